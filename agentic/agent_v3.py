@@ -4,13 +4,29 @@ import duckdb
 import logging
 import os
 import json
+import hashlib
+import argparse
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import re
 from typing import List, Dict, Any, Optional
 import time
 
 # Import the tool function
-from tools import get_table_columns
+from tools import catalog, get_columns_for_tables, get_table_columns
+from sql_classifier import classify_sql
+from sql_lineage import derive_lineage
+
+# Run helpers shared with the extractor in src/main/llm
+LLM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "main", "llm"))
+if LLM_DIR not in sys.path:
+    sys.path.append(LLM_DIR)
+from call_timing import open_span_recorder
+from llm_scheduler import TokenBucketLimiter, estimate_tokens, is_rate_limit_error
+from run_journal import RunJournal
 start = time.time()
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -37,6 +53,21 @@ genai.configure(api_key=API_KEY)
 
 # Define the Gemini model to use
 MODEL_NAME = "gemini-1.5-flash-latest" # Or "gemini-1.5-pro-latest"
+MAX_CONCURRENT_FILES = 4 # SQL files in flight at once; Stage 1 of later files overlaps Stage 3 of earlier ones
+REQUESTS_PER_MINUTE = 15 # Shared by the identifier and analysis calls of all files (free tier quota)
+TOKENS_PER_MINUTE = 1_000_000 # Free tier quota, prompt + answer tokens
+MAX_RATE_LIMIT_RETRIES = 5 # A 429 pauses the shared limiter with exponential backoff, then the call is retried
+RATE_LIMIT_BASE_BACKOFF = 2.0
+RATE_LIMIT_MAX_BACKOFF = 60.0
+USE_LOCAL_CLASSIFIER = True # Stage 1 from DuckDB's SQL parser (sql_classifier.py); the LLM only if it cannot tell
+USE_LOCAL_LINEAGE = True # Scripts whose lineage the SQL parser traces exactly (sql_lineage.py) skip Stages 1-3
+
+def create_model(stage: str):
+    """
+    The model client for a stage ("identifier" or "analysis"). Replace this function to
+    run offline, e.g. with src/main/llm/model_client.ReplayModel (see benchmark.py there).
+    """
+    return genai.GenerativeModel(MODEL_NAME)
 
 # --- Tool Definition (Only needed for context gathering stage) ---
 # No tools needed directly by the analyzer agents in this model if context is pre-fetched
@@ -84,18 +115,76 @@ def load_prompt(file_path: str, **kwargs) -> str:
         logging.error(f"Error loading/formatting prompt file {file_path}: {e}", exc_info=True)
         raise
 
+# --- Call Timing ---
+# Spans in the format of src/main/llm/call_timing.py, which also prints the
+# throughput report: python src/main/llm/call_timing.py agentic/agent_spans.jsonl
+SPANS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_spans.jsonl")
+span_recorder = open_span_recorder(SPANS_PATH, "agent_v3")
+
+def timed_generate_content(model, prompt: str, label: str, limiter: Optional[TokenBucketLimiter] = None, **kwargs):
+    """
+    model.generate_content(prompt, **kwargs) once the shared limiter (llm_scheduler's
+    requests/min and tokens/min buckets; None: no limit) allows it, recorded as an
+    llm_call span with its token usage (and a sleep span for the wait). Rate-limit
+    errors pause the limiter for every caller and the call is retried.
+    """
+    estimated_tokens = estimate_tokens(prompt)
+    attempt = 0
+    while True:
+        wait_start = time.time()
+        if limiter is not None and limiter.acquire(estimated_tokens):
+            span_recorder.record("sleep", wait_start, time.time(), reason="rate_limit", label=label)
+        call_start = time.time()
+        try:
+            response = model.generate_content(prompt, **kwargs)
+        except Exception as e:
+            span_recorder.record("llm_call", call_start, time.time(), status="error", label=label, error=f"{type(e).__name__}: {e}")
+            if not is_rate_limit_error(e) or attempt >= MAX_RATE_LIMIT_RETRIES:
+                raise
+            attempt += 1
+            delay = min(RATE_LIMIT_MAX_BACKOFF, RATE_LIMIT_BASE_BACKOFF * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+            logging.warning(f"Rate limited, backing off {delay:.1f}s (retry {attempt}/{MAX_RATE_LIMIT_RETRIES}): {e}")
+            if limiter is not None:
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            continue
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        answer_tokens = getattr(usage, "candidates_token_count", None)
+        if limiter is not None and prompt_tokens is not None:
+            limiter.record_usage(estimated_tokens, prompt_tokens + (answer_tokens or 0))
+        span_recorder.record("llm_call", call_start, time.time(), label=label, retries=attempt,
+                             prompt_tokens=prompt_tokens, answer_tokens=answer_tokens)
+        return response
+
 # --- Stage 1: Identifier Agent (V2) ---
-def identify_sql_and_context_needs(sql_content: str) -> Optional[Dict[str, Any]]:
+def identify_sql_and_context_needs(sql_content: str, limiter: Optional[TokenBucketLimiter] = None) -> Optional[Dict[str, Any]]:
     """
     Uses Gemini to identify SQL type, context need, reason, and specific tables.
+    With USE_LOCAL_CLASSIFIER the SQL parser answers first and Gemini is only asked
+    about scripts it cannot classify with certainty.
     """
     logging.info("Stage 1: Identifying SQL type and specific context needs...")
+    if USE_LOCAL_CLASSIFIER:
+        try:
+            result = classify_sql(sql_content)
+        except Exception as e:
+            logging.warning(f"Local SQL classifier failed, asking the identifier agent: {e}")
+            result = None
+        if result is not None:
+            logging.info(f"Stage 1 Result (local parser, no LLM call): {result}")
+            return result
+        logging.info("Local SQL classifier cannot tell, asking the identifier agent")
     try:
         prompt = load_prompt(IDENTIFIER_PROMPT_FILE, sql_content=sql_content)
-        identifier_model = genai.GenerativeModel(MODEL_NAME)
+        identifier_model = create_model("identifier")
         # Increased retries slightly for potentially more complex identification
-        response = identifier_model.generate_content(
+        response = timed_generate_content(
+            identifier_model,
             prompt,
+            "identifier",
+            limiter,
             generation_config=genai.types.GenerationConfig(temperature=0.1) # Lower temp for structured output
         )
 
@@ -137,45 +226,72 @@ def identify_sql_and_context_needs(sql_content: str) -> Optional[Dict[str, Any]]
         return None
 
 # --- Stage 2: Context Gathering ---
+_catalog_warmup = None
+_catalog_warmup_lock = threading.Lock()
+
+def load_column_index():
+    try:
+        catalog.column_index()
+    except Exception as e:
+        logging.warning(f"Could not preload the column index, Stage 2 will load it: {e}")
+
+def warm_up_catalog():
+    """
+    Starts loading the DuckDB column index in the background, once per process, so it
+    is ready by the time Stage 1 has answered instead of adding to Stage 2.
+    """
+    global _catalog_warmup
+    with _catalog_warmup_lock:
+        if _catalog_warmup is None:
+            _catalog_warmup = threading.Thread(target=load_column_index, name="catalog-warmup", daemon=True)
+            _catalog_warmup.start()
+
 def gather_required_context(tables_to_query: List[str]) -> Dict[str, Any]:
     """
-    Calls the get_table_columns tool for each table identified in Stage 1.
+    Looks up the columns of every table identified in Stage 1 in one batch against the
+    shared column index (tools.get_columns_for_tables), so the time taken does not grow
+    with the number of tables. Tables that cannot be resolved are listed in "errors".
     """
     if not tables_to_query:
         logging.info("Stage 2: No tables require context gathering.")
         return {"schemas": {}, "errors": {}}
 
     logging.info(f"Stage 2: Gathering context for tables: {tables_to_query}")
-    gathered_context: Dict[str, List[str]] = {}
-    errors: Dict[str, str] = {}
-    tool_function = available_tools.get("get_table_columns")
-
-    if not tool_function:
-        logging.error("Tool 'get_table_columns' not found in available_tools.")
-        return {"schemas": {}, "errors": {"general": "Tool function not configured."}}
-
-    for table_name in tables_to_query:
-        try:
-            logging.info(f"Executing tool get_table_columns(table_name='{table_name}')")
-            columns = tool_function(table_name=table_name)
-            if columns: # Only add if columns were found
-                 gathered_context[table_name] = columns
-                 logging.info(f"Successfully retrieved columns for {table_name}")
-            else:
-                 logging.warning(f"Tool returned no columns for {table_name}. It might not exist or be accessible.")
-                 errors[table_name] = "No columns found (table might not exist or is inaccessible)"
-        except Exception as e:
-            logging.error(f"Error executing tool get_table_columns for '{table_name}': {e}", exc_info=True)
-            errors[table_name] = str(e)
+    try:
+        context = get_columns_for_tables(tables_to_query)
+    except Exception as e:
+        logging.error(f"Error gathering columns for {tables_to_query}: {e}", exc_info=True)
+        return {"schemas": {}, "errors": {table_name: str(e) for table_name in tables_to_query}}
+    for table_name, error in context["errors"].items():
+        logging.warning(f"No context for {table_name}: {error}")
 
     logging.info("Stage 2: Context gathering complete.")
-    return {"schemas": gathered_context, "errors": errors}
+    return context
+
+# --- Fast path: Lineage from the SQL parser ---
+def derive_local_lineage(sql_content: str) -> Optional[Dict[str, Any]]:
+    """
+    The lineage of a script traced from DuckDB's AST, with table columns from the shared
+    catalog, if every target column was traced with certainty; otherwise None and the
+    script goes through Stages 1-3.
+    """
+    try:
+        result = derive_lineage(sql_content, get_columns_for_tables)
+    except Exception as e:
+        logging.warning(f"Local lineage engine failed, asking the agents: {e}")
+        return None
+    if result is None or result["confidence"] != "high":
+        logging.info(f"Local lineage engine is not certain ({(result or {}).get('notes') or 'see column notes'}), asking the agents")
+        return None
+    logging.info(f"Lineage of {len(result['lineage'])} columns from the local SQL parser, no LLM call")
+    return result
 
 # --- Stage 3: Specialized Analysis Agent (with Context) ---
 def run_specialized_analysis_with_context(
     sql_content: str,
     prompt_file: str,
-    gathered_context: Dict[str, Any] # Expects {"schemas": {...}, "errors": {...}}
+    gathered_context: Dict[str, Any], # Expects {"schemas": {...}, "errors": {...}}
+    limiter: Optional[TokenBucketLimiter] = None
     ) -> Dict[str, Any]:
     """
     Runs the detailed analysis using the appropriate prompt, injecting pre-fetched context.
@@ -201,11 +317,14 @@ def run_specialized_analysis_with_context(
 
     try:
         # Initialize model - NO TOOLS needed for this stage in this design
-        analysis_model = genai.GenerativeModel(MODEL_NAME)
+        analysis_model = create_model("analysis")
         # Use generate_content as we don't expect function calls back
         logging.info("Sending analysis prompt with context to Gemini...")
-        response = analysis_model.generate_content(
+        response = timed_generate_content(
+            analysis_model,
             prompt,
+            "analysis",
+            limiter,
              generation_config=genai.types.GenerationConfig(temperature=0.1) # Lower temp for structured JSON
         )
         logging.debug("Received final analysis response.")
@@ -275,10 +394,12 @@ def run_specialized_analysis_with_context(
 
 
 # --- Main Orchestrator Logic (V2) ---
-def process_sql_file_orchestrated(sql_file_path: str) -> dict:
+def process_sql_file_orchestrated(sql_file_path: str, limiter: Optional[TokenBucketLimiter] = None) -> dict:
     """
     Orchestrates the multi-stage process (V2) for analyzing a SQL file.
-    Identify -> Gather Context -> Analyze with Context
+    Identify -> Gather Context -> Analyze with Context, unless the local lineage
+    engine traces the script by itself. The Gemini calls of both stages go through
+    limiter (shared by all files of a run; None: no limit).
     """
     logging.info(f"--- Starting Orchestrated Processing V2 for: {sql_file_path} ---")
     final_result: Dict[str, Any] = {}
@@ -297,8 +418,13 @@ def process_sql_file_orchestrated(sql_file_path: str) -> dict:
         logging.error(f"Error reading SQL file {sql_file_path}: {e}", exc_info=True)
         return {"error": f"Failed to read SQL file: {e}", "file_path": sql_file_path}
 
-    # 1. Identify Type and Context Needs
-    identification_result = identify_sql_and_context_needs(sql_content)
+    # 1. Identify Type and Context Needs (the column index loads meanwhile for Stage 2)
+    warm_up_catalog()
+    if USE_LOCAL_LINEAGE:
+        local_lineage = derive_local_lineage(sql_content)
+        if local_lineage is not None:
+            return local_lineage
+    identification_result = identify_sql_and_context_needs(sql_content, limiter)
     if not identification_result:
         return {"error": "Stage 1 Failed: Could not identify SQL type or context needs."}
     final_result["identification"] = identification_result # Store stage 1 result
@@ -341,7 +467,8 @@ def process_sql_file_orchestrated(sql_file_path: str) -> dict:
     analysis_result = run_specialized_analysis_with_context(
         sql_content,
         target_analyzer_prompt_file,
-        gathered_context
+        gathered_context,
+        limiter
     )
     final_result["analysis"] = analysis_result # Store stage 3 result
 
@@ -351,10 +478,10 @@ def process_sql_file_orchestrated(sql_file_path: str) -> dict:
     return analysis_result # Or just return the final analysis JSON
 
 
-def run_orchestrator(sql_file_path: str):
+def run_orchestrator(sql_file_path: str, limiter: Optional[TokenBucketLimiter] = None):
     """Run the orchestrated process and return the result."""
     print(f"\n--- Running Orchestrator on ({sql_file_path}) ---")
-    return process_sql_file_orchestrated(sql_file_path)
+    return process_sql_file_orchestrated(sql_file_path, limiter)
 
 def save_result_to_json(result: dict, sql_file_path: str, output_dir: str = "Agent_LLM_JSONs"):
     """
@@ -379,22 +506,97 @@ def save_result_to_json(result: dict, sql_file_path: str, output_dir: str = "Age
         json.dump(result, f, indent=2)
     
     print(f"\n✅ Result saved to: {output_path}")
-
-def process_all_sql_files(sql_dir: str, output_dir: str):
-    for filename in os.listdir(sql_dir):
-        time.sleep(5)
-        print(f"Sleeping for 5 seconds...\n")
+    return output_path
+
+# --- Checkpoint Journal ---
+# Entries of run_journal.RunJournal, under one "template" for the whole orchestrator
+JOURNAL_TEMPLATE = "agent_v3"
+
+def orchestrator_sha256() -> str:
+    """Hash of the prompt files, so a resumed run redoes the files journaled with other prompts."""
+    digest = hashlib.sha256(MODEL_NAME.encode("utf-8"))
+    for prompt_file in (IDENTIFIER_PROMPT_FILE, COPY_ANALYZER_PROMPT_FILE):
+        if os.path.exists(prompt_file):
+            with open(prompt_file, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+def process_sql_file(sql_file_path: str, sql_sha256: str, output_dir: str, journal: RunJournal, template_sha256: str,
+                     limiter: Optional[TokenBucketLimiter] = None) -> bool:
+    """Runs the orchestrator on one file, saves its result and journals it if it succeeded."""
+    filename = os.path.basename(sql_file_path)
+    logging.info(f"Working on file: {filename}")
+    result = run_orchestrator(sql_file_path, limiter)
+    output_path = save_result_to_json(result, sql_file_path, output_dir)
+    if "error" in result: # Failed files are not checkpointed, so a resumed run retries them
+        return False
+    journal.record(JOURNAL_TEMPLATE, filename, template_sha256, sql_sha256, output_path,
+                   {"derived_by": result.get("derived_by", "agents")})
+    return True
+
+def process_all_sql_files(sql_dir: str, output_dir: str, resume: bool = False,
+                          workers: int = MAX_CONCURRENT_FILES, requests_per_minute: Optional[float] = REQUESTS_PER_MINUTE,
+                          tokens_per_minute: float = TOKENS_PER_MINUTE):
+    """
+    Analyses every .sql file of sql_dir into output_dir, `workers` files at a time.
+    All Gemini calls of both stages share one llm_scheduler.TokenBucketLimiter of
+    requests_per_minute and tokens_per_minute (0 or None: no limit), so while
+    earlier files wait for their analysis, later files already get identified. Each
+    successful result is appended to output_dir/_journal.jsonl (run_journal.RunJournal)
+    with the SQL file's and the prompts' sha256; with resume, files journaled with
+    unchanged hashes and an existing result file are skipped.
+    """
+    limiter = TokenBucketLimiter(requests_per_minute or 0, tokens_per_minute)
+    span_recorder.new_run()
+    os.makedirs(output_dir, exist_ok=True)
+    journal = RunJournal(output_dir)
+    template_sha256 = orchestrator_sha256()
+    skipped = 0
+    pending = []
+    run_start = time.time()
+    for filename in sorted(os.listdir(sql_dir)):
         if filename.endswith(".sql"):
             sql_file_path = os.path.join(sql_dir, filename)
-            logging.info(f"Working on file: {filename}")
-            result = run_orchestrator(sql_file_path)
-            save_result_to_json(result, sql_file_path, output_dir)
+            with open(sql_file_path, "rb") as f:
+                sql_sha256 = hashlib.sha256(f.read()).hexdigest()
+            entry = journal.completed(JOURNAL_TEMPLATE, filename, template_sha256, sql_sha256) if resume else None
+            if entry:
+                logging.info(f"Skipping {filename}, already done: {entry['output_path']}")
+                skipped += 1
+                continue
+            pending.append((sql_file_path, sql_sha256))
+
+    logging.info(f"Processing {len(pending)} SQL files with {workers} workers ({requests_per_minute or 'unlimited'} requests/min)")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="orchestrator") as executor:
+        futures = {executor.submit(process_sql_file, sql_file_path, sql_sha256, output_dir, journal, template_sha256, limiter): sql_file_path
+                   for sql_file_path, sql_sha256 in pending}
+        for future in as_completed(futures):
+            try:
+                if not future.result():
+                    failed += 1
+            except Exception as e:
+                failed += 1
+                logging.error(f"Error processing {futures[future]}: {e}", exc_info=True)
+    journal.close()
+    span_recorder.record("run", run_start, time.time(), scripts=len(pending), skipped=skipped, failed=failed)
+    logging.info(f"Processed {len(pending)} SQL files, {failed} failed")
+    if resume:
+        logging.info(f"Resumed run: skipped {skipped} SQL files completed earlier")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the orchestrated lineage agent over a directory of SQL files.")
+    parser.add_argument("--resume", action="store_true", help="skip SQL files the checkpoint journal lists as done")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_FILES, help="SQL files processed at once")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Gemini requests per minute over both stages (0: no limit)")
+    parser.add_argument("--tpm", type=float, default=TOKENS_PER_MINUTE, help="Gemini tokens per minute over both stages (0: no limit)")
+    args = parser.parse_args()
+
     sql_dir = r"C:\lopu-kg-test\project\src\main\sql_for_pipelines"
     output_dir = r"C:\lopu-kg-test\project\agentic\Agent_LLM_JSONs"
 
-    process_all_sql_files(sql_dir, output_dir)
+    process_all_sql_files(sql_dir, output_dir, resume=args.resume, workers=args.workers, requests_per_minute=args.rpm,
+                          tokens_per_minute=args.tpm)
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     end = time.time()
@@ -0,0 +1,249 @@
+import json
+import logging
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import duckdb
+
+# Stage 1 without the LLM: statement type and context needs of a SQL script from DuckDB's
+# own parser. extract_statements() gives the statement type, tokenize() the target table,
+# json_serialize_sql() the AST of the SELECT part. Anything it cannot read with certainty
+# (several statements, CREATE without AS, COPY ... TO, INSERT ... ON CONFLICT, parse
+# errors) is left to the LLM.
+
+class Token(NamedTuple):
+    text: str
+    kind: str # identifier, keyword, operator, numeric_const, string_const
+    start: int
+
+class StatementParts(NamedTuple):
+    statement_type: str # SELECT, INSERT, COPY or CREATE_TABLE_AS
+    target_table: Optional[str]
+    target_columns: Optional[List[str]] # Explicit column list of INSERT / COPY, None if implicit
+    query: Optional[str] # The SELECT part, None for COPY and INSERT ... VALUES
+
+_local = threading.local()
+
+def connection():
+    """This thread's in-memory DuckDB connection, used only to parse."""
+    if not hasattr(_local, "connection"):
+        _local.connection = duckdb.connect()
+    return _local.connection
+
+def _token_text(sql: str, start: int, end: int) -> str:
+    text = sql[start:end]
+    if text[:1] in ('"', "'"): # Quoted identifier or string: up to the closing quote
+        quote = text[0]
+        position = 1
+        while True:
+            position = text.find(quote, position)
+            if position == -1:
+                return text.strip()
+            if text[position + 1:position + 2] != quote:
+                return text[:position + 1]
+            position += 2
+    for separator in ("--", "/*"): # Comments are not tokens but sit in the gap to the next one
+        if separator in text[1:]:
+            text = text[:text.index(separator, 1)]
+    return text.split()[0] if text.strip() else ""
+
+def tokenize(sql: str) -> List[Token]:
+    positions = duckdb.tokenize(sql)
+    tokens = []
+    for i, (start, kind) in enumerate(positions):
+        end = positions[i + 1][0] if i + 1 < len(positions) else len(sql)
+        tokens.append(Token(_token_text(sql, start, end), kind.name, start))
+    return tokens
+
+def unquote(identifier: str) -> str:
+    if len(identifier) > 1 and identifier[0] == identifier[-1] == '"':
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+def _word(token: Token) -> str:
+    return token.text.upper() if token.kind == "keyword" else ""
+
+def _read_name(tokens: List[Token], i: int):
+    """A dotted name starting at tokens[i]. Returns (name, index after it) or (None, i)."""
+    parts = []
+    while i < len(tokens) and tokens[i].kind in ("identifier", "keyword"):
+        parts.append(unquote(tokens[i].text))
+        if i + 1 < len(tokens) and tokens[i + 1].text == "." and i + 2 < len(tokens):
+            i += 2
+            continue
+        return ".".join(parts), i + 1
+    return None, i
+
+def _read_column_list(tokens: List[Token], i: int):
+    """An optional (col, col, ...) at tokens[i]. Returns (columns or None, index after it)."""
+    if i >= len(tokens) or tokens[i].text != "(":
+        return None, i
+    columns = []
+    i += 1
+    while i < len(tokens) and tokens[i].text != ")":
+        if tokens[i].kind in ("identifier", "keyword"):
+            columns.append(unquote(tokens[i].text))
+        elif tokens[i].text != ",":
+            return None, -1 # Not a plain column list
+        i += 1
+    return columns, i + 1
+
+def split_statement(sql: str) -> Optional[StatementParts]:
+    """The statement type, target table, explicit target columns and SELECT part of a single-statement script, or None."""
+    try:
+        statements = duckdb.extract_statements(sql)
+        tokens = tokenize(sql)
+    except duckdb.Error as e:
+        logging.info(f"Local SQL parser cannot read the script: {e}")
+        return None
+    if len(statements) != 1 or not tokens:
+        return None
+    statement_type = statements[0].type.name
+    if statement_type == "SELECT":
+        return StatementParts("SELECT", None, None, sql)
+
+    i = 1
+    if statement_type == "INSERT":
+        while i < len(tokens) and _word(tokens[i]) in ("OR", "REPLACE", "IGNORE"):
+            i += 1
+        if i >= len(tokens) or _word(tokens[i]) != "INTO":
+            return None
+        target, i = _read_name(tokens, i + 1)
+        columns, i = _read_column_list(tokens, i)
+        if target is None or i < 0 or i >= len(tokens):
+            return None
+        if _word(tokens[i]) == "VALUES":
+            return StatementParts("INSERT", target, columns, None)
+        if _word(tokens[i]) not in ("SELECT", "WITH", "FROM") and tokens[i].text != "(":
+            return None # BY NAME, DEFAULT VALUES, ...
+        return StatementParts("INSERT", target, columns, sql[tokens[i].start:])
+
+    if statement_type == "COPY":
+        target, i = _read_name(tokens, 1)
+        columns, i = _read_column_list(tokens, i)
+        if target is None or i < 0 or i >= len(tokens) or _word(tokens[i]) != "FROM":
+            return None # COPY ... TO is an export, not a load
+        return StatementParts("COPY", target, columns, None)
+
+    if statement_type == "CREATE":
+        while i < len(tokens) and _word(tokens[i]) in ("OR", "REPLACE", "TEMP", "TEMPORARY"):
+            i += 1
+        if i >= len(tokens) or _word(tokens[i]) != "TABLE":
+            return None
+        i += 1
+        if [_word(token) for token in tokens[i:i + 3]] == ["IF", "NOT", "EXISTS"]:
+            i += 3
+        target, i = _read_name(tokens, i)
+        if target is None or i + 1 >= len(tokens) or _word(tokens[i]) != "AS":
+            return None
+        return StatementParts("CREATE_TABLE_AS", target, None, sql[tokens[i + 1].start:])
+    return None
+
+def parse_query(query: str) -> Optional[Dict[str, Any]]:
+    """The DuckDB AST (json_serialize_sql) of a SELECT, or None if it cannot be serialized."""
+    serialized = connection().execute("SELECT json_serialize_sql(?)", [query.strip().rstrip(";")]).fetchone()[0]
+    ast = json.loads(serialized)
+    if ast.get("error"):
+        logging.info(f"Local SQL parser cannot serialize the query: {ast.get('error_message')}")
+        return None
+    return ast
+
+def walk(node):
+    """Every dict in an AST, depth first."""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from walk(value)
+
+def cte_names(ast: Dict[str, Any]) -> set:
+    return {entry["key"].lower() for node in walk(ast) if "cte_map" in node for entry in node["cte_map"]["map"]}
+
+def table_name(node: Dict[str, Any]) -> str:
+    return ".".join(part for part in (node["catalog_name"], node["schema_name"], node["table_name"]) if part)
+
+def is_cte_reference(node: Dict[str, Any], ctes: set) -> bool:
+    return not node["schema_name"] and not node["catalog_name"] and node["table_name"].lower() in ctes
+
+def base_tables(ast: Dict[str, Any]) -> List[str]:
+    """Database tables the query reads, in order of appearance, without CTE references."""
+    ctes = cte_names(ast)
+    tables = []
+    for node in walk(ast):
+        if node.get("type") == "BASE_TABLE" and not is_cte_reference(node, ctes) and table_name(node) not in tables:
+            tables.append(table_name(node))
+    return tables
+
+def from_items(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The tables, table functions and subqueries of a FROM clause, through its joins."""
+    if node is None or node.get("type") == "EMPTY":
+        return []
+    if node.get("type") == "JOIN":
+        return from_items(node["left"]) + from_items(node["right"])
+    return [node]
+
+def star_tables(ast: Dict[str, Any]) -> List[str]:
+    """
+    Database tables whose columns a * (or alias.*) expands to. Stars over CTEs,
+    subqueries and table functions such as read_csv are left out: their columns are
+    spelled out in the script itself, the catalog cannot add anything.
+    """
+    ctes = cte_names(ast)
+    tables = []
+    for node in walk(ast):
+        if node.get("type") != "SELECT_NODE":
+            continue
+        stars = [expression for expression in walk(node["select_list"]) if expression.get("class") == "STAR"]
+        if not stars:
+            continue
+        items = from_items(node["from_table"])
+        for star in stars:
+            relation = star["relation_name"].lower()
+            for item in items:
+                if relation and relation not in (item.get("alias", "").lower(), item.get("table_name", "").lower()):
+                    continue
+                if item["type"] == "BASE_TABLE" and not is_cte_reference(item, ctes) and table_name(item) not in tables:
+                    tables.append(table_name(item))
+    return tables
+
+def classify_sql(sql_content: str) -> Optional[Dict[str, Any]]:
+    """
+    The identifier agent's answer worked out locally: statement_type, context_needed
+    and, if context is needed, reason and tables_requiring_context (COPY and INSERT
+    targets without a column list, the tables of a SELECT *). Returns None when the
+    script is not certain to be read right, so the caller asks the LLM instead.
+    """
+    parts = split_statement(sql_content)
+    if parts is None:
+        return None
+    reasons: List[str] = []
+    tables: List[str] = []
+    if parts.statement_type in ("COPY", "INSERT") and parts.target_columns is None:
+        reasons.append("COPY target" if parts.statement_type == "COPY" else "Implicit INSERT columns")
+        tables.append(parts.target_table)
+    if parts.query is not None:
+        ast = parse_query(parts.query)
+        if ast is None:
+            return None
+        expanded = star_tables(ast)
+        if expanded:
+            reasons.append("SELECT *")
+            tables.extend(table for table in expanded if table not in tables)
+
+    result: Dict[str, Any] = {"statement_type": parts.statement_type, "context_needed": bool(tables)}
+    if tables:
+        result["reason"] = ", ".join(reasons)
+        result["tables_requiring_context"] = tables
+    result["classified_by"] = "local_parser"
+    return result
+
+if __name__ == "__main__":
+    import os
+    import sys
+    sql_dir = sys.argv[1] if len(sys.argv) > 1 else r"C:\lopu-kg-test\project\src\main\sql_for_pipelines"
+    for filename in sorted(os.listdir(sql_dir)):
+        if filename.endswith(".sql"):
+            with open(os.path.join(sql_dir, filename), "r", encoding="utf-8") as f:
+                print(f"{filename}: {classify_sql(f.read()) or 'left to the LLM'}")
@@ -1,6 +1,7 @@
 import duckdb
 import logging
-from typing import List
+import threading
+from typing import Any, Dict, List
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -8,9 +9,100 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Define the database file path (make sure this matches setup_duckdb.py)
 DB_FILE = "C:\lopu-kg-test\project\initial_db.duckdb"
 
+# All columns of the database in one scan, in table order
+COLUMNS_QUERY = """
+    SELECT database_name, schema_name, table_name, column_name
+    FROM duckdb_columns()
+    WHERE NOT internal
+    ORDER BY database_name, schema_name, table_name, column_index
+"""
+
+def normalize_table_name(table_name: str) -> str:
+    """Lower case without identifier quotes: DuckDB resolves table names case-insensitively."""
+    return ".".join(part.strip().strip('"') for part in table_name.strip().split(".")).lower()
+
+class CatalogService:
+    """
+    Shared read-only access to the DuckDB catalog for the agent tools. The database
+    file is opened once and every thread gets its own cursor on that connection, so
+    concurrent agents neither re-open the file nor share a cursor. The columns of all
+    tables are read once with duckdb_columns() into an index that answers lookups
+    without a query; names it does not know fall back to PRAGMA table_info.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._connection = None
+        self._index = None
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._local = threading.local()
+
+    def cursor(self):
+        """This thread's cursor on the shared connection."""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            with self._lock:
+                if self._connection is None:
+                    self._connection = duckdb.connect(database=self.db_file, read_only=True)
+                    logging.info(f"Opened DuckDB catalog {self.db_file} (read-only)")
+                cursor = self._connection.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    def column_index(self) -> Dict[str, List[str]]:
+        """
+        {table name: columns} for every table and view, loaded on first use. Each table
+        is under database.schema.table and schema.table, tables of the main schema also
+        under their bare name; names are normalized with normalize_table_name().
+        """
+        with self._index_lock: # Threads asking during the load wait for it instead of loading again
+            if self._index is None:
+                rows = self.cursor().execute(COLUMNS_QUERY).fetchall()
+                index: Dict[str, List[str]] = {}
+                for database_name, schema_name, table_name, column_name in rows:
+                    names = [f"{database_name}.{schema_name}.{table_name}", f"{schema_name}.{table_name}"]
+                    if schema_name == "main":
+                        names.append(table_name)
+                    for name in names:
+                        index.setdefault(name.lower(), []).append(column_name)
+                self._index = index
+                logging.info(f"Loaded the column index of {self.db_file}: {len(rows)} columns")
+            return self._index
+
+    def table_columns(self, table_name: str) -> List[str]:
+        """
+        Columns of a table in order. Raises duckdb.CatalogException if the table does
+        not exist, like PRAGMA table_info.
+        """
+        columns = self.column_index().get(normalize_table_name(table_name))
+        if columns is not None:
+            return list(columns)
+        # Not in the index: let DuckDB resolve the name (search path, unusual quoting)
+        query = f"PRAGMA table_info('{table_name}');"
+        logging.info(f"Executing query: {query}")
+        return [row[1] for row in self.cursor().execute(query).fetchall()]
+
+    def refresh(self) -> None:
+        """Forgets the column index, e.g. after the database file was rebuilt."""
+        with self._index_lock:
+            self._index = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._index = None
+            self._local = threading.local()
+
+# Shared by every agent and orchestrator worker of this process
+catalog = CatalogService(DB_FILE)
+
 def get_table_columns(table_name: str) -> List[str]:
     """
     Retrieves the list of column names for a given table from the DuckDB database.
+    Served from the shared catalog's column index; the database is not re-opened.
 
     Args:
         table_name: The fully qualified name of the table (e.g., 'schema_name.table_name').
@@ -22,22 +114,8 @@ def get_table_columns(table_name: str) -> List[str]:
     logging.info(f"Attempting to get columns for table: {table_name}")
     columns = []
     try:
-        # Connect to DuckDB in read-only mode
-        con = duckdb.connect(database=DB_FILE, read_only=True)
-
-        # Use PRAGMA table_info to get schema information
-        # Query needs to handle potential SQL injection if table_name were directly formatted,
-        # but PRAGMA doesn't support parameters directly. DuckDB's Python client is generally safe.
-        # However, validating table_name format beforehand is good practice if input is less trusted.
-        # For internal agent use, this is generally okay.
-        query = f"PRAGMA table_info('{table_name}');"
-        logging.info(f"Executing query: {query}")
-
-        result = con.execute(query).fetchall()
-
-        # The column name is typically in the second position (index 1) of the result tuple
-        if result:
-            columns = [row[1] for row in result]
+        columns = catalog.table_columns(table_name)
+        if columns:
             logging.info(f"Found columns for '{table_name}': {columns}")
         else:
             logging.warning(f"No columns found for table '{table_name}'. It might not exist or schema is inaccessible.")
@@ -54,13 +132,41 @@ def get_table_columns(table_name: str) -> List[str]:
         logging.error(f"An unexpected error occurred in get_table_columns for '{table_name}': {e}", exc_info=True)
         # Return empty list on unexpected errors
         columns = []
-    finally:
-        if 'con' in locals() and con:
-            con.close()
-            logging.debug("DuckDB connection closed.")
 
     return columns
 
+def get_columns_for_tables(table_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Batched get_table_columns: every table is resolved against the column index, which
+    takes one catalog query the first time and none after. Names the index does not
+    know are looked up one by one as in get_table_columns.
+
+    Args:
+        table_names: Fully qualified table names.
+
+    Returns:
+        {"schemas": {table_name: columns}, "errors": {table_name: message}}; tables
+        that were found are returned even if others were not.
+    """
+    schemas: Dict[str, List[str]] = {}
+    errors: Dict[str, str] = {}
+    try:
+        index = catalog.column_index()
+    except duckdb.Error as e:
+        logging.error(f"DuckDB Error loading the column index of {catalog.db_file}: {e}")
+        return {"schemas": {}, "errors": {table_name: f"Catalog unavailable: {e}" for table_name in table_names}}
+
+    for table_name in table_names:
+        columns = index.get(normalize_table_name(table_name))
+        if columns is None:
+            columns = get_table_columns(table_name)
+        if columns:
+            schemas[table_name] = list(columns)
+        else:
+            errors[table_name] = "No columns found (table might not exist or is inaccessible)"
+    logging.info(f"Resolved columns for {len(schemas)} of {len(table_names)} tables")
+    return {"schemas": schemas, "errors": errors}
+
 if __name__ == "__main__":
     print("Testing get_table_columns...")
     get_table_columns("temp_propect")
@@ -0,0 +1,127 @@
+import os
+import logging
+import threading
+import duckdb
+from typing import Optional, List, Tuple, Dict
+
+# One query for the whole catalog: columns joined with their table comment and
+# primary key membership, in column order.
+CATALOG_QUERY = """
+    WITH pk AS (
+        SELECT database_name, schema_name, table_name,
+               unnest(constraint_column_names) AS column_name
+        FROM duckdb_constraints()
+        WHERE constraint_type = 'PRIMARY KEY'
+    )
+    SELECT c.schema_name,
+           c.table_name,
+           c.column_name,
+           c.data_type,
+           c.comment AS column_comment,
+           t.comment AS table_comment,
+           pk.column_name IS NOT NULL AS is_pk
+    FROM duckdb_columns() c
+    LEFT JOIN duckdb_tables() t
+           ON t.database_name = c.database_name
+          AND t.schema_name = c.schema_name
+          AND t.table_name = c.table_name
+    LEFT JOIN pk
+           ON pk.database_name = c.database_name
+          AND pk.schema_name = c.schema_name
+          AND pk.table_name = c.table_name
+          AND pk.column_name = c.column_name
+    WHERE c.database_name = current_database()
+    ORDER BY c.schema_name, c.table_name, c.column_index;
+"""
+
+SchemaFields = List[Tuple[str, str, Optional[str], Optional[str]]]
+
+
+class DuckDBCatalog:
+    """
+    In-memory snapshot of the DuckDB catalog, keyed by 'schema.table' (case-insensitive,
+    like DuckDB identifiers). Serves the same (fields, table_comment) tuples as
+    get_table_schema_duckdb() without a query per table.
+
+    If db_path is given, the snapshot is reloaded whenever the DuckDB file's mtime
+    changes. The reload ATTACHes the file to a short-lived in-memory connection:
+    duckdb.connect() on a path that db_conn still holds open would return the cached,
+    already-open database and re-read the old snapshot.
+    """
+
+    def __init__(self, db_conn: Optional[duckdb.DuckDBPyConnection], db_path: Optional[str] = None, check_mtime: bool = True):
+        self.db_conn = db_conn
+        self.db_path = db_path
+        self.check_mtime = check_mtime and db_path is not None
+        self._tables: Dict[str, Tuple[SchemaFields, Optional[str]]] = {}
+        self._mtime: Optional[float] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.db_path)
+        except (OSError, TypeError):
+            return None
+
+    def _read_file_catalog(self) -> list:
+        """Catalog rows of the file as it is on disk now, bypassing DuckDB's instance cache."""
+        conn = duckdb.connect()
+        try:
+            escaped_path = self.db_path.replace("'", "''")
+            conn.execute(f"ATTACH '{escaped_path}' AS catalog_snapshot (READ_ONLY)")
+            conn.execute("USE catalog_snapshot")
+            return conn.execute(CATALOG_QUERY).fetchall()
+        finally:
+            conn.close()
+
+    def _load_locked(self, reconnect: bool) -> int:
+        mtime = self._file_mtime()
+        if reconnect or self.db_conn is None:
+            rows = self._read_file_catalog()
+        else:
+            rows = self.db_conn.execute(CATALOG_QUERY).fetchall()
+
+        tables: Dict[str, Tuple[SchemaFields, Optional[str]]] = {}
+        for schema_name, table_name, column_name, data_type, column_comment, table_comment, is_pk in rows:
+            key = f"{schema_name}.{table_name}".lower()
+            fields, _ = tables.setdefault(key, ([], table_comment))
+            # Same description format as PRAGMA table_info based lookups
+            fields.append((column_name, data_type, f"Primary Key: {is_pk}" if is_pk else None, column_comment))
+
+        self._tables = tables
+        self._mtime = mtime
+        self._loaded = True
+        logging.info(f"Loaded DuckDB catalog snapshot: {len(tables)} tables, {len(rows)} columns.")
+        return len(tables)
+
+    def load(self, reconnect: bool = False) -> int:
+        """(Re)reads the whole catalog. Returns the number of tables indexed."""
+        with self._lock:
+            return self._load_locked(reconnect)
+
+    def invalidate(self) -> None:
+        """Drops the snapshot; the next lookup reloads it."""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            if not self._loaded:
+                self._load_locked(reconnect=False)
+            elif self.check_mtime and self._file_mtime() != self._mtime:
+                logging.info(f"DuckDB file {self.db_path} changed on disk, reloading catalog snapshot.")
+                self._load_locked(reconnect=True)
+
+    def get_table_schema(self, full_table_name: str) -> Tuple[Optional[SchemaFields], Optional[str]]:
+        """Returns (fields, table_comment) for 'schema.table', or (None, None) if unknown."""
+        self._ensure_fresh()
+        entry = self._tables.get(full_table_name.lower())
+        if entry is None:
+            return None, None
+        fields, table_comment = entry
+        return list(fields), table_comment
+
+    def __contains__(self, full_table_name: str) -> bool:
+        self._ensure_fresh()
+        return full_table_name.lower() in self._tables
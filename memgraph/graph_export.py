@@ -0,0 +1,345 @@
+import os
+import csv
+import json
+import logging
+from typing import Optional, Iterable
+
+# Merge key of every node label the lineage loader writes
+NODE_KEYS = {
+    "Pipeline": "name",
+    "Script": "name",
+    "Schema": "name",
+    "Table": "full_name",
+    "Column": "full_name",
+}
+NODE_ORDER = ["Pipeline", "Script", "Schema", "Table", "Column"]
+
+NULL_MARKER = "\\N" # CSV cell for a missing property (an empty cell is an empty string)
+EXPORT_MANIFEST = "export_manifest.json"
+LOAD_CSV_SCRIPT = "load_csv.cypherl"
+CYPHERL_FILE = "lineage.cypherl"
+CYPHERL_BATCH_SIZE = 500 # Rows per UNWIND line in the CYPHERL export
+
+_TYPE_CASTS = {"bool": "toBoolean", "int": "toInteger", "float": "toFloat"}
+
+
+class LineageGraph:
+    """
+    The lineage graph as plain dictionaries:
+        nodes:         {label: {key: {property: value}}}
+        relationships: {(type, start_label, end_label): {(start_key, end_key): {property: value}}}
+
+    add_batch(), add_script_properties() and add_dependencies() apply the same MERGE /
+    ON CREATE / SET rules as the online loader (LineageBatch.statements(),
+    update_script_properties(), dependencies()), so the graph equals what those
+    statements leave in an empty Memgraph.
+    """
+
+    def __init__(self):
+        self.nodes = {label: {} for label in NODE_ORDER}
+        self.relationships = {}
+
+    # --- Building ---
+    def merge_node(self, label: str, key, on_create: Optional[dict] = None) -> dict:
+        nodes = self.nodes.setdefault(label, {})
+        if key not in nodes:
+            nodes[key] = {NODE_KEYS[label]: key}
+            nodes[key].update({k: v for k, v in (on_create or {}).items() if v is not None})
+        return nodes[key]
+
+    def merge_relationship(self, rel_type: str, start_label: str, start_key, end_label: str, end_key) -> Optional[dict]:
+        """MATCHes both endpoints and MERGEs the relationship; None if an endpoint is missing."""
+        if start_key not in self.nodes.get(start_label, {}) or end_key not in self.nodes.get(end_label, {}):
+            return None
+        return self.relationships.setdefault((rel_type, start_label, end_label), {}).setdefault((start_key, end_key), {})
+
+    @staticmethod
+    def _set_properties(target: dict, props: dict) -> None:
+        """SET x += props: null values remove the property."""
+        for k, v in (props or {}).items():
+            if v is None:
+                target.pop(k, None)
+            else:
+                target[k] = v
+
+    def add_batch(self, batch) -> None:
+        """Applies a LineageBatch in the order of LineageBatch.statements()."""
+        for row in batch.pipelines.values():
+            self.merge_node("Pipeline", row["name"])
+        for row in batch.script_links.values():
+            self.merge_node("Pipeline", row["pipeline_name"])
+            self.merge_node("Script", row["script_name"], {"type": "SQL"})
+            self.merge_relationship("CONTAINS_SCRIPT", "Pipeline", row["pipeline_name"], "Script", row["script_name"])
+        for row in batch.schemas.values():
+            self.merge_node("Schema", row["name"])
+        for row in batch.tables.values():
+            is_new = row["full_name"] not in self.nodes["Table"]
+            table = self.merge_node("Table", row["full_name"], {"name": row["name"], "type": row["type"]})
+            if not is_new and row["is_file"]:
+                table["type"] = "FILE"
+            self._set_properties(table, row["props"])
+        for row in batch.table_schemas.values():
+            self.merge_relationship("IN_SCHEMA", "Table", row["table_full_name"], "Schema", row["schema_name"])
+        for row in batch.columns.values():
+            self._set_properties(self.merge_node("Column", row["full_name"], {"name": row["name"]}), row["props"])
+        for row in batch.column_tables.values():
+            self.merge_relationship("IN_TABLE", "Column", row["col_full_name"], "Table", row["table_full_name"])
+        for row in batch.derived_from.values():
+            edge = self.merge_relationship("DERIVED_FROM", "Column", row["tgt_col_full_name"], "Column", row["src_col_full_name"])
+            if edge is not None:
+                self._set_properties(edge, row["props"])
+        for rel_type, rows in (("READS_FROM", batch.reads_from), ("GENERATES", batch.generates)):
+            for row in rows.values():
+                self.merge_relationship(rel_type, "Script", row["script_name"], "Column", row["col_full_name"])
+
+    def add_script_properties(self, script_details: dict, hash_func=None) -> None:
+        """Mirrors update_script_properties(): sets path/content/hash on existing Script nodes."""
+        for script_name, details in script_details.items():
+            script = self.nodes["Script"].get(script_name)
+            if script is None or 'path' not in details or 'content' not in details:
+                continue
+            script["path_to_sql"] = details["path"]
+            script["sql_content"] = details["content"]
+            sql_hash = details.get("sql_hash") or (hash_func(details["content"]) if hash_func else None)
+            if sql_hash:
+                script["sql_hash"] = sql_hash
+
+    def add_dependencies(self, label: str, edges: Iterable) -> None:
+        """Mirrors write_dependency_edges(): DEPENDS_ON between existing nodes of one label."""
+        for name, dependency in edges:
+            self.merge_relationship("DEPENDS_ON", label, name, label, dependency)
+
+    # --- Inspection ---
+    def counts(self) -> dict:
+        counts = {label: len(nodes) for label, nodes in self.nodes.items() if nodes}
+        for (rel_type, start_label, end_label), rels in sorted(self.relationships.items()):
+            counts[f"{start_label}-{rel_type}->{end_label}"] = len(rels)
+        return counts
+
+
+def _property_columns(records: Iterable[dict], leading: list) -> list:
+    """Column order for a CSV: the leading columns, then all other properties sorted."""
+    names = set()
+    for record in records:
+        names.update(record)
+    return leading + sorted(names - set(leading))
+
+
+def _column_types(records: list, columns: list) -> dict:
+    """Per column: 'bool', 'int' or 'float' if every non-null value has that type, else 'str'."""
+    types = {}
+    for column in columns:
+        seen = {type(r[column]).__name__ for r in records if r.get(column) is not None}
+        types[column] = seen.pop() if len(seen) == 1 and next(iter(seen), None) in _TYPE_CASTS else "str"
+    return types
+
+
+def _csv_cell(value) -> str:
+    if value is None:
+        return NULL_MARKER
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, dict)):
+        return json.dumps(value) # Non-scalar properties travel as JSON text
+    return str(value)
+
+
+def _cell_value(text: str, value_type: str):
+    if text == NULL_MARKER:
+        return None
+    if value_type == "bool":
+        return text == "true"
+    if value_type == "int":
+        return int(text)
+    if value_type == "float":
+        return float(text)
+    return text
+
+
+def _cypher_name(name: str) -> str:
+    return name if name.isidentifier() else f"`{name.replace('`', '``')}`"
+
+
+def cypher_literal(value) -> str:
+    """Renders a property value as a Cypher literal."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(cypher_literal(v) for v in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{_cypher_name(str(k))}: {cypher_literal(v)}" for k, v in value.items()) + "}"
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def _row_properties(columns: list, types: dict, alias: str = "row") -> str:
+    """{prop: row.prop, ...} map for LOAD CSV, with type casts for non-string columns."""
+    parts = []
+    for column in columns:
+        ref = f"{alias}.{_cypher_name(column)}"
+        cast = _TYPE_CASTS.get(types[column])
+        parts.append(f"{_cypher_name(column)}: {cast}({ref})" if cast else f"{_cypher_name(column)}: {ref}")
+    return "{" + ", ".join(parts) + "}"
+
+
+def _relationship_file(rel_type: str, start_label: str, end_label: str) -> str:
+    return f"rel_{start_label}_{rel_type}_{end_label}.csv"
+
+
+def export_csv(graph: LineageGraph, out_dir: str, schema_statements: Iterable[str] = (), load_path: Optional[str] = None) -> dict:
+    """
+    Writes one CSV per node label and per (relationship type, start label, end label),
+    an export manifest describing them, and a LOAD CSV script (load_csv.cypherl) to run
+    with mgconsole. load_path is the directory the CSVs will have on the Memgraph host
+    (defaults to out_dir). Missing properties are written as \\N.
+    Returns the manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    load_path = load_path or os.path.abspath(out_dir)
+    manifest = {"null_marker": NULL_MARKER, "nodes": [], "relationships": []}
+    script = [statement.strip() for statement in schema_statements]
+
+    for label in NODE_ORDER + sorted(set(graph.nodes) - set(NODE_ORDER)):
+        records = list(graph.nodes.get(label, {}).values())
+        if not records:
+            continue
+        key = NODE_KEYS[label]
+        columns = _property_columns(records, [key])
+        types = _column_types(records, columns)
+        file_name = f"nodes_{label}.csv"
+        with open(os.path.join(out_dir, file_name), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for record in records:
+                writer.writerow([_csv_cell(record.get(column)) for column in columns])
+        manifest["nodes"].append({"file": file_name, "label": label, "key": key, "columns": types, "count": len(records)})
+        script.append(
+            f'LOAD CSV FROM "{load_path}/{file_name}" WITH HEADER NULLIF "\\\\N" AS row '
+            f'CREATE (:{label} {_row_properties(columns, types)});'
+        )
+
+    for (rel_type, start_label, end_label), rels in sorted(graph.relationships.items()):
+        if not rels:
+            continue
+        columns = _property_columns(rels.values(), [])
+        types = _column_types(list(rels.values()), columns)
+        file_name = _relationship_file(rel_type, start_label, end_label)
+        with open(os.path.join(out_dir, file_name), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["_start", "_end"] + columns)
+            for (start_key, end_key), props in rels.items():
+                writer.writerow([start_key, end_key] + [_csv_cell(props.get(column)) for column in columns])
+        manifest["relationships"].append({
+            "file": file_name, "type": rel_type,
+            "start_label": start_label, "start_key": NODE_KEYS[start_label],
+            "end_label": end_label, "end_key": NODE_KEYS[end_label],
+            "columns": types, "count": len(rels),
+        })
+        script.append(
+            f'LOAD CSV FROM "{load_path}/{file_name}" WITH HEADER NULLIF "\\\\N" AS row '
+            f'MATCH (a:{start_label} {{{NODE_KEYS[start_label]}: row._start}}), (b:{end_label} {{{NODE_KEYS[end_label]}: row._end}}) '
+            f'CREATE (a)-[:{rel_type} {_row_properties(columns, types)}]->(b);'
+        )
+
+    with open(os.path.join(out_dir, EXPORT_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    with open(os.path.join(out_dir, LOAD_CSV_SCRIPT), "w", encoding="utf-8") as f:
+        f.write("\n".join(script) + "\n")
+    logging.info(f"Exported lineage graph as CSV to {out_dir}: {graph.counts()}")
+    return manifest
+
+
+def export_cypherl(graph: LineageGraph, out_path: str, schema_statements: Iterable[str] = (), batch_size: int = CYPHERL_BATCH_SIZE) -> None:
+    """
+    Writes the graph as a CYPHERL file (one query per line) for `mgconsole < file`:
+    the schema statements, then nodes and relationships as UNWIND-over-literal-list
+    CREATEs of batch_size rows each.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        for statement in schema_statements:
+            f.write(statement.strip() + "\n")
+        for label in NODE_ORDER + sorted(set(graph.nodes) - set(NODE_ORDER)):
+            records = list(graph.nodes.get(label, {}).values())
+            for start in range(0, len(records), batch_size):
+                f.write(f"UNWIND {cypher_literal(records[start:start + batch_size])} AS props CREATE (n:{label}) SET n = props;\n")
+        for (rel_type, start_label, end_label), rels in sorted(graph.relationships.items()):
+            rows = [{"s": start_key, "e": end_key, "p": props} for (start_key, end_key), props in rels.items()]
+            for start in range(0, len(rows), batch_size):
+                f.write(
+                    f"UNWIND {cypher_literal(rows[start:start + batch_size])} AS row "
+                    f"MATCH (a:{start_label} {{{NODE_KEYS[start_label]}: row.s}}), (b:{end_label} {{{NODE_KEYS[end_label]}: row.e}}) "
+                    f"CREATE (a)-[r:{rel_type}]->(b) SET r = row.p;\n"
+                )
+    logging.info(f"Exported lineage graph as CYPHERL to {out_path}: {graph.counts()}")
+
+
+def read_csv_export(out_dir: str) -> LineageGraph:
+    """Reads a CSV export back into a LineageGraph (with the original property types)."""
+    with open(os.path.join(out_dir, EXPORT_MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    graph = LineageGraph()
+    for entry in manifest["nodes"]:
+        with open(os.path.join(out_dir, entry["file"]), "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                props = {k: _cell_value(v, entry["columns"][k]) for k, v in row.items()}
+                graph.nodes.setdefault(entry["label"], {})[props[entry["key"]]] = {k: v for k, v in props.items() if v is not None}
+    for entry in manifest["relationships"]:
+        rels = graph.relationships.setdefault((entry["type"], entry["start_label"], entry["end_label"]), {})
+        with open(os.path.join(out_dir, entry["file"]), "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                start_key, end_key = row.pop("_start"), row.pop("_end")
+                props = {k: _cell_value(v, entry["columns"][k]) for k, v in row.items()}
+                rels[(start_key, end_key)] = {k: v for k, v in props.items() if v is not None}
+    return graph
+
+
+def graph_from_memgraph(db) -> LineageGraph:
+    """Reads the lineage part (NODE_KEYS labels) of a live Memgraph graph into a LineageGraph."""
+    graph = LineageGraph()
+    for row in db.execute_and_fetch("MATCH (n) RETURN labels(n) AS labels, properties(n) AS props"):
+        for label in row["labels"]:
+            if label in NODE_KEYS:
+                graph.nodes.setdefault(label, {})[row["props"].get(NODE_KEYS[label])] = dict(row["props"])
+    for row in db.execute_and_fetch(
+        """
+        MATCH (a)-[r]->(b)
+        RETURN type(r) AS type, labels(a) AS start_labels, properties(a) AS start,
+               labels(b) AS end_labels, properties(b) AS end, properties(r) AS props
+        """
+    ):
+        start_label = next((label for label in row["start_labels"] if label in NODE_KEYS), None)
+        end_label = next((label for label in row["end_labels"] if label in NODE_KEYS), None)
+        if start_label and end_label:
+            graph.relationships.setdefault((row["type"], start_label, end_label), {})[
+                (row["start"].get(NODE_KEYS[start_label]), row["end"].get(NODE_KEYS[end_label]))
+            ] = dict(row["props"])
+    return graph
+
+
+def compare_graphs(expected: LineageGraph, actual: LineageGraph, sample: int = 5) -> dict:
+    """
+    Differences between two LineageGraphs, per label / relationship group:
+    {"Column": {"missing": [...], "extra": [...], "different": [...]}, ...}.
+    Lists are capped at `sample` entries; an empty dict means the graphs are equal.
+    """
+    differences = {}
+
+    def diff(name, left: dict, right: dict):
+        missing = sorted(set(left) - set(right), key=str)
+        extra = sorted(set(right) - set(left), key=str)
+        different = sorted((k for k in set(left) & set(right) if left[k] != right[k]), key=str)
+        if missing or extra or different:
+            differences[name] = {
+                "missing": missing[:sample], "extra": extra[:sample], "different": different[:sample],
+                "counts": {"missing": len(missing), "extra": len(extra), "different": len(different)},
+            }
+
+    for label in sorted(set(expected.nodes) | set(actual.nodes)):
+        diff(label, expected.nodes.get(label, {}), actual.nodes.get(label, {}))
+    for group in sorted(set(expected.relationships) | set(actual.relationships)):
+        diff("{1}-{0}->{2}".format(*group), expected.relationships.get(group, {}), actual.relationships.get(group, {}))
+    return differences
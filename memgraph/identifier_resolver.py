@@ -0,0 +1,247 @@
+import os
+import re
+import logging
+from collections import namedtuple
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# --- Precompiled patterns ---
+READ_CSV_PATTERN = re.compile(r"read_csv\(['\"](.+?\.csv)['\"]")
+QUOTED_FILE_PATTERN = re.compile(r'^"(.+)\.(csv|txt|dat)"$', re.IGNORECASE)
+
+# A resolved source identifier. full_name is the column's full name (table full name + column).
+ResolvedIdentifier = namedtuple("ResolvedIdentifier", ["schema", "table", "column", "table_full_name", "full_name"])
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class IdentifierResolver:
+    """
+    Resolves lineage identifiers (source columns, table names, file paths) with
+    precompiled patterns and bounded LRU caches, since the same few hundred
+    identifiers repeat across all lineage documents.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._resolve_cached = lru_cache(maxsize=maxsize)(self._resolve_uncached)
+        self.normalize_table_name = lru_cache(maxsize=maxsize)(self._normalize_table_name)
+        self.parse_file_path = lru_cache(maxsize=maxsize)(self._parse_file_path)
+        self.csv_source_name = lru_cache(maxsize=maxsize)(self._csv_source_name)
+
+    # --- Single identifiers ---
+    @staticmethod
+    def _parse_file_path(file_path: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Parses a raw file path into schema name (from dir), table name (filename),
+        and full name (schema.table).
+        Handles both / and \\ separators.
+        """
+        if not file_path:
+            return None, None, None
+
+        norm_path = file_path.replace("\\", "/")
+        table_name = os.path.basename(norm_path)
+        dir_path = os.path.dirname(norm_path)
+
+        # Create schema name from directory structure
+        if dir_path:
+            schema_name = dir_path.replace("/", ".")
+        else:
+            # Handle files in the root or without explicit directory
+            schema_name = "file_root"
+
+        return schema_name, table_name, f"{schema_name}.{table_name}"
+
+    @staticmethod
+    def _csv_source_name(name: str) -> Optional[str]:
+        """Returns the dotted '"path.to.file.csv"' name for a read_csv(...) source, or None."""
+        match = READ_CSV_PATTERN.search(name)
+        if not match:
+            return None
+        # Normalize and convert path to dot notation, avoiding a leading dot if path starts with /
+        norm_path = match.group(1).replace("\\", "/")
+        dot_path = os.path.splitext(norm_path.lstrip('/'))[0].replace("/", ".")
+        return f'"{dot_path}.csv"'
+
+    @staticmethod
+    def _normalize_table_name(name: str) -> str:
+        """
+        Ensures the table name is in schema.table format.
+        - Handles quoted file paths (e.g., '"path/to/file.txt"') by parsing them
+          into schema.table format (e.g., 'path.to.file').
+        - If name contains '.' and is not a quoted file, assumes it's already schema.table.
+        - If name doesn't contain '.' and is not a quoted file, prepends 'main.'.
+        """
+        if not name:
+            logging.debug("normalize_table_name received empty or None input, returning empty string.")
+            return ""
+
+        quoted_file_match = QUOTED_FILE_PATTERN.match(name)
+        if quoted_file_match:
+            try:
+                normalized_path = quoted_file_match.group(1).replace("\\", "/")
+                parts = normalized_path.split('/')
+                table_name = parts[-1].replace(".", "_") # Also sanitize dots in filename part
+
+                schema_parts = parts[:-1]
+                if schema_parts:
+                    schema_name = ".".join(part.replace(".", "_") for part in schema_parts)
+                else:
+                    schema_name = "file_sources" # Default schema
+
+                normalized = f"{schema_name}.{table_name}"
+                logging.debug(f"Normalized quoted file path '{name}' to: '{normalized}'")
+                return normalized
+            except Exception as e:
+                logging.error(f"Error parsing quoted file path '{name}': {e}. Returning original name.")
+                return name
+
+        if "." in name:
+            # Assume it's already in schema.table format (e.g., "wh_db.DimTime")
+            return name
+        # Simple name without dots, assume it's a table in the 'main' schema
+        return f"main.{name}"
+
+    @staticmethod
+    def _resolve_uncached(identifier: str, file_schema: Optional[str], file_table: Optional[str], file_full_name: Optional[str]):
+        """
+        Returns (ResolvedIdentifier or None, message). The message (a 2-part warning or the
+        invalid-format error) is logged by resolve() on every call, not once per cache entry.
+        """
+        parts = identifier.split('.')
+        message = None
+
+        if identifier.startswith("file.") and len(parts) == 2 and file_table is not None:
+            # File placeholder: schema/table of the actual file, placeholder as conceptual column name
+            logging.debug(f"Interpreting file placeholder '{identifier}' using pre-processed info.")
+            schema_name, table_name, column_name = file_schema, file_table, parts[1]
+        elif len(parts) == 3:
+            schema_name, table_name, column_name = parts
+        elif len(parts) == 2:
+            message = f"Identifier '{identifier}' only has 2 parts. Assuming 'main' schema."
+            schema_name, table_name, column_name = "main", parts[0], parts[1]
+        else:
+            schema_name = table_name = column_name = None
+            if identifier.startswith('"') and identifier.endswith('.csv"'):
+                csv_parts = identifier.strip('"').split('.')
+                if len(csv_parts) >= 2:
+                    table_name = csv_parts[-2]
+                    schema_name = ".".join(csv_parts[:-2]) if len(csv_parts) > 2 else "csv_files"
+                    column_name = "file_content"
+                    logging.debug(f"Interpreted CSV path '{identifier}' as: {schema_name}.{table_name}.{column_name}")
+            if column_name is None:
+                return None, f"Invalid identifier format: {identifier}"
+
+        if file_table is not None and table_name == file_table and schema_name == file_schema:
+            table_full_name = file_full_name
+        else:
+            table_full_name = f"{schema_name}.{table_name}" if schema_name else table_name
+        return ResolvedIdentifier(schema_name, table_name, column_name, table_full_name, f"{table_full_name}.{column_name}"), message
+
+    def resolve(self, identifier: str, file_source_details: Optional[dict] = None) -> ResolvedIdentifier:
+        """
+        Resolves a source identifier ('schema.table.column', 'table.column', a file
+        placeholder or a quoted CSV path). Raises ValueError for invalid formats.
+        """
+        if file_source_details:
+            result, message = self._resolve_cached(
+                identifier,
+                file_source_details['schema'],
+                file_source_details['table'],
+                file_source_details['full_name'],
+            )
+        else:
+            result, message = self._resolve_cached(identifier, None, None, None)
+        if result is None:
+            logging.error(message)
+            raise ValueError(message)
+        if message:
+            logging.warning(message)
+        return result
+
+    # --- Whole documents ---
+    def resolve_header(self, data: dict) -> Tuple[Optional[dict], Optional[Tuple[str, str, str]]]:
+        """
+        Resolves the document-level parts of a lineage document: the first FILE source
+        ({"schema", "table", "full_name"} or None) and the target table
+        ((schema, table, full_name) or None).
+        """
+        file_source = None
+        for source_summary in data.get("sources_summary", []):
+            if source_summary.get("type") == "FILE":
+                raw_file_path = source_summary.get("name")
+                if not raw_file_path:
+                    logging.warning("Found FILE source in summary but 'name' (path) is missing. Skipping.")
+                    continue
+                f_schema, f_table, f_full_name = self.parse_file_path(raw_file_path)
+                if not all([f_schema, f_table, f_full_name]):
+                    logging.warning(f"Could not parse file path '{raw_file_path}' correctly. Skipping.")
+                    continue
+                file_source = {"schema": f_schema, "table": f_table, "full_name": f_full_name}
+                break # Only the first FILE source is used
+
+        target = None
+        target_full_table_name = self.normalize_table_name(data.get('target_table') or "")
+        if '.' in target_full_table_name:
+            target_schema_name, target_table_name = target_full_table_name.split('.', 1)
+            target = (target_schema_name, target_table_name, target_full_table_name)
+        return file_source, target
+
+    def resolve_sources(self, lineage_info: dict, file_source: Optional[dict] = None, errors: Optional[list] = None) -> list:
+        """
+        Resolves the sources of one target column's lineage entry.
+        Returns [(source_info, ResolvedIdentifier), ...]; invalid identifiers are
+        logged, skipped and appended to `errors` as (source_identifier, message).
+        """
+        resolved_sources = []
+        for source_info in lineage_info.get('sources', []):
+            source_identifier = source_info.get('source_identifier')
+            if not source_identifier:
+                logging.warning("  Skipping source: missing 'source_identifier'")
+                continue
+            try:
+                resolved_sources.append((source_info, self.resolve(source_identifier, file_source)))
+            except ValueError as e:
+                logging.warning(f"    Skipping source due to error: {e} (Source Identifier: {source_identifier})")
+                if errors is not None:
+                    errors.append((source_identifier, str(e)))
+        return resolved_sources
+
+    def resolve_document(self, data: dict) -> dict:
+        """
+        Resolves every identifier of a lineage document in one pass.
+
+        Returns:
+            {
+                "file_source": {"schema", "table", "full_name"} or None,
+                "target": (schema, table, full_name) or None,
+                "columns": iterator of (target_col, lineage_info, [(source_info, ResolvedIdentifier), ...]),
+                "errors": [(source_identifier, message), ...],
+            }
+        "columns" resolves one target column at a time as it is iterated, so a streamed
+        'lineage' object (lineage_stream.LazyLineageObject) is never held in memory at
+        once; "errors" is complete once "columns" has been iterated.
+        """
+        file_source, target = self.resolve_header(data)
+        errors = []
+        columns = (
+            (target_col_name, lineage_info, self.resolve_sources(lineage_info, file_source, errors))
+            for target_col_name, lineage_info in (data.get('lineage') or {}).items()
+        )
+        return {"file_source": file_source, "target": target, "columns": columns, "errors": errors}
+
+    def cache_info(self) -> dict:
+        """lru_cache statistics per resolver cache."""
+        return {
+            "identifiers": self._resolve_cached.cache_info(),
+            "table_names": self.normalize_table_name.cache_info(),
+            "file_paths": self.parse_file_path.cache_info(),
+            "csv_sources": self.csv_source_name.cache_info(),
+        }
+
+    def clear(self) -> None:
+        self._resolve_cached.cache_clear()
+        self.normalize_table_name.cache_clear()
+        self.parse_file_path.cache_clear()
+        self.csv_source_name.cache_clear()
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Optional
+
+MANIFEST_VERSION = 1
+
+
+def sha256_bytes(data: bytes) -> str:
+    """Returns the hex sha256 digest of raw bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path) -> Optional[str]:
+    """Returns the hex sha256 digest of a file's content, or None if it can't be read."""
+    try:
+        with open(path, "rb") as f:
+            return sha256_bytes(f.read())
+    except OSError as e:
+        logging.debug(f"Could not hash file {path}: {e}")
+        return None
+
+
+def sha256_json(obj) -> str:
+    """Stable digest of a JSON-serialisable object (sorted keys, no whitespace)."""
+    return sha256_bytes(json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Loads the ingest manifest. Returns an empty manifest if the file is missing,
+    unreadable or written by another manifest version.
+
+    Layout:
+        {
+            "version": 1,
+            "documents": {
+                "1_wh_db.DimBroker.json": {
+                    "json_hash": "...", "sql_hash": "...", "schema_hash": "...",
+                    "script_name": "1_wh_db.DimBroker.sql",
+                    "derived_from": [[tgt_col, src_col], ...],
+                    "reads_from": [[script, col], ...],
+                    "generates": [[script, col], ...]
+                }
+            }
+        }
+    """
+    empty = {"version": MANIFEST_VERSION, "documents": {}}
+    if not os.path.exists(manifest_path):
+        return empty
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        logging.warning(f"Could not read ingest manifest {manifest_path}, doing a full load: {e}")
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION:
+        logging.warning(f"Ingest manifest {manifest_path} has version {manifest.get('version')}, expected {MANIFEST_VERSION}. Doing a full load.")
+        return empty
+    manifest.setdefault("documents", {})
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: dict) -> None:
+    """Writes the manifest atomically (temp file + rename)."""
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    logging.info(f"Saved ingest manifest with {len(manifest.get('documents', {}))} documents to {manifest_path}")
+
+
+def document_unchanged(entry: Optional[dict], json_hash: str, sql_hash: Optional[str], schema_hash: str) -> bool:
+    """True if the manifest entry was recorded for exactly these hashes."""
+    return bool(entry) and (
+        entry.get("json_hash") == json_hash
+        and entry.get("sql_hash") == sql_hash
+        and entry.get("schema_hash") == schema_hash
+    )
+
+
+def stale_edges(old_documents: dict, new_documents: dict, edge_type: str) -> list[tuple]:
+    """
+    Returns edges of `edge_type` ("derived_from", "reads_from", "generates") that a
+    changed or removed document used to assert and that no current document asserts
+    any more. Edges shared with another (unchanged) document are kept.
+    """
+    claimed = {tuple(edge) for entry in new_documents.values() for edge in entry.get(edge_type, [])}
+    stale = set()
+    for name, old_entry in old_documents.items():
+        new_entry = new_documents.get(name)
+        if new_entry is old_entry:
+            continue # Unchanged document, entry carried over as is
+        stale.update(tuple(edge) for edge in old_entry.get(edge_type, []))
+    return sorted(stale - claimed)
@@ -0,0 +1,271 @@
+import json
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, Iterable, Callable, Optional, Tuple, Any
+
+CHUNK_SIZE = 64 * 1024
+# Files above this size are not parsed whole: their 'lineage' object is walked key by key
+LARGE_DOCUMENT_BYTES = 32 * 1024 * 1024
+STREAMED_KEY = "lineage"
+
+_WHITESPACE = " \t\n\r"
+_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+_NUMBER_CHARS = set("0123456789+-.eE")
+_decoder = json.JSONDecoder()
+
+
+def _partial_number(text: str) -> bool:
+    """Whether text can be the cut-off rest of a number, e.g. 'e-' of '1.5e-07'."""
+    return bool(text) and all(char in _NUMBER_CHARS for char in text)
+
+
+class JsonStreamReader:
+    """
+    Minimal incremental reader over a JSON text file: reads CHUNK_SIZE pieces and
+    decodes one value at a time with json.JSONDecoder.raw_decode, so only the value
+    being decoded has to fit in memory. Optionally hashes the bytes it reads.
+    """
+
+    def __init__(self, fp, chunk_size: int = CHUNK_SIZE, hasher=None):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.hasher = hasher
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Appends the next chunk to the buffer. Returns False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.hasher is not None:
+            self.hasher.update(chunk.encode("utf-8"))
+        # Drop what has been consumed so the buffer stays about one value long
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character ('' at end of file) without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Expected '{char}', found '{found}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def _cut_at_buffer_end(self, error: json.JSONDecodeError) -> bool:
+        """
+        Whether a decode error can come from a value cut at the chunk boundary, as
+        opposed to invalid JSON. Most such errors point at the end of the buffer;
+        unterminated strings, escapes and literals point at where they start, and a
+        number cut in its fraction or exponent at the part that did not parse.
+        """
+        rest = self.buffer[error.pos:]
+        if error.msg.startswith("Unterminated string"):
+            return True # The string runs to the end of the buffer
+        if error.msg.startswith("Invalid \\uXXXX escape"):
+            return len(rest) < 6
+        if error.msg.startswith("Expecting value") and any(literal.startswith(rest) for literal in _LITERALS):
+            return True
+        if _partial_number(rest):
+            return True
+        return error.pos >= len(self.buffer) - 1
+
+    def read_value(self) -> Any:
+        """Decodes the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._cut_at_buffer_end(e) and self._fill():
+                    continue # Value is cut at the chunk boundary
+                raise
+            number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if (end == len(self.buffer) or number and _partial_number(self.buffer[end:])) and self._fill():
+                continue # A number may continue in the next chunk, decode again
+            self.pos = end
+            return value
+
+    def iter_object(self) -> Iterator[Tuple[str, Any]]:
+        """Yields (key, value) of the object starting at the current position, one member at a time."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key, self.read_value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise json.JSONDecodeError(f"Expected ',' or '}}', found '{separator}'", self.buffer, self.pos - 1)
+
+    def skip_object(self) -> bool:
+        """Consumes the object at the current position member by member. Returns True if it had members."""
+        has_members = False
+        for _ in self.iter_object():
+            has_members = True
+        return has_members
+
+    def read_document(self, streamed_key: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Walks a top-level JSON object. Yields (key, value) for every member except
+        `streamed_key`, whose object value is positioned on and left to the caller:
+        for that key (key, None) is yielded and the caller must consume the value
+        (iter_object / skip_object / read_value) before resuming the iteration.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            if key == streamed_key:
+                yield key, None
+            else:
+                yield key, self.read_value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise json.JSONDecodeError(f"Expected ',' or '}}', found '{separator}'", self.buffer, self.pos - 1)
+
+
+class LazyLineageObject:
+    """
+    Read-only stand-in for a document's 'lineage' dict that re-reads the file on every
+    iteration, yielding one target column's lineage at a time. Supports what the
+    loaders use: truthiness, items(), keys(), values(), iteration and len().
+    """
+
+    def __init__(self, path: Path, has_members: bool, streamed_key: str = STREAMED_KEY):
+        self.path = Path(path)
+        self.has_members = has_members
+        self.streamed_key = streamed_key
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            reader = JsonStreamReader(f)
+            for key, _ in reader.read_document(self.streamed_key):
+                if key != self.streamed_key:
+                    continue
+                if reader.peek() != "{":
+                    reader.read_value() # null or malformed: nothing to yield
+                    continue
+                yield from reader.iter_object()
+
+    def keys(self) -> Iterator[str]:
+        return (key for key, _ in self.items())
+
+    def values(self) -> Iterator[Any]:
+        return (value for _, value in self.items())
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def __bool__(self) -> bool:
+        return self.has_members
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def __repr__(self) -> str:
+        return f"LazyLineageObject({str(self.path)!r})"
+
+
+def load_json_document(path: Path, large_document_bytes: int = LARGE_DOCUMENT_BYTES) -> Tuple[dict, str]:
+    """
+    Reads one lineage JSON file. Returns (document, sha256 of the file's bytes).
+
+    Files up to large_document_bytes are parsed whole. Larger files are scanned once
+    in chunks: every top-level member except 'lineage' is kept, and 'lineage' becomes
+    a LazyLineageObject that streams the column entries from disk when iterated.
+    Raises json.JSONDecodeError, UnicodeDecodeError or OSError like json.load.
+    """
+    path = Path(path)
+    if path.stat().st_size <= large_document_bytes:
+        with open(path, "rb") as f:
+            raw = f.read()
+        return json.loads(raw.decode("utf-8")), hashlib.sha256(raw).hexdigest()
+
+    hasher = hashlib.sha256()
+    document = {}
+    with open(path, "r", encoding="utf-8", newline="") as f: # No newline translation, so the hash matches the bytes
+        reader = JsonStreamReader(f, hasher=hasher)
+        for key, value in reader.read_document(STREAMED_KEY):
+            if key != STREAMED_KEY:
+                document[key] = value
+            elif reader.peek() == "{":
+                document[key] = LazyLineageObject(path, reader.skip_object())
+            else:
+                document[key] = reader.read_value()
+        if reader.peek() != "": # Also reads (and hashes) up to the end of the file
+            raise json.JSONDecodeError("Extra data", reader.buffer, reader.pos)
+    logging.debug(f"Streamed large JSON document {path.name} ({path.stat().st_size} bytes).")
+    return document, hasher.hexdigest()
+
+
+def iter_json_files(directory_path: str | Path) -> Iterator[Path]:
+    """Yields the *.json files of a directory in sorted order (for predictable loads)."""
+    path = Path(directory_path)
+    if not path.is_dir():
+        logging.error(f"Not a directory: {path}")
+        raise NotADirectoryError(f"Not a directory: {path}")
+    yield from sorted(path.glob("*.json"))
+
+
+def stream_json_documents(directory_path: str | Path, large_document_bytes: int = LARGE_DOCUMENT_BYTES) -> Iterator[Tuple[Path, dict]]:
+    """
+    Lazily yields (filepath, document) for every JSON file of a directory, in sorted
+    order. Only one document is held at a time; unreadable files are logged and skipped.
+    """
+    loaded = 0
+    for json_file in iter_json_files(directory_path):
+        try:
+            document, _ = load_json_document(json_file, large_document_bytes)
+        except (json.JSONDecodeError, UnicodeDecodeError, OSError) as e:
+            logging.warning(f"Skipped loading {json_file.name}: {e}")
+            continue
+        loaded += 1
+        logging.debug(f"Successfully loaded JSON: {json_file.name}")
+        yield json_file, document
+    logging.info(f"Streamed {loaded} JSON files from {directory_path}")
+
+
+def bounded_map(func: Callable, items: Iterable, workers: int, max_pending: Optional[int] = None,
+                thread_name_prefix: str = "lineage-stream") -> Iterator[Any]:
+    """
+    Like ThreadPoolExecutor.map, but pulls from `items` lazily and keeps at most
+    max_pending (default 2 * workers) calls in flight, so a fast producer cannot
+    run ahead of the consumer. Results are yielded in input order.
+    """
+    max_pending = max(1, max_pending or 2 * workers)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=thread_name_prefix) as executor:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
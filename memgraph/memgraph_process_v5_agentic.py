@@ -5,14 +5,40 @@ from pathlib import Path
 import duckdb
 from typing import Optional, List, Tuple
 import os
-import re
 import logging # Added for better output
-from memgraph_utils import read_all_sql_files, update_script_properties, dependencies
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from memgraph_utils import (
+    read_all_sql_files, update_script_properties, dependencies, sql_content_hash,
+    load_dependency_map, build_dependency_edges, PIPELINE_DEPENDENCY_PATH, SCRIPT_DEPENDENCY_PATH,
+)
+from ingest_manifest import (
+    MANIFEST_VERSION, sha256_file, sha256_json,
+    load_manifest, save_manifest, document_unchanged, stale_edges,
+)
+from duckdb_catalog import DuckDBCatalog
+from identifier_resolver import IdentifierResolver
+from memgraph_tx import StatementBuffer, TransactionStats, TransactionalWriter
+from lineage_stream import LARGE_DOCUMENT_BYTES, load_json_document, iter_json_files, stream_json_documents, bounded_map
+from graph_export import LineageGraph, export_csv, export_cypherl, read_csv_export, graph_from_memgraph, compare_graphs, CYPHERL_FILE
 
 # --- Configuration ---
 MEMGRAPH_HOST = "memgraph-mage"  # Or your Memgraph host IP/DNS name
 MEMGRAPH_PORT = 7687
 DUCKDB_PATH = os.path.abspath("/app/initial_db.duckdb") # Use constant
+USE_BULK_LOAD = True # False = old per-row MERGE path (useful to compare both graphs)
+BULK_BATCH_SIZE = 1000 # Max rows sent per UNWIND statement
+INGEST_WORKERS = 4 # Worker threads / Memgraph connections for the bulk ingest pipeline
+USE_INCREMENTAL_INGEST = True # Skip JSONs whose JSON/SQL/schema hashes match the manifest
+INGEST_MANIFEST_PATH = "/app/memgraph/.ingest_manifest.json"
+SQL_FILES_DIR = "/app/src/main/sql_for_pipelines"
+USE_TRANSACTIONS = True # Write each group of documents in one explicit transaction (retried on conflicts)
+DOCUMENTS_PER_TRANSACTION = 1
+TX_MAX_RETRIES = 5
+MAX_PENDING_DOCUMENTS = 16 # Parsed documents queued ahead of the writers (bounds memory on large directories)
+EXPORT_DIR = None # e.g. "/app/memgraph/export": write import files instead of loading Memgraph
+EXPORT_FORMAT = "csv" # "csv" (node/relationship CSVs + LOAD CSV script) or "cypherl" (mgconsole)
+USE_SCHEMA_CATALOG = True # Serve table schemas from one duckdb_columns() snapshot instead of a query per table
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,6 +52,13 @@ except Exception as e:
     # Decide how to handle failure - exit or continue without DuckDB features?
     duckdb_conn = None # Set to None to handle checks later
 
+# Catalog snapshot is read lazily on the first lookup and reloaded if the DuckDB file's mtime changes
+duckdb_catalog = DuckDBCatalog(duckdb_conn, DUCKDB_PATH) if duckdb_conn and USE_SCHEMA_CATALOG else None
+# Tables already imported into Memgraph during this run (import_schema_to_memgraph)
+IMPORTED_SCHEMA_TABLES = set()
+# Committed / retried / failed transaction counters for this run
+tx_stats = TransactionStats()
+
 try:
     # Establish connection - Add user/password if required
     memgraph = Memgraph(host=MEMGRAPH_HOST, port=MEMGRAPH_PORT)
@@ -38,6 +71,8 @@ except Exception as e:
 
 # --- Reading in sql pipeline to process mapping ---
 json_file = "/app/src/main/pipeline_mapping.json"
+if not os.path.exists(json_file): # Outside the container: the repository's copy
+    json_file = str(Path(__file__).resolve().parents[1] / "src" / "main" / "pipeline_mapping.json")
 with open(json_file, "r", encoding="utf-8") as f:
                 PIPELINE_SCRIPT_MAP_DATA = json.load(f)
 
@@ -50,30 +85,17 @@ SCRIPT_TO_PIPELINE_MAP = {
 logging.info("Created script-to-pipeline lookup map.")
 
 
+# Shared identifier resolver: precompiled patterns + LRU caches (see identifier_resolver.py)
+resolver = IdentifierResolver()
+
+
 def parse_file_path(file_path):
     """
     Parses a raw file path into schema name (from dir), table name (filename),
     and full name (schema.table).
     Handles both / and \ separators.
     """
-    if not file_path:
-        return None, None, None
-
-    norm_path = file_path.replace("\\", "/")
-    table_name = os.path.basename(norm_path)
-    dir_path = os.path.dirname(norm_path)
-
-    # Create schema name from directory structure
-    if dir_path:
-        schema_name = dir_path.replace("/", ".")
-    else:
-        # Handle files in the root or without explicit directory
-        schema_name = "file_root" # Or choose another default schema name
-
-    # Create full name
-    full_name = f"{schema_name}.{table_name}"
-
-    return schema_name, table_name, full_name
+    return resolver.parse_file_path(file_path)
 
 
 # --- Utility Functions (Keep yours, slightly adjusted logging/checks) ---
@@ -81,16 +103,8 @@ def parse_file_path(file_path):
 def update_function_name(data):
     """Updates read_csv paths in sources_summary."""
     for source in data.get("sources_summary", []):
-        name = source.get("name", "")
-        # Consider making regex more robust if needed
-        match = re.search(r"read_csv\(['\"](.+?\.csv)['\"]", name)
-        if match:
-            file_path = match.group(1)
-            # Normalize and convert path to dot notation
-            norm_path = file_path.replace("\\", "/")
-            # Avoid leading dot if path starts with /
-            dot_path = os.path.splitext(norm_path.lstrip('/'))[0].replace("/", ".")
-            new_name = f'"{dot_path}.csv"' # Keep quotes consistent
+        new_name = resolver.csv_source_name(source.get("name", "") or "")
+        if new_name:
             source["name"] = new_name
             logging.debug(f"Updated CSV source name to: {new_name}")
     return data
@@ -99,43 +113,10 @@ def parse_identifier(identifier, file_source_details=None):
     """
     Parses 'schema.table.column' into (schema, table, column).
     Handles file placeholders if file_source_details is provided.
+    Raises ValueError for invalid identifiers.
     """
-    parts = identifier.split('.')
-
-    # --- Start: Handle File Placeholders ---
-    # Check if it looks like a file placeholder and we have pre-processed file info
-    if identifier.startswith("file.") and len(parts) == 2 and file_source_details:
-         placeholder_col_name = parts[1] # e.g., "placeholder_source_for_col1"
-         logging.debug(f"Interpreting file placeholder '{identifier}' using pre-processed info.")
-         # Return the schema/table from the actual file path,
-         # and use the placeholder part as a *conceptual* column name for the file source
-         return (
-             file_source_details['schema'],
-             file_source_details['table'],
-             placeholder_col_name # Or a generic name like 'file_content'
-         )
-    # --- End: Handle File Placeholders ---
-
-    if len(parts) == 3:
-        return parts[0], parts[1], parts[2]
-    elif len(parts) == 2:
-        # Keep the original warning for non-file cases
-        logging.warning(f"Identifier '{identifier}' only has 2 parts. Assuming 'main' schema.")
-        return "main", parts[0], parts[1]
-    else:
-         # --- Keep CSV handling if needed ---
-        if identifier.startswith('"') and identifier.endswith('.csv"'):
-             clean_id = identifier.strip('"')
-             parts = clean_id.split('.')
-             if len(parts) >= 2:
-                 table_name = parts[-2]
-                 schema_name = ".".join(parts[:-2]) if len(parts) > 2 else "csv_files"
-                 column_name = "file_content"
-                 logging.debug(f"Interpreted CSV path '{identifier}' as: {schema_name}.{table_name}.{column_name}")
-                 return schema_name, table_name, column_name
-
-        logging.error(f"Invalid identifier format: {identifier}")
-        raise ValueError(f"Invalid identifier format: {identifier}")
+    resolved = resolver.resolve(identifier, file_source_details)
+    return resolved.schema, resolved.table, resolved.column
 
 
 def normalize_table_name(name: str) -> str:
@@ -146,42 +127,7 @@ def normalize_table_name(name: str) -> str:
     - If name contains '.' and is not a quoted file, assumes it's already schema.table.
     - If name doesn't contain '.' and is not a quoted file, prepends 'main.'.
     """
-    if not name:
-        logging.debug("normalize_table_name received empty or None input, returning empty string.")
-        return ""
-
-    # Check for quoted file paths first
-    quoted_file_match = re.match(r'^"(.+)\.(csv|txt|dat)"$', name, re.IGNORECASE)
-
-    if quoted_file_match:
-        try: # Add try-except for robustness during parsing
-            full_path_part = quoted_file_match.group(1)
-            normalized_path = full_path_part.replace("\\", "/")
-            parts = normalized_path.split('/')
-            table_name = parts[-1].replace(".", "_") # Also sanitize dots in filename part
-
-            schema_parts = parts[:-1]
-            if schema_parts:
-                schema_name = ".".join(part.replace(".", "_") for part in schema_parts)
-            else:
-                schema_name = "file_sources" # Default schema
-
-            normalized = f"{schema_name}.{table_name}"
-            logging.debug(f"Normalized quoted file path '{name}' to: '{normalized}'")
-            return normalized
-        except Exception as e:
-            logging.error(f"Error parsing quoted file path '{name}': {e}. Returning original name.")
-            # Fallback to returning the original name if parsing fails unexpectedly
-            return name # Or return "" or raise an error? Returning name might be safer.
-
-    if "." in name:
-        # Assume it's already in schema.table format (e.g., "wh_db.DimTime")
-        logging.debug(f"Input '{name}' has a dot and is not a quoted file, returning as is.")
-        return name
-    else:
-        # Simple name without dots, assume it's a table in the 'main' schema
-        logging.debug(f"Input '{name}' has no dot, prepending 'main.'.")
-        return f"main.{name}"
+    return resolver.normalize_table_name(name)
 
 
 # --- Modified Main Loading Logic ---
@@ -430,6 +376,383 @@ def load_lineage_to_memgraph(db, data, script_name, pipeline_name):
                 logging.error(f"    An unexpected error occurred processing source {source_info.get('source_identifier', 'UNKNOWN')} for target {target_col_full_name}: {e}", exc_info=True)
 
 
+# --- Bulk (UNWIND) Loading Logic ---
+class LineageBatch:
+    """
+    Collects the nodes and edges of one or more lineage documents as parameter
+    lists, so they can be written with a few UNWIND statements instead of one
+    MERGE round-trip per row.
+
+    Documents are added in the same order main() processes them, and the
+    first-seen rules of the per-row path (ON CREATE name/type, FILE type
+    overriding on match, DERIVED_FROM props merged with +=) are applied here in
+    Python, so both paths produce the same graph. The one exception is
+    Table.type on tables also created by the DuckDB schema import, where the
+    per-row result already depends on file order.
+    """
+
+    def __init__(self, schema_tables: Optional[set] = None):
+        self.documents = 0
+        self.script_links = {}     # (pipeline, script) -> row
+        self.pipelines = {}        # pipeline name -> row, Pipeline nodes without scripts (see shared_nodes())
+        self.schemas = {}          # schema name -> row
+        self.tables = {}           # table full_name -> row
+        self.table_schemas = {}    # (table full_name, schema name) -> row
+        self.columns = {}          # column full_name -> row
+        self.column_tables = {}    # (column full_name, table full_name) -> row
+        self.derived_from = {}     # (target col, source col) -> row
+        self.reads_from = {}       # (script, source col) -> row
+        self.generates = {}        # (script, target col) -> row
+        # Tables already added via add_table_schema(); may be shared between batches
+        self.schema_tables = schema_tables if schema_tables is not None else set()
+
+    def _add_table(self, schema_name, table_full_name, table_name, table_type=None, is_file=False):
+        self.schemas.setdefault(schema_name, {"name": schema_name})
+        row = self.tables.setdefault(table_full_name, {
+            "full_name": table_full_name,
+            "name": table_name,
+            "type": table_type, # Only applied on create, like the per-row path
+            "is_file": False,
+            "props": {},
+        })
+        if is_file:
+            row["is_file"] = True
+            row["type"] = "FILE"
+        self.table_schemas.setdefault(
+            (table_full_name, schema_name),
+            {"table_full_name": table_full_name, "schema_name": schema_name}
+        )
+
+    def _add_column(self, col_full_name, col_name, table_full_name, props=None):
+        row = self.columns.setdefault(col_full_name, {"full_name": col_full_name, "name": col_name, "props": {}})
+        if props:
+            row["props"].update(props)
+        self.column_tables.setdefault(
+            (col_full_name, table_full_name),
+            {"col_full_name": col_full_name, "table_full_name": table_full_name}
+        )
+
+    def add_table_schema(self, target_full_table_name, table_schema, table_comment=None) -> bool:
+        """
+        Adds a DuckDB table schema (as returned by get_table_schema_duckdb).
+        Mirrors import_schema_to_memgraph(), so call it before add_document()
+        for the same file, like main() does.
+        """
+        target_full_table_name = normalize_table_name(target_full_table_name)
+        if target_full_table_name in self.schema_tables:
+            return True # Each table's schema is imported at most once
+        if table_schema is None or '.' not in target_full_table_name:
+            return False
+        self.schema_tables.add(target_full_table_name)
+        target_schema_name, target_table_name = target_full_table_name.split('.', 1)
+        self._add_table(target_schema_name, target_full_table_name, target_table_name)
+        if table_comment:
+            self.tables[target_full_table_name]["props"]["comment"] = table_comment
+
+        for col_name, col_type, col_desc, col_comment in table_schema:
+            col_props = {"type": col_type}
+            if col_desc:
+                col_props["description"] = col_desc
+            if col_comment:
+                col_props["comment"] = col_comment
+            self._add_column(f"{target_full_table_name}.{col_name}", col_name, target_full_table_name, col_props)
+        return True
+
+    def add_document(self, data, script_name, pipeline_name) -> bool:
+        """
+        Adds one lineage document. Mirrors load_lineage_to_memgraph() row for row.
+        Returns False if the document was skipped.
+        """
+        if not all([script_name, pipeline_name]):
+            logging.error(f"Script name ('{script_name}') or Pipeline name ('{pipeline_name}') is missing. Skipping lineage loading for this data.")
+            return False
+
+        self.script_links.setdefault(
+            (pipeline_name, script_name),
+            {"pipeline_name": pipeline_name, "script_name": script_name}
+        )
+
+        # Column lineage is resolved item by item as resolved["columns"] is iterated below,
+        # so a streamed 'lineage' object (lineage_stream.LazyLineageObject) is never held in memory at once
+        resolved = resolver.resolve_document(data)
+        file_source, target = resolved["file_source"], resolved["target"]
+        if file_source:
+            self._add_table(file_source["schema"], file_source["full_name"], file_source["table"], is_file=True)
+
+        if not data.get('target_table'):
+            logging.warning(f"Missing 'target_table' in lineage data for script {script_name}. Skipping.")
+            return False
+        if target is None:
+            logging.warning(f"Could not properly parse schema/table from target '{data.get('target_table')}' for script {script_name}. Skipping.")
+            return False
+        target_schema_name, target_table_name, target_full_table_name = target
+        self._add_table(target_schema_name, target_full_table_name, target_table_name)
+
+        lineage_details = data.get('lineage', {})
+        if not lineage_details:
+            logging.warning(f"No 'lineage' details found for target table '{target_full_table_name}' in script {script_name}.")
+            self.documents += 1
+            return True
+
+        for target_col_name, lineage_info, sources in resolved["columns"]:
+            target_col_full_name = f"{target_full_table_name}.{target_col_name}"
+            self._add_column(target_col_full_name, target_col_name, target_full_table_name)
+
+            for source_info, src in sources:
+                source_identifier = source_info['source_identifier']
+                src_col_full_name = src.full_name
+                self._add_table(src.schema, src.table_full_name, src.table, table_type="TABLE")
+                self._add_column(src_col_full_name, src.column, src.table_full_name)
+
+                rel_props = {
+                    "transformation_type": source_info.get("transformation_type", lineage_info.get("transformation_type")),
+                    "transformation_logic": source_info.get("transformation_logic", lineage_info.get("transformation_logic")),
+                    "path": str(source_info.get("path")),
+                    "role": source_info.get("role"),
+                    "join_info": json.dumps(source_info.get("join_info")) if source_info.get("join_info") else None,
+                    "notes": source_info.get("notes", lineage_info.get("notes")),
+                }
+                if source_identifier.startswith("file.") and "COPY from file" in str(rel_props.get("transformation_logic")):
+                    rel_props["transformation_type"] = "FILE_LOAD"
+                rel_props = {k: v for k, v in rel_props.items() if v is not None}
+
+                # ON CREATE SET r = props / ON MATCH SET r += props == dict update in order
+                edge = self.derived_from.setdefault(
+                    (target_col_full_name, src_col_full_name),
+                    {"tgt_col_full_name": target_col_full_name, "src_col_full_name": src_col_full_name, "props": {}}
+                )
+                edge["props"].update(rel_props)
+
+                self.reads_from.setdefault(
+                    (script_name, src_col_full_name),
+                    {"script_name": script_name, "col_full_name": src_col_full_name}
+                )
+                self.generates.setdefault(
+                    (script_name, target_col_full_name),
+                    {"script_name": script_name, "col_full_name": target_col_full_name}
+                )
+
+        if resolved["errors"]:
+            logging.warning(f"Skipped {len(resolved['errors'])} unresolvable source identifier(s) in script {script_name}.")
+        self.documents += 1
+        return True
+
+    def merge(self, other: "LineageBatch") -> None:
+        """
+        Adds the rows of another batch as if its documents had been added here,
+        with the same first-seen rules (ON CREATE values kept, FILE type and
+        props applied on match).
+        """
+        self.documents += other.documents
+        for attr in ("script_links", "pipelines", "schemas", "table_schemas", "column_tables", "reads_from", "generates"):
+            rows = getattr(self, attr)
+            for key, row in getattr(other, attr).items():
+                rows.setdefault(key, dict(row))
+        for full_name, other_row in other.tables.items():
+            row = self.tables.setdefault(full_name, {**other_row, "props": {}})
+            if other_row["is_file"]:
+                row["is_file"] = True
+                row["type"] = "FILE"
+            row["props"].update(other_row["props"])
+        for rows, other_rows in ((self.columns, other.columns), (self.derived_from, other.derived_from)):
+            for key, other_row in other_rows.items():
+                rows.setdefault(key, {**other_row, "props": {}})["props"].update(other_row["props"])
+        self.schema_tables.update(other.schema_tables)
+
+    def node_keys(self) -> set:
+        """Keys of every node this batch MERGEs or attaches edges to (see statements())."""
+        return {row[field] for _, rows, key_fields in self.statements() for row in rows for field in key_fields}
+
+    def owned_keys(self) -> set:
+        """
+        Keys of the nodes that belong to this batch's documents: their Scripts, the
+        columns they generate with those columns' tables, and the files they load.
+        The DERIVED_FROM props and ON CREATE values that depend on document order all
+        hang off these nodes. Schemas, Pipelines and the source tables and columns
+        documents read are shared with other documents.
+        """
+        generated = {col_full_name for _, col_full_name in self.generates}
+        return (
+            {script_name for _, script_name in self.script_links}
+            | generated
+            | {table for col_full_name, table in self.column_tables if col_full_name in generated}
+            | {full_name for full_name, row in self.tables.items() if row["is_file"]}
+        )
+
+    def shared_nodes(self, keys: set) -> "LineageBatch":
+        """
+        A batch of only the Pipeline nodes and the Schema, Table and Column nodes whose
+        keys are in `keys`, with this batch's ON CREATE values and props but no edges.
+        """
+        shared = LineageBatch()
+        shared.pipelines = {name: {"name": name} for name, _ in self.script_links if name in keys}
+        shared.schemas = {name: dict(row) for name, row in self.schemas.items() if name in keys}
+        for attr in ("tables", "columns"):
+            setattr(shared, attr, {
+                full_name: {**row, "props": dict(row["props"])}
+                for full_name, row in getattr(self, attr).items() if full_name in keys
+            })
+        return shared
+
+    def statements(self):
+        """
+        Yields (cypher, rows, key_fields) in dependency order (nodes before edges).
+        key_fields name the row fields holding the keys of the nodes a row writes to,
+        used by partition_rows() to keep concurrent writers off the same nodes.
+        """
+        yield (
+            """
+            UNWIND $rows AS row
+            MERGE (p:Pipeline {name: row.name})
+            """,
+            list(self.pipelines.values()),
+            ("name",)
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MERGE (p:Pipeline {name: row.pipeline_name})
+            MERGE (s:Script {name: row.script_name})
+            ON CREATE SET s.type = 'SQL'
+            MERGE (p)-[:CONTAINS_SCRIPT]->(s)
+            """,
+            list(self.script_links.values()),
+            ("pipeline_name", "script_name")
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MERGE (s:Schema {name: row.name})
+            """,
+            list(self.schemas.values()),
+            ("name",)
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MERGE (t:Table {full_name: row.full_name})
+            ON CREATE SET t.name = row.name, t.type = row.type
+            ON MATCH SET t.type = CASE WHEN row.is_file THEN 'FILE' ELSE t.type END
+            SET t += row.props
+            """,
+            list(self.tables.values()),
+            ("full_name",)
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MATCH (t:Table {full_name: row.table_full_name})
+            MATCH (s:Schema {name: row.schema_name})
+            MERGE (t)-[:IN_SCHEMA]->(s)
+            """,
+            list(self.table_schemas.values()),
+            ("table_full_name", "schema_name")
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MERGE (c:Column {full_name: row.full_name})
+            ON CREATE SET c.name = row.name
+            SET c += row.props
+            """,
+            list(self.columns.values()),
+            ("full_name",)
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MATCH (c:Column {full_name: row.col_full_name})
+            MATCH (t:Table {full_name: row.table_full_name})
+            MERGE (c)-[:IN_TABLE]->(t)
+            """,
+            list(self.column_tables.values()),
+            ("col_full_name", "table_full_name")
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MATCH (c_src:Column {full_name: row.src_col_full_name})
+            MATCH (c_tgt:Column {full_name: row.tgt_col_full_name})
+            MERGE (c_tgt)-[r:DERIVED_FROM]->(c_src)
+            SET r += row.props
+            """,
+            list(self.derived_from.values()),
+            ("tgt_col_full_name", "src_col_full_name")
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MATCH (s:Script {name: row.script_name})
+            MATCH (c:Column {full_name: row.col_full_name})
+            MERGE (s)-[:READS_FROM]->(c)
+            """,
+            list(self.reads_from.values()),
+            ("script_name", "col_full_name")
+        )
+        yield (
+            """
+            UNWIND $rows AS row
+            MATCH (s:Script {name: row.script_name})
+            MATCH (c:Column {full_name: row.col_full_name})
+            MERGE (s)-[:GENERATES]->(c)
+            """,
+            list(self.generates.values()),
+            ("script_name", "col_full_name")
+        )
+
+
+    def transaction_statements(self, batch_size: int = BULK_BATCH_SIZE) -> list:
+        """All statements of this batch as (query, params) pairs, chunked to batch_size rows."""
+        return [
+            (query, {"rows": rows[start:start + batch_size]})
+            for query, rows, _ in self.statements()
+            for start in range(0, len(rows), batch_size)
+        ]
+
+
+def write_lineage_batch(db, batch: LineageBatch, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """Writes a LineageBatch to Memgraph in chunks of batch_size rows. Returns statements sent."""
+    statements_sent = 0
+    for query, rows, _ in batch.statements():
+        for start in range(0, len(rows), batch_size):
+            db.execute(query, {"rows": rows[start:start + batch_size]})
+            statements_sent += 1
+    logging.info(f"Bulk loaded {batch.documents} lineage document(s): {len(batch.tables)} tables, {len(batch.columns)} columns, {len(batch.derived_from)} DERIVED_FROM edges in {statements_sent} UNWIND statements.")
+    return statements_sent
+
+
+def bulk_load_lineage_to_memgraph(db, data, script_name, pipeline_name):
+    """Bulk (UNWIND) counterpart of load_lineage_to_memgraph() for a single document."""
+    batch = LineageBatch()
+    if batch.add_document(data, script_name, pipeline_name):
+        write_lineage_batch(db, batch)
+
+
+def lineage_graph_signature(db) -> dict:
+    """
+    Returns every node key and relationship (with properties) of the lineage graph.
+    Load once with USE_BULK_LOAD = False and once with True on an empty database
+    and compare the two signatures to check both paths produce the same graph.
+    """
+    nodes = db.execute_and_fetch(
+        """
+        MATCH (n)
+        RETURN labels(n) AS labels, coalesce(n.full_name, n.name) AS key, properties(n) AS props
+        """
+    )
+    rels = db.execute_and_fetch(
+        """
+        MATCH (a)-[r]->(b)
+        RETURN type(r) AS type, coalesce(a.full_name, a.name) AS start,
+               coalesce(b.full_name, b.name) AS end, properties(r) AS props
+        """
+    )
+    return {
+        "nodes": sorted((tuple(n["labels"]), n["key"], json.dumps(n["props"], sort_keys=True, default=str)) for n in nodes),
+        "relationships": sorted((r["type"], r["start"], r["end"], json.dumps(r["props"], sort_keys=True, default=str)) for r in rels),
+    }
+
+
 # --- Schema Import Functions (Keep yours, added checks for connections) ---
 def get_table_schema_duckdb(db_conn: duckdb.DuckDBPyConnection, target_full_table_name: str) -> Optional[Tuple[List[Tuple[str, str, Optional[str], Optional[str]]], Optional[str]]]:
     """Gets table schema and comments from DuckDB."""
@@ -446,6 +769,17 @@ def get_table_schema_duckdb(db_conn: duckdb.DuckDBPyConnection, target_full_tabl
         return None, None
     target_schema_name, target_table_name = target_full_table_name.split('.', 1)
 
+    if duckdb_catalog is not None:
+        try:
+            fields, table_comment = duckdb_catalog.get_table_schema(target_full_table_name)
+            if fields is None:
+                logging.warning(f"Could not get schema for table '{target_full_table_name}' or it's empty.")
+                return None, None
+            logging.debug(f"Served schema for {target_full_table_name} from catalog snapshot ({len(fields)} columns).")
+            return fields, table_comment
+        except Exception as e:
+            logging.error(f"DuckDB catalog snapshot failed, falling back to per-table lookup: {e}")
+
     try:
         # Use qualified name in PRAGMA
         schema_info = db_conn.execute(f"PRAGMA table_info('{target_full_table_name}');").fetchall()
@@ -492,8 +826,14 @@ def import_schema_to_memgraph(
     memgraph_conn,
     duckdb_conn: duckdb.DuckDBPyConnection,
     target_full_table_name: str,
+    imported_tables: Optional[set] = None,
 ) -> None:
-    """Imports table schema from DuckDB into Memgraph nodes and properties."""
+    """
+    Imports table schema from DuckDB into Memgraph nodes and properties.
+    The table is recorded in imported_tables (default IMPORTED_SCHEMA_TABLES) once
+    its statements are sent. When memgraph_conn is a StatementBuffer, pass a set per
+    transaction and merge it into IMPORTED_SCHEMA_TABLES only after the commit.
+    """
     if not memgraph_conn:
         logging.error("Memgraph connection not available, cannot import schema.")
         return
@@ -503,6 +843,9 @@ def import_schema_to_memgraph(
 
     # Normalize name before getting schema
     target_full_table_name = normalize_table_name(target_full_table_name)
+    if target_full_table_name in IMPORTED_SCHEMA_TABLES or (imported_tables is not None and target_full_table_name in imported_tables):
+        logging.debug(f"Schema for '{target_full_table_name}' already imported in this run, skipping.")
+        return
     table_schema, table_comment = get_table_schema_duckdb(duckdb_conn, target_full_table_name)
 
     if table_schema is None:
@@ -566,6 +909,7 @@ def import_schema_to_memgraph(
             memgraph_conn.execute(merge_col_query, col_params)
             logging.debug(f"  Merged Column '{col_full_name}' with properties.")
 
+        (IMPORTED_SCHEMA_TABLES if imported_tables is None else imported_tables).add(target_full_table_name)
         logging.info(f"Successfully imported schema for table '{target_full_table_name}'")
 
     except Exception as e:
@@ -597,28 +941,524 @@ def extract_table_names(data: dict) -> list[str]:
     return list(normalized_tables)
 
 def load_all_json_files(directory_path: str | Path) -> list[Tuple[Path, dict]]:
-    """Loads all JSON files in a directory, returning (filepath, data) tuples."""
-    path = Path(directory_path)
-    if not path.is_dir():
-        logging.error(f"Not a directory: {path}")
-        raise NotADirectoryError(f"Not a directory: {path}")
-
-    json_data_list = []
-    for json_file in sorted(path.glob("*.json")): # Sort for predictable order
+    """
+    Loads all JSON files in a directory, returning (filepath, data) tuples.
+    Holds every document in memory; main() iterates stream_json_documents() instead.
+    """
+    return list(stream_json_documents(directory_path))
+
+
+def resolve_script_and_pipeline(json_filepath: Path) -> Tuple[Optional[str], Optional[str]]:
+    """Maps a lineage JSON file to its (script_name, pipeline_name) using SCRIPT_TO_PIPELINE_MAP."""
+    # Assumption: script name is the JSON filename without .json
+    potential_script_name = json_filepath.stem
+    if potential_script_name in SCRIPT_TO_PIPELINE_MAP:
+        script_name = potential_script_name
+        pipeline_name = SCRIPT_TO_PIPELINE_MAP[script_name]
+        logging.info(f"Identified Script: '{script_name}', Pipeline: '{pipeline_name}'")
+        return script_name, pipeline_name
+
+    # Handle cases where filename doesn't match a known script
+    for known_script in SCRIPT_TO_PIPELINE_MAP.keys():
+        if potential_script_name.startswith(known_script.replace('.sql','')):
+            pipeline_name = SCRIPT_TO_PIPELINE_MAP[known_script]
+            logging.info(f"Matched Script based on prefix: '{known_script}', Pipeline: '{pipeline_name}'")
+            return known_script, pipeline_name
+
+    logging.warning(f"Could not determine Script/Pipeline for JSON file {json_filepath.name}. Skipping Pipeline/Script linking for this file.")
+    return None, None
+
+
+# --- Parallel Ingest Pipeline ---
+def connect_memgraph() -> Memgraph:
+    """Opens a new Memgraph connection (one per writer thread)."""
+    return Memgraph(host=MEMGRAPH_HOST, port=MEMGRAPH_PORT)
+
+
+def new_transactional_writer() -> TransactionalWriter:
+    """Opens a transactional writer (one per writer thread) reporting into tx_stats."""
+    return TransactionalWriter(MEMGRAPH_HOST, MEMGRAPH_PORT, stats=tx_stats, max_retries=TX_MAX_RETRIES)
+
+
+CONSTRAINTS_AND_INDEXES = [
+    "CREATE CONSTRAINT ON (s:Schema) ASSERT s.name IS UNIQUE;",
+    "CREATE INDEX ON :Schema(name);",
+    "CREATE CONSTRAINT ON (t:Table) ASSERT t.full_name IS UNIQUE;",
+    "CREATE INDEX ON :Table(full_name);",
+    "CREATE CONSTRAINT ON (c:Column) ASSERT c.full_name IS UNIQUE;",
+    "CREATE INDEX ON :Column(full_name);",
+    # Add constraints/indexes for Pipeline and Script
+    "CREATE CONSTRAINT ON (p:Pipeline) ASSERT p.name IS UNIQUE;",
+    "CREATE INDEX ON :Pipeline(name);",
+    "CREATE CONSTRAINT ON (s:Script) ASSERT s.name IS UNIQUE;",
+    "CREATE INDEX ON :Script(name);",
+]
+
+
+def ensure_constraints_and_indexes(db) -> None:
+    """
+    Creates the uniqueness constraints and indexes for the lineage graph. Run before
+    loading: MERGEs use the indexes, and the constraints turn concurrent creation of
+    the same node in two transactions into a retryable error instead of a duplicate.
+    """
+    logging.info("Ensuring constraints and indexes...")
+    for statement in CONSTRAINTS_AND_INDEXES:
+        try:
+            db.execute(statement)
+        except Exception as e:
+            # Ignore errors if they already exist (common for constraints/indexes)
+            err_msg = str(e).lower()
+            if "already exists" in err_msg or "constraint requires" in err_msg or "index already exists" in err_msg:
+                logging.debug(f"Constraint/Index already exists: {statement.split(' ON ')[0]}")
+            else:
+                logging.warning(f"Could not apply constraint/index '{statement}': {e}")
+    logging.info("Finished applying constraints and indexes.")
+
+
+def partition_rows(rows: list, key_fields: tuple, partitions: int) -> list[list]:
+    """
+    Splits UNWIND rows into at most `partitions` lists such that no node key
+    (values of key_fields) appears in two lists. Rows touching the same nodes are
+    grouped via union-find, so concurrent writers never MERGE the same node or
+    attach edges to it at the same time. Row order is kept within each list.
+    """
+    parent = {}
+
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for row in rows:
+        first, *others = [row[field] for field in key_fields]
+        root = find(first)
+        for key in others:
+            other_root = find(key)
+            if other_root != root:
+                parent[other_root] = root
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(find(row[key_fields[0]]), []).append(row)
+
+    # Largest groups first onto the currently smallest partition
+    buckets = [[] for _ in range(max(1, partitions))]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(buckets, key=len).extend(group)
+    return [bucket for bucket in buckets if bucket]
+
+
+def partition_groups(group_keys: list[set], partitions: int) -> list[list[int]]:
+    """
+    Assigns transaction groups (given by the node keys each one owns, see
+    LineageBatch.owned_keys()) to at most `partitions` writers with partition_rows():
+    groups sharing a key land on the same writer, which commits them in order.
+    Returns the group indexes per writer, in their original order.
+    """
+    rows = [{"group": ("group", index), "node": ("group", index)} for index in range(len(group_keys))]
+    rows += [{"group": ("group", index), "node": key} for index, keys in enumerate(group_keys) for key in keys]
+    return [
+        sorted({row["group"][1] for row in part})
+        for part in partition_rows(rows, ("group", "node"), partitions)
+    ]
+
+
+def write_lineage_batch_parallel(batch: LineageBatch, workers: int, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """
+    Writes a LineageBatch from `workers` Memgraph connections. Statements run one
+    after another (nodes before edges); the rows of each statement are split with
+    partition_rows() and written concurrently.
+    """
+    local = threading.local()
+
+    def write_part(query, rows):
+        if not hasattr(local, "db"):
+            local.db = connect_memgraph()
+        sent = 0
+        for start in range(0, len(rows), batch_size):
+            local.db.execute(query, {"rows": rows[start:start + batch_size]})
+            sent += 1
+        return sent
+
+    statements_sent = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="memgraph-writer") as executor:
+        for query, rows, key_fields in batch.statements():
+            parts = partition_rows(rows, key_fields, workers)
+            for sent in executor.map(lambda part: write_part(query, part), parts):
+                statements_sent += sent
+    logging.info(f"Parallel loaded {batch.documents} lineage document(s) with {workers} writers: {len(batch.tables)} tables, {len(batch.columns)} columns, {len(batch.derived_from)} DERIVED_FROM edges in {statements_sent} UNWIND statements.")
+    return statements_sent
+
+
+def parse_lineage_file(json_filepath: Path) -> Optional[dict]:
+    """
+    Stage 1: reads, hashes and normalises one lineage JSON file. Files above
+    LARGE_DOCUMENT_BYTES keep their 'lineage' on disk (see lineage_stream).
+    """
+    try:
+        lineage_data, json_hash = load_json_document(json_filepath, LARGE_DOCUMENT_BYTES)
+    except (json.JSONDecodeError, UnicodeDecodeError, OSError) as e:
+        logging.warning(f"Skipped loading {json_filepath.name}: {e}")
+        return None
+
+    script_name, pipeline_name = resolve_script_and_pipeline(json_filepath)
+    lineage_data = update_function_name(lineage_data)
+    return {
+        "path": json_filepath,
+        "data": lineage_data,
+        "script_name": script_name,
+        "pipeline_name": pipeline_name,
+        "json_hash": json_hash,
+        "sql_hash": sha256_file(os.path.join(SQL_FILES_DIR, script_name)) if script_name else None,
+        "table_names": [
+            table_name for table_name in extract_table_names(lineage_data)
+            if table_name and '.' in table_name and not table_name.startswith("csv_files.")
+        ],
+    }
+
+
+def retract_lineage_edges(db, derived_from: list, reads_from: list, generates: list, batch_size: int = BULK_BATCH_SIZE) -> None:
+    """Deletes the given DERIVED_FROM (tgt, src), READS_FROM and GENERATES (script, col) edges."""
+    retractions = [
+        (
+            """
+            UNWIND $rows AS row
+            MATCH (:Column {full_name: row[0]})-[r:DERIVED_FROM]->(:Column {full_name: row[1]})
+            DELETE r
+            """,
+            derived_from
+        ),
+        (
+            """
+            UNWIND $rows AS row
+            MATCH (:Script {name: row[0]})-[r:READS_FROM]->(:Column {full_name: row[1]})
+            DELETE r
+            """,
+            reads_from
+        ),
+        (
+            """
+            UNWIND $rows AS row
+            MATCH (:Script {name: row[0]})-[r:GENERATES]->(:Column {full_name: row[1]})
+            DELETE r
+            """,
+            generates
+        ),
+    ]
+    for query, rows in retractions:
+        rows = [list(edge) for edge in rows]
+        for start in range(0, len(rows), batch_size):
+            db.execute(query, {"rows": rows[start:start + batch_size]})
+    logging.info(f"Retracted {len(derived_from)} stale DERIVED_FROM, {len(reads_from)} READS_FROM and {len(generates)} GENERATES edges.")
+
+
+def run_ingest_pipeline(
+    json_dir: str | Path,
+    workers: int = INGEST_WORKERS,
+    incremental: bool = USE_INCREMENTAL_INGEST,
+    manifest_path: str = INGEST_MANIFEST_PATH,
+    use_transactions: bool = USE_TRANSACTIONS,
+    documents_per_transaction: int = DOCUMENTS_PER_TRANSACTION,
+    max_pending_documents: int = MAX_PENDING_DOCUMENTS,
+    dry_run: bool = False,
+) -> list[LineageBatch]:
+    """
+    Staged, parallel, streaming version of the main() loop:
+      1. stream the JSON files in sorted order through a worker pool that parses,
+         hashes and normalises each one and resolves its DuckDB table schemas (each
+         distinct table once; one cursor per thread unless the catalog snapshot is
+         used). At most max_pending_documents parsed documents wait for the writer,
+      2. skip documents whose JSON, SQL and schema hashes match the manifest (incremental mode),
+      3. add the remaining documents to LineageBatches in file order
+         (schemas before lineage, as main() does) and write them from `workers`
+         Memgraph connections:
+         - use_transactions: the shared nodes (Pipelines, Schemas, and tables and
+           columns a document reads without generating them) are MERGEd first in
+           one transaction, with their file-order ON CREATE values. Then one explicit transaction per group of
+           documents_per_transaction documents: partition_groups() routes groups
+           owning the same node to the same writer, which commits them in file
+           order. Conflicts left (edges onto shared nodes, other clients) are
+           retried with backoff (needs the unique constraints from
+           ensure_constraints_and_indexes()),
+         - otherwise: one autocommit batch split into conflict-free partitions,
+      4. retract DERIVED_FROM/READS_FROM/GENERATES edges that changed or removed
+         documents no longer assert. Safe after the writes: an edge any current
+         document asserts is never stale.
+    dry_run builds one batch of all documents without touching Memgraph or the manifest.
+    Returns the written (or built) LineageBatches, in transactional mode the shared
+    nodes first and then one per group in file order: applied in that order they
+    give the graph the writers leave in Memgraph.
+    """
+    if dry_run:
+        incremental = use_transactions = False
+    schema_cache = {}
+    local = threading.local()
+
+    def resolve_schema(table_name):
+        if table_name not in schema_cache:
+            if duckdb_catalog is not None:
+                # Snapshot lookups are dictionary hits
+                schema_cache[table_name] = get_table_schema_duckdb(duckdb_conn, table_name)
+            elif duckdb_conn:
+                if not hasattr(local, "cursor"):
+                    local.cursor = duckdb_conn.cursor() # DuckDB connections are not shared across threads
+                schema_cache[table_name] = get_table_schema_duckdb(local.cursor, table_name)
+            else:
+                schema_cache[table_name] = (None, None)
+        return schema_cache[table_name]
+
+    def prepare_document(json_filepath):
+        doc = parse_lineage_file(json_filepath)
+        if doc:
+            doc["table_schemas"] = {table_name: resolve_schema(table_name) for table_name in doc["table_names"]}
+        return json_filepath, doc
+
+    if not duckdb_conn:
+        logging.info("Skipping schema import step as DuckDB connection is not available.")
+
+    old_documents = load_manifest(manifest_path)["documents"] if incremental else {}
+    new_documents = {}
+    imported_schema_tables = set() # Tables whose schema rows are written (transactional mode: committed)
+    schema_tables_lock = threading.Lock()
+    batches = []
+    parsed = skipped = 0
+
+    def add_table_schemas(target, table_schemas):
+        for table_name, (table_schema, table_comment) in table_schemas.items():
+            if not target.add_table_schema(table_name, table_schema, table_comment) and duckdb_conn:
+                logging.warning(f"Skipping schema import for table '{table_name}' due to missing schema information.")
+
+    # Transactional mode: groups of documents_per_transaction documents, as
+    # (file names, [(table schemas, document batch), ...], owned node keys)
+    groups = []
+    shared_batch = LineageBatch() # All groups in file order, for the shared nodes' ON CREATE values
+    shared_keys = set()
+    group_size = max(1, documents_per_transaction)
+    group_names, group_documents, group_keys = [], [], set()
+    failed_groups = []
+    group_batches = []
+
+    def write_lane(group_indexes):
+        # Groups of one lane share nodes, so they are committed one after another.
+        # Each group's batch is built just before its commit: a table's schema rows
+        # are left out only once an earlier transaction has committed them.
+        writer = new_transactional_writer()
         try:
-            with open(json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                json_data_list.append((json_file, data)) # Store path along with data
-                logging.debug(f"Successfully loaded JSON: {json_file.name}")
-        except (json.JSONDecodeError, OSError) as e:
-            logging.warning(f"Skipped loading {json_file.name}: {e}")
+            for index in group_indexes:
+                names, documents, _ = groups[index]
+                with schema_tables_lock:
+                    batch = LineageBatch(schema_tables=set(imported_schema_tables))
+                for table_schemas, doc_batch in documents:
+                    for table_name, (table_schema, table_comment) in table_schemas.items():
+                        batch.add_table_schema(table_name, table_schema, table_comment)
+                    batch.merge(doc_batch)
+                group_batches[index] = batch
+                if writer.run(batch.transaction_statements(), label=", ".join(names)):
+                    with schema_tables_lock:
+                        imported_schema_tables.update(batch.schema_tables)
+                else:
+                    failed_groups.append(names) # Its schemas stay unmarked, later groups write them again
+        finally:
+            writer.close()
+
+    batch = None
+    for json_filepath, doc in bounded_map(prepare_document, iter_json_files(json_dir), workers, max_pending_documents, "lineage-parse"):
+        if not doc:
+            if json_filepath.name in old_documents:
+                # Unreadable now, not deleted: keep its edges and entry until it parses again
+                new_documents[json_filepath.name] = old_documents[json_filepath.name]
+            continue
+        parsed += 1
+        name = doc["path"].name
+        schema_hash = sha256_json(doc["table_schemas"])
+        old_entry = old_documents.get(name)
+        if incremental and document_unchanged(old_entry, doc["json_hash"], doc["sql_hash"], schema_hash):
+            new_documents[name] = old_entry
+            skipped += 1
+            logging.debug(f"Unchanged since last ingest, skipping: {name}")
+            continue
+
+        doc_batch = LineageBatch() # Per-document edge set, recorded in the manifest for later diffs
+        if doc["script_name"] and doc["pipeline_name"]:
+            doc_batch.add_document(doc["data"], doc["script_name"], doc["pipeline_name"])
+        else:
+            logging.warning(f"Skipping lineage loading for {name} due to missing script/pipeline context.")
+        new_documents[name] = {
+            "json_hash": doc["json_hash"],
+            "sql_hash": doc["sql_hash"],
+            "schema_hash": schema_hash,
+            "script_name": doc["script_name"],
+            "derived_from": [list(edge) for edge in doc_batch.derived_from],
+            "reads_from": [list(edge) for edge in doc_batch.reads_from],
+            "generates": [list(edge) for edge in doc_batch.generates],
+        }
+
+        if not use_transactions:
+            # Everything goes into a single batch, schemas before lineage as main() does
+            if batch is None:
+                batch = LineageBatch(schema_tables=imported_schema_tables)
+                batches.append(batch)
+            add_table_schemas(batch, doc["table_schemas"])
+            batch.merge(doc_batch)
+            continue
+
+        schema_batch = LineageBatch() # Only for the node keys the document's schema rows may touch
+        add_table_schemas(schema_batch, doc["table_schemas"])
+        shared_batch.merge(schema_batch)
+        shared_batch.merge(doc_batch)
+        # Nodes a document only reads may be owned by another group: they are created
+        # up front so that their ON CREATE values do not depend on which group commits first
+        shared_keys |= (schema_batch.node_keys() | doc_batch.node_keys()) - doc_batch.owned_keys()
+        group_names.append(name)
+        group_documents.append((doc["table_schemas"], doc_batch))
+        group_keys |= doc_batch.owned_keys()
+        if len(group_names) >= group_size:
+            groups.append((group_names, group_documents, group_keys))
+            group_names, group_documents, group_keys = [], [], set()
+
+    if group_names:
+        groups.append((group_names, group_documents, group_keys))
+    if groups:
+        # Nearly every document touches a Schema or Pipeline node: created up front,
+        # they no longer tie all groups to one writer
+        shared = shared_batch.shared_nodes(shared_keys)
+        writer = new_transactional_writer()
+        if not writer.run(shared.transaction_statements(), label="shared nodes"):
+            logging.warning("Could not create the shared nodes up front, the writers MERGE them concurrently.")
+        writer.close()
+        lanes = partition_groups([keys for _, _, keys in groups], workers)
+        group_batches.extend([None] * len(groups))
+        with ThreadPoolExecutor(max_workers=len(lanes), thread_name_prefix="memgraph-tx") as tx_executor:
+            for future in [tx_executor.submit(write_lane, lane) for lane in lanes]:
+                future.result()
+        batches = [shared] + group_batches
+        logging.info(f"Committed {len(groups)} transaction group(s) from {len(lanes)} conflict-free writer(s).")
+    logging.info(f"Parsed {parsed} JSON files from {json_dir}")
+
+    if not batches:
+        logging.info("Nothing to load, graph is up to date.")
+    elif dry_run:
+        logging.info(f"Dry run: built {batches[0].documents} lineage document(s), nothing written.")
+    elif use_transactions:
+        for names in failed_groups:
+            # Keep the previous manifest entry so the next run retries these documents
+            for name in names:
+                if name in old_documents:
+                    new_documents[name] = old_documents[name]
+                else:
+                    new_documents.pop(name, None)
+        logging.info(f"Transactional load of {len(batches) - 1} transaction group(s): {tx_stats.as_dict()}")
+    elif workers > 1:
+        write_lineage_batch_parallel(batches[0], workers)
+    else:
+        write_lineage_batch(memgraph, batches[0])
+
+    if incremental:
+        logging.info(f"Incremental ingest: {skipped} unchanged, {parsed - skipped} new or changed, {len(set(old_documents) - set(new_documents))} removed.")
+        stale = {edge_type: stale_edges(old_documents, new_documents, edge_type) for edge_type in ("derived_from", "reads_from", "generates")}
+        if any(stale.values()):
+            if use_transactions:
+                buffer = StatementBuffer()
+                retract_lineage_edges(buffer, stale["derived_from"], stale["reads_from"], stale["generates"])
+                writer = new_transactional_writer()
+                retracted = writer.run(buffer.statements, label="retract stale edges")
+                writer.close()
+            else:
+                retract_lineage_edges(memgraph, stale["derived_from"], stale["reads_from"], stale["generates"])
+                retracted = True
+            if not retracted:
+                # Keep the previous entries of changed and removed documents, so the
+                # next run finds the same edges stale and retracts them again
+                logging.error("Retracting stale edges failed, the next run retries it.")
+                for name, old_entry in old_documents.items():
+                    new_documents[name] = old_entry
+        save_manifest(manifest_path, {"version": MANIFEST_VERSION, "documents": new_documents})
+    return batches
+
+
+# --- Offline Export ---
+def build_lineage_graph(json_dir: str | Path, workers: int = INGEST_WORKERS, sql_dir: str = SQL_FILES_DIR) -> LineageGraph:
+    """
+    Builds in memory the graph main() would load into an empty Memgraph: the lineage
+    and DuckDB schemas (via run_ingest_pipeline(dry_run=True)), then the Script
+    properties and DEPENDS_ON edges, in main()'s order.
+    """
+    graph = LineageGraph()
+    for batch in run_ingest_pipeline(json_dir, workers, dry_run=True):
+        graph.add_batch(batch)
+    try:
+        graph.add_script_properties(read_all_sql_files(sql_dir), sql_content_hash)
+    except ValueError as e:
+        logging.warning(f"Skipping Script properties in export: {e}")
+    for label, path in (("Pipeline", PIPELINE_DEPENDENCY_PATH), ("Script", SCRIPT_DEPENDENCY_PATH)):
+        try:
+            graph.add_dependencies(label, build_dependency_edges(load_dependency_map(path)))
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Skipping {label} dependencies in export: {e}")
+    return graph
+
+
+def export_lineage(json_dir: str | Path, export_dir: str, export_format: str = EXPORT_FORMAT, workers: int = INGEST_WORKERS) -> LineageGraph:
+    """
+    Writes the lineage graph as bulk import files instead of MERGEing it into Memgraph:
+      - "csv": node/relationship CSVs and load_csv.cypherl (LOAD CSV statements),
+      - "cypherl": lineage.cypherl for `mgconsole < lineage.cypherl`.
+    Both start with CONSTRAINTS_AND_INDEXES and expect an empty database.
+    Returns the exported graph.
+    """
+    graph = build_lineage_graph(json_dir, workers)
+    if export_format == "csv":
+        export_csv(graph, export_dir, CONSTRAINTS_AND_INDEXES)
+        # The files must read back to the same graph
+        differences = compare_graphs(graph, read_csv_export(export_dir))
+        if differences:
+            logging.error(f"CSV export does not round-trip: {differences}")
+    elif export_format == "cypherl":
+        export_cypherl(graph, os.path.join(export_dir, CYPHERL_FILE), CONSTRAINTS_AND_INDEXES)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return graph
+
 
-    logging.info(f"Loaded {len(json_data_list)} JSON files from {directory_path}")
-    return json_data_list
+def verify_export_against_memgraph(export_dir: str, db=None) -> dict:
+    """
+    Compares a CSV export with the graph in Memgraph (e.g. after running main() with
+    the online loader on an empty database). Returns compare_graphs() differences;
+    empty means the offline and online paths produced the same graph.
+    """
+    differences = compare_graphs(read_csv_export(export_dir), graph_from_memgraph(db or memgraph))
+    if differences:
+        logging.warning(f"Export and Memgraph differ: {differences}")
+    else:
+        logging.info("Export matches the graph in Memgraph.")
+    return differences
 
 
 # --- Main Execution Logic ---
-def main():
+def main(
+    use_bulk_load: bool = USE_BULK_LOAD,
+    workers: int = INGEST_WORKERS,
+    incremental: bool = USE_INCREMENTAL_INGEST,
+    use_transactions: bool = USE_TRANSACTIONS,
+    documents_per_transaction: int = DOCUMENTS_PER_TRANSACTION,
+    export_dir: Optional[str] = EXPORT_DIR,
+    export_format: str = EXPORT_FORMAT,
+):
+    # --- Define JSON source directory ---
+    json_dir = "/app/agentic/Agent_LLM_JSONs"
+    #json_dir = "/app/src/LLM_answers/llm_prompt_for_column_level_lineage_hard_w_ex/2"
+
+    # Export mode: write import files, no Memgraph connection needed
+    if export_dir:
+        try:
+            export_lineage(json_dir, export_dir, export_format, workers)
+        finally:
+            if duckdb_conn:
+                duckdb_conn.close()
+        return
+
     if not memgraph:
         logging.critical("Cannot proceed without a Memgraph connection.")
         return
@@ -626,43 +1466,38 @@ def main():
         logging.warning("Cannot proceed with schema import without DuckDB connection.")
         # Allow proceeding without schema import if desired
 
-    # --- Define JSON source directory ---
-    json_dir = "/app/agentic/Agent_LLM_JSONs"
-    #json_dir = "/app/src/LLM_answers/llm_prompt_for_column_level_lineage_hard_w_ex/2"
+    IMPORTED_SCHEMA_TABLES.clear()
 
     try:
-        all_json_data = load_all_json_files(json_dir)
-
-        # Process each loaded JSON file
+        ensure_constraints_and_indexes(memgraph)
+
+        # Bulk mode: staged pipeline replaces the per-row loop below
+        if use_bulk_load:
+            all_json_data = []
+            run_ingest_pipeline(json_dir, workers, incremental, use_transactions=use_transactions, documents_per_transaction=documents_per_transaction)
+        else:
+            all_json_data = stream_json_documents(json_dir) # Lazy: one document in memory at a time
+
+        # Per-row path in transactional mode: record the statements of each group of
+        # documents and commit them together
+        buffer = StatementBuffer() if use_transactions and not use_bulk_load else None
+        target_db = buffer if buffer is not None else memgraph
+        writer = new_transactional_writer() if buffer is not None else None
+        buffered_files = []
+        buffered_schema_tables = set() if buffer is not None else None # Marked imported once committed
+
+        def commit_buffer():
+            if writer.run(buffer.statements, label=", ".join(buffered_files)):
+                IMPORTED_SCHEMA_TABLES.update(buffered_schema_tables)
+            buffer.clear()
+            buffered_schema_tables.clear()
+
+        # Process each JSON file as it is read
         for json_filepath, lineage_data in all_json_data:
             logging.info(f"--- Processing file: {json_filepath.name} ---")
 
             # **Determine Script and Pipeline Name**
-            # Assumption: script name is the JSON filename without .json
-            potential_script_name = json_filepath.stem
-            script_name = None
-            pipeline_name = None
-
-            # Check if the potential name looks like a script file we know
-            if potential_script_name in SCRIPT_TO_PIPELINE_MAP:
-                script_name = potential_script_name
-                pipeline_name = SCRIPT_TO_PIPELINE_MAP[script_name]
-                logging.info(f"Identified Script: '{script_name}', Pipeline: '{pipeline_name}'")
-            else:
-                # Handle cases where filename doesn't match a known script
-                # Maybe try matching based on suffix?
-                found = False
-                for known_script in SCRIPT_TO_PIPELINE_MAP.keys():
-                    if potential_script_name.startswith(known_script.replace('.sql','')):
-                         script_name = known_script
-                         pipeline_name = SCRIPT_TO_PIPELINE_MAP[script_name]
-                         logging.info(f"Matched Script based on prefix: '{script_name}', Pipeline: '{pipeline_name}'")
-                         found = True
-                         break
-                if not found:
-                     logging.warning(f"Could not determine Script/Pipeline for JSON file {json_filepath.name}. Skipping Pipeline/Script linking for this file.")
-                     # Decide: skip entirely, or load lineage without pipeline/script links?
-                     # continue # Option: Skip this file entirely
+            script_name, pipeline_name = resolve_script_and_pipeline(json_filepath)
 
 
             # Update CSV source names if needed
@@ -674,7 +1509,7 @@ def main():
                 for table_name in table_names_for_schema:
                     if table_name and '.' in table_name and not table_name.startswith("csv_files."): # Avoid schema import for generic CSVs
                         logging.debug(f"Importing schema for: {table_name}")
-                        import_schema_to_memgraph(memgraph, duckdb_conn, table_name)
+                        import_schema_to_memgraph(target_db, duckdb_conn, table_name, buffered_schema_tables)
                     else:
                         logging.debug(f"Skipping schema import for non-standard or CSV table: {table_name}")
             else:
@@ -683,38 +1518,23 @@ def main():
 
             # Load the column-level lineage with script/pipeline context
             if script_name and pipeline_name:
-                 load_lineage_to_memgraph(memgraph, lineage_data, script_name, pipeline_name)
+                 load_lineage_to_memgraph(target_db, lineage_data, script_name, pipeline_name)
             else:
                  logging.warning(f"Skipping lineage loading for {json_filepath.name} due to missing script/pipeline context.")
                  # Alternatively, call load_lineage without script/pipeline context if you want partial data
                  # load_lineage_to_memgraph(memgraph, lineage_data, None, None) # Requires adjusting the function to handle None
 
-        # --- Create Constraints/Indexes ---
-        logging.info("Ensuring constraints and indexes...")
-        constraints_indexes = [
-            "CREATE CONSTRAINT ON (s:Schema) ASSERT s.name IS UNIQUE;",
-            "CREATE INDEX ON :Schema(name);",
-            "CREATE CONSTRAINT ON (t:Table) ASSERT t.full_name IS UNIQUE;",
-            "CREATE INDEX ON :Table(full_name);",
-            "CREATE CONSTRAINT ON (c:Column) ASSERT c.full_name IS UNIQUE;",
-            "CREATE INDEX ON :Column(full_name);",
-            # Add constraints/indexes for Pipeline and Script
-            "CREATE CONSTRAINT ON (p:Pipeline) ASSERT p.name IS UNIQUE;",
-            "CREATE INDEX ON :Pipeline(name);",
-            "CREATE CONSTRAINT ON (s:Script) ASSERT s.name IS UNIQUE;",
-            "CREATE INDEX ON :Script(name);",
-        ]
-        for statement in constraints_indexes:
-            try:
-                memgraph.execute(statement)
-            except Exception as e:
-                # Ignore errors if they already exist (common for constraints/indexes)
-                err_msg = str(e).lower()
-                if "already exists" in err_msg or "constraint requires" in err_msg or "index already exists" in err_msg:
-                    logging.debug(f"Constraint/Index already exists: {statement.split(' ON ')[0]}")
-                else:
-                    logging.warning(f"Could not apply constraint/index '{statement}': {e}")
-        logging.info("Finished applying constraints and indexes.")
+            if writer is not None:
+                buffered_files.append(json_filepath.name)
+                if len(buffered_files) >= max(1, documents_per_transaction):
+                    commit_buffer()
+                    buffered_files = []
+
+        if writer is not None:
+            commit_buffer()
+            writer.close()
+        if use_transactions:
+            logging.info(f"Transactions: {tx_stats.as_dict()}")
 
         logging.info("\nLineage loading process complete.")
 
@@ -735,7 +1555,7 @@ def main():
 
     # set sql and paths
 
-    sql_files_dict = read_all_sql_files("/app/src/main/sql_for_pipelines")
+    sql_files_dict = read_all_sql_files(SQL_FILES_DIR)
     update_script_properties(memgraph, sql_files_dict)
     dependencies(memgraph)
 
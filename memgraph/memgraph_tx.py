@@ -0,0 +1,141 @@
+import time
+import random
+import logging
+import threading
+from typing import Optional, List, Tuple
+
+import mgclient
+
+# Substrings of Memgraph errors that are safe to retry: the transaction lost a
+# write-write conflict, or a concurrent MERGE created the node first.
+TRANSIENT_ERROR_MARKERS = (
+    "conflicting transactions",
+    "serialization error",
+    "retry this transaction",
+    "unique constraint violation",
+)
+
+
+def is_transient_error(e: Exception) -> bool:
+    """True for Memgraph conflict errors and lost connections, which are worth retrying."""
+    if isinstance(e, (mgclient.InterfaceError, mgclient.OperationalError)):
+        return True
+    message = str(e).lower()
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+class StatementBuffer:
+    """
+    Stands in for a gqlalchemy connection and records execute() calls, so code
+    written against db.execute (load_lineage_to_memgraph, import_schema_to_memgraph)
+    can be replayed as one transaction.
+    """
+
+    def __init__(self):
+        self.statements: List[Tuple[str, dict]] = []
+
+    def execute(self, query: str, parameters: Optional[dict] = None):
+        self.statements.append((query, parameters or {}))
+
+    def clear(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+
+class TransactionStats:
+    """Thread-safe committed/retried/failed counters shared by all writers of a run."""
+
+    def __init__(self):
+        self.committed = 0
+        self.retried = 0
+        self.failed = 0
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "committed": self.committed,
+                "retried": self.retried,
+                "failed": self.failed,
+                "statements": self.statements,
+            }
+
+
+class TransactionalWriter:
+    """
+    Runs lists of (query, params) as single explicit Bolt transactions on its own
+    mgclient connection, retrying transient conflicts with exponential backoff and
+    jitter. Not thread-safe: use one writer per thread.
+    """
+
+    def __init__(self, host: str, port: int, stats: Optional[TransactionStats] = None,
+                 max_retries: int = 5, base_backoff: float = 0.05, max_backoff: float = 2.0):
+        self.host = host
+        self.port = port
+        self.stats = stats or TransactionStats()
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = mgclient.connect(host=self.host, port=self.port)
+            self._conn.autocommit = False
+        return self._conn
+
+    def _discard_connection(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def run(self, statements: List[Tuple[str, dict]], label: str = "") -> bool:
+        """Executes all statements in one transaction. Returns True if it committed."""
+        if not statements:
+            return True
+        attempt = 0
+        while True:
+            try:
+                conn = self._connection()
+                cursor = conn.cursor()
+                for query, params in statements:
+                    cursor.execute(query, params or {})
+                conn.commit()
+                self.stats.add(committed=1, statements=len(statements))
+                logging.debug(f"Committed transaction {label} ({len(statements)} statements).")
+                return True
+            except Exception as e:
+                try:
+                    if self._conn is not None:
+                        self._conn.rollback()
+                except Exception:
+                    self._discard_connection()
+                if isinstance(e, (mgclient.InterfaceError, mgclient.OperationalError)):
+                    self._discard_connection()
+
+                if is_transient_error(e) and attempt < self.max_retries:
+                    attempt += 1
+                    self.stats.add(retried=1)
+                    delay = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+                    delay *= 0.5 + random.random() / 2 # Jitter so conflicting writers don't retry in lockstep
+                    logging.info(f"Transient error in transaction {label}, retry {attempt}/{self.max_retries} in {delay:.2f}s: {e}")
+                    time.sleep(delay)
+                    continue
+
+                self.stats.add(failed=1)
+                logging.error(f"Transaction {label} failed after {attempt} retries, rolled back: {e}")
+                return False
+
+    def close(self):
+        self._discard_connection()
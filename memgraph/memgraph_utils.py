@@ -1,8 +1,21 @@
 import os
 import json
+import hashlib
+import logging
+# Process-wide cache of read SQL files: full path -> ((mtime_ns, size), entry)
+_SQL_FILE_CACHE = {}
+
+
+def sql_content_hash(content: str) -> str:
+    """sha256 of a script's SQL text, stored as Script.sql_hash."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
 def read_all_sql_files(directory: str) -> dict:
     """
-    Recursively finds all SQL files in a directory and returns their contents and paths.
+    Recursively finds all SQL files in a directory and returns their contents, paths
+    and content hashes. Files whose mtime and size are unchanged since the last call
+    in this process are served from a cache instead of being read again.
     
     Args:
         directory: Path to the directory to search
@@ -11,11 +24,13 @@ def read_all_sql_files(directory: str) -> dict:
         dict: {
             'file1.sql': {
                 'content': 'SELECT * FROM...',
-                'path': '/full/path/to/file1.sql'
+                'path': '/full/path/to/file1.sql',
+                'sql_hash': '9f86d0...'
             },
             'file2.sql': {
                 'content': 'CREATE TABLE...',
-                'path': '/full/path/to/file2.sql'
+                'path': '/full/path/to/file2.sql',
+                'sql_hash': '60303a...'
             }
         }
         
@@ -32,143 +47,204 @@ def read_all_sql_files(directory: str) -> dict:
             if file.lower().endswith('.sql'):
                 full_path = os.path.join(root, file)
                 try:
+                    stat = os.stat(full_path)
+                    signature = (stat.st_mtime_ns, stat.st_size)
+                    cached = _SQL_FILE_CACHE.get(full_path)
+                    if cached and cached[0] == signature:
+                        sql_files[file] = cached[1]
+                        continue
                     with open(full_path, 'r', encoding='utf-8') as f:
                         content = f.read()
                     sql_files[file] = {
                         'content': content,
-                        'path': full_path
+                        'path': full_path,
+                        'sql_hash': sql_content_hash(content)
                     }
+                    _SQL_FILE_CACHE[full_path] = (signature, sql_files[file])
                 except IOError as e:
                     print(f"Warning: Could not read file {full_path} - {str(e)}")
                     continue
     
     return sql_files
 
-def dependencies(db):
-    # --- Reading in sql pipeline to process mapping ---
-    json_file_pipe_dep = "/app/src/main/pipeline_dependency.json"
-    with open(json_file_pipe_dep, "r", encoding="utf-8") as f:
-                    PIPELINE_DEPENDENCY = json.load(f)
-
-    json_file_script_dep = "/app/src/main/script_dependency.json"
-    with open(json_file_script_dep, "r", encoding="utf-8") as f:
-                    SCRIPT_DEPENDENCY = json.load(f)
-
-    pipe_deps_dict = {
-    pipeline: dependant
-    for pipeline, dependant in PIPELINE_DEPENDENCY.items()
-    for dependant in dependant
-    }
+PIPELINE_DEPENDENCY_PATH = "/app/src/main/pipeline_dependency.json"
+SCRIPT_DEPENDENCY_PATH = "/app/src/main/script_dependency.json"
+DEPENDENCY_BATCH_SIZE = 1000 # Max edges sent per UNWIND statement
 
-    script_depts_dict = {
-    script: dependant
-    for script, dependant in SCRIPT_DEPENDENCY.items()
-    for dependant in dependant
-    }
+# One statement per node label. Counts edges whose endpoints exist (matched) and
+# those already there before the MERGE (existing); the rest are created. Parallel
+# DEPENDS_ON edges are collapsed to one flag per node pair before counting.
+DEPENDENCY_EDGE_QUERY = """
+    UNWIND $rows AS row
+    MATCH (a:{label} {{name: row[0]}})
+    MATCH (b:{label} {{name: row[1]}})
+    OPTIONAL MATCH (a)-[existing:DEPENDS_ON]->(b)
+    WITH a, b, count(existing) > 0 AS existed
+    MERGE (a)-[:DEPENDS_ON]->(b)
+    RETURN count(*) AS matched, sum(CASE WHEN existed THEN 1 ELSE 0 END) AS existing
+"""
 
-    #return pipe_deps_dict, script_depts_dict
 
-    for pipe, dependant in pipe_deps_dict.items():
+def load_dependency_map(path: str) -> dict:
+    """Reads a {name: [names it depends on]} JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-        try:
-            db.execute(
-                """
-                MATCH (p:Pipeline {name: $pipe})
-                MATCH (p2:Pipeline {name: $dependant})
-                MERGE (p)-[:DEPENDS_ON]->(p2)
-                """,
-                {"pipe": pipe, "dependant": dependant} 
-            )
-        except Exception as e:
-            logging.error(f"Failed create dependency '{pipe}' > '{dependant}': {e}")
 
-    for script, dependant in script_depts_dict.items():
+def build_dependency_edges(dependency_map: dict) -> list:
+    """
+    Flattens {name: [dependencies]} into a sorted, de-duplicated list of
+    [name, dependency] edges. Every dependency is kept (not just the last one).
+    """
+    edges = set()
+    for name, depends_on in dependency_map.items():
+        for dependency in depends_on or []:
+            if name and dependency:
+                edges.add((name, dependency))
+    return [list(edge) for edge in sorted(edges)]
+
 
+def write_dependency_edges(db, label: str, edges: list, batch_size: int = DEPENDENCY_BATCH_SIZE) -> dict:
+    """
+    MERGEs (:label)-[:DEPENDS_ON]->(:label) for all [name, dependency] edges with one
+    UNWIND statement per batch. Returns {"created", "existing", "missing", "failed"} edge
+    counts; "missing" edges have an endpoint node that doesn't exist.
+    """
+    counts = {"created": 0, "existing": 0, "missing": 0, "failed": 0}
+    query = DEPENDENCY_EDGE_QUERY.format(label=label)
+    for start in range(0, len(edges), batch_size):
+        rows = edges[start:start + batch_size]
         try:
-            db.execute(
-                """
-                MATCH (s:Script {name: $script})
-                MATCH (s2:Script {name: $dependant})
-                MERGE (s)-[:DEPENDS_ON]->(s2)
-                """,
-                {"script": script, "dependant": dependant} 
-            )
-            logging.info(f"Created dependency '{script}' > '{dependant}'")
+            result = next(iter(db.execute_and_fetch(query, {"rows": rows})), None) or {}
         except Exception as e:
-            logging.error(f"Failed create dependency '{script}' > '{dependant}': {e}")    
+            logging.error(f"Failed to create {len(rows)} {label} dependencies: {e}")
+            counts["failed"] += len(rows)
+            continue
+        matched = result.get("matched", 0)
+        existing = result.get("existing", 0)
+        counts["created"] += matched - existing
+        counts["existing"] += existing
+        counts["missing"] += len(rows) - matched
+    logging.info(f"{label} DEPENDS_ON edges: {counts['created']} created, {counts['existing']} already present, {counts['missing']} with missing nodes, {counts['failed']} failed.")
+    return counts
 
 
-import logging
+def dependencies(db, pipeline_dependency: dict = None, script_dependency: dict = None) -> dict:
+    """
+    Loads Pipeline and Script DEPENDS_ON edges from pipeline_dependency.json and
+    script_dependency.json (or the already loaded maps passed in).
+    Returns the write_dependency_edges() counts per label.
+    """
+    # --- Reading in sql pipeline to process mapping ---
+    if pipeline_dependency is None:
+        pipeline_dependency = load_dependency_map(PIPELINE_DEPENDENCY_PATH)
+    if script_dependency is None:
+        script_dependency = load_dependency_map(SCRIPT_DEPENDENCY_PATH)
+
+    return {
+        "Pipeline": write_dependency_edges(db, "Pipeline", build_dependency_edges(pipeline_dependency)),
+        "Script": write_dependency_edges(db, "Script", build_dependency_edges(script_dependency)),
+    }
+
+
+SCRIPT_UPDATE_BATCH_SIZE = 500 # Max scripts (with their full SQL text) per UNWIND statement
+
 
-def update_script_properties(db, script_details):
+def fetch_script_hashes(db, script_names: list, batch_size: int = 1000) -> dict:
+    """Returns {name: (sql_hash, path_to_sql)} for the Script nodes that exist among script_names."""
+    existing = {}
+    for start in range(0, len(script_names), batch_size):
+        for row in db.execute_and_fetch(
+            """
+            MATCH (s:Script)
+            WHERE s.name IN $names
+            RETURN s.name AS name, s.sql_hash AS sql_hash, s.path_to_sql AS path
+            """,
+            {"names": script_names[start:start + batch_size]}
+        ):
+            existing[row["name"]] = (row["sql_hash"], row["path"])
+    return existing
+
+
+def update_script_properties(db, script_details, batch_size: int = SCRIPT_UPDATE_BATCH_SIZE, force: bool = False) -> dict:
     """
-    Updates existing Script nodes in Neo4j with their path and SQL content.
+    Updates existing Script nodes in Memgraph with their path, SQL content and sql_hash.
 
-    Finds Script nodes by their name and updates the 'path' and
-    'sql_content' properties based on the provided dictionary.
+    Reads the stored sql_hash/path of all scripts in one query, then sends only the
+    scripts whose SQL or path changed (all of them with force=True) in UNWIND batches.
 
     Args:
-        db: The database connection/session object with an 'execute' method.
+        db: The database connection/session object with 'execute_and_fetch'.
         script_details (dict): A dictionary where keys are script names (str)
                                and values are dictionaries containing 'path' (str)
-                               and 'content' (str).
+                               and 'content' (str), as returned by read_all_sql_files.
+                               'sql_hash' is computed if missing.
                                Example:
                                {
                                    'file1.sql': {
                                        'content': 'SELECT * FROM...',
                                        'path': '/full/path/to/file1.sql'
-                                   },
-                                   'file2.sql': {
-                                       'content': 'CREATE TABLE...',
-                                       'path': '/full/path/to/file2.sql'
                                    }
                                }
+        batch_size: Max scripts per UNWIND statement.
+        force: Rewrite every found script even if its hash matches.
+
+    Returns:
+        dict: {"updated", "unchanged", "not_found", "skipped", "failed"} script counts.
     """
-    updated_count = 0
-    not_found_count = 0
+    counts = {"updated": 0, "unchanged": 0, "not_found": 0, "skipped": 0, "failed": 0}
 
+    rows = []
     for script_name, details in script_details.items():
         if 'path' not in details or 'content' not in details:
             logging.warning(f"Skipping script '{script_name}': Missing 'path' or 'content'.")
+            counts["skipped"] += 1
             continue
-
+        rows.append({
+            "script_name": script_name,
+            "path": details['path'],
+            "content": details['content'],
+            "sql_hash": details.get('sql_hash') or sql_content_hash(details['content']),
+        })
+
+    try:
+        existing = fetch_script_hashes(db, [row["script_name"] for row in rows])
+    except Exception as e:
+        logging.error(f"Failed to read Script node hashes: {e}")
+        counts["failed"] += len(rows)
+        return counts
+
+    changed = []
+    for row in rows:
+        if row["script_name"] not in existing:
+            logging.warning(f"Script node not found, could not update: {row['script_name']}")
+            counts["not_found"] += 1
+        elif not force and existing[row["script_name"]] == (row["sql_hash"], row["path"]):
+            counts["unchanged"] += 1
+        else:
+            changed.append(row)
+
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
         try:
-            # MATCH the existing script node by name
-            # SET the properties using parameters
-            # Use OPTIONAL MATCH if you want to handle non-existent scripts gracefully
-            # or RETURN s to check if the node was found.
-            # This version uses RETURN count(s) to check if the node was found.
-            result = db.execute(
+            result = next(iter(db.execute_and_fetch(
                 """
-                MATCH (s:Script {name: $script_name})
-                SET s.path_to_sql = $path, s.sql_content = $content
-                RETURN count(s) as update_count
+                UNWIND $rows AS row
+                MATCH (s:Script {name: row.script_name})
+                SET s.path_to_sql = row.path, s.sql_content = row.content, s.sql_hash = row.sql_hash
+                RETURN count(s) AS update_count
                 """,
-                {
-                    "script_name": script_name,
-                    "path": details['path'],
-                    "content": details['content'] # Renamed parameter to avoid conflict
-                }
-            )
-            logging.info(f"Script node path, content updated: {script_name}")
-            # Assuming execute returns results allowing extraction,
-            # Check if the node was found and updated. Adjust based on your db driver.
-            # Example: if using neo4j driver, result might be a Result object.
-            # record = result.single() # Get the single summary record
-            # update_count = record["update_count"] if record else 0
-
-            # Simplified check (assumes execute might return None or empty if no match)
-            # Adapt this check based on your specific db.execute behavior
-            update_check = result # Placeholder: Adapt based on actual return type
-            if update_check: # Needs adjustment based on actual result format
-                 logging.debug(f"Updated properties for Script: {script_name}")
-                 updated_count += 1
-            else:
-                 logging.warning(f"Script node not found, could not update: {script_name}")
-                 not_found_count += 1
-
+                {"rows": batch}
+            )), None) or {}
         except Exception as e:
-            logging.error(f"Failed to update Script node '{script_name}': {e}")
-
-    logging.info(f"Script property update complete. Updated: {updated_count}, Not Found: {not_found_count}")
-
+            logging.error(f"Failed to update {len(batch)} Script nodes: {e}")
+            counts["failed"] += len(batch)
+            continue
+        updated = result.get("update_count", 0)
+        counts["updated"] += updated
+        counts["not_found"] += len(batch) - updated # Deleted between the hash read and the update
+        for row in batch:
+            logging.debug(f"Updated properties for Script: {row['script_name']}")
+
+    logging.info(f"Script property update complete. Updated: {counts['updated']}, Unchanged: {counts['unchanged']}, Not Found: {counts['not_found']}, Skipped: {counts['skipped']}, Failed: {counts['failed']}")
+    return counts
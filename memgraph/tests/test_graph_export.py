@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("gqlalchemy")
+pytest.importorskip("mgclient")
+
+MEMGRAPH_DIR = Path(__file__).resolve().parents[1]
+SAMPLE_JSON_DIR = MEMGRAPH_DIR.parent / "agentic" / "Agent_LLM_JSONs"
+SQL_DIR = MEMGRAPH_DIR.parent / "src" / "main" / "sql_for_pipelines"
+sys.path.insert(0, str(MEMGRAPH_DIR))
+
+import memgraph_process_v5_agentic as loader
+from graph_export import LineageGraph, export_csv, read_csv_export, compare_graphs
+
+
+class CommittingWriter:
+    """Stands in for TransactionalWriter: every transaction commits, nothing is sent."""
+
+    def run(self, statements, label=""):
+        return True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def repo_sql_dir(monkeypatch):
+    monkeypatch.setattr(loader, "SQL_FILES_DIR", str(SQL_DIR))
+
+
+def loader_graph(batches) -> LineageGraph:
+    graph = LineageGraph()
+    for batch in batches:
+        graph.add_batch(batch)
+    return graph
+
+
+def test_csv_export_of_sample_lineage_round_trips(tmp_path):
+    # Same batches the online bulk loader writes, built without touching Memgraph
+    batches = loader.run_ingest_pipeline(SAMPLE_JSON_DIR, workers=2, incremental=False, dry_run=True)
+    assert batches and batches[0].documents > 0
+    graph = loader_graph(batches)
+
+    export_csv(graph, str(tmp_path), loader.CONSTRAINTS_AND_INDEXES)
+
+    assert compare_graphs(graph, read_csv_export(str(tmp_path))) == {}
+
+
+def test_csv_export_matches_transactional_loader(tmp_path, monkeypatch):
+    # The shared nodes and group batches the writers commit, in commit order per node
+    monkeypatch.setattr(loader, "new_transactional_writer", CommittingWriter)
+    online = loader_graph(loader.run_ingest_pipeline(SAMPLE_JSON_DIR, workers=4, incremental=False, use_transactions=True))
+
+    export_csv(loader_graph(loader.run_ingest_pipeline(SAMPLE_JSON_DIR, workers=4, incremental=False, dry_run=True)),
+               str(tmp_path), loader.CONSTRAINTS_AND_INDEXES)
+
+    assert compare_graphs(read_csv_export(str(tmp_path)), online) == {}
+
+
+def test_csv_export_keeps_property_types_and_special_characters(tmp_path):
+    batch = loader.LineageBatch()
+    batch.add_table_schema("wh_db.DimTest", [("id", "INTEGER", "Primary Key: True", None), ("note", "VARCHAR", None, 'a "quoted", multi\nline comment')], "test table")
+    batch.add_document(
+        {
+            "target_table": "wh_db.DimTest",
+            "sources_summary": [{"type": "FILE", "name": "'/data/Batch1/Test.txt'"}],
+            "lineage": {
+                "id": {"sources": [{"source_identifier": "file.col0", "transformation_type": "CAST", "path": [1, 2]}]},
+                "note": {"sources": [{"source_identifier": "stage.notes.text", "transformation_logic": "trim(text), ''"}]},
+            },
+        },
+        "test_script.sql",
+        "test_pipeline",
+    )
+    graph = loader_graph([batch])
+
+    export_csv(graph, str(tmp_path))
+
+    assert compare_graphs(graph, read_csv_export(str(tmp_path))) == {}
@@ -0,0 +1,48 @@
+import math
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("gqlalchemy")
+pytest.importorskip("mgclient")
+
+MEMGRAPH_DIR = Path(__file__).resolve().parents[1]
+SAMPLE_JSON_DIR = MEMGRAPH_DIR.parent / "agentic" / "Agent_LLM_JSONs"
+SQL_DIR = MEMGRAPH_DIR.parent / "src" / "main" / "sql_for_pipelines"
+sys.path.insert(0, str(MEMGRAPH_DIR))
+
+import memgraph_process_v5_agentic as loader
+
+
+class RecordingWriter:
+    """Stands in for TransactionalWriter: commits every transaction, remembering its label."""
+
+    writers = []
+
+    def __init__(self):
+        self.labels = []
+        RecordingWriter.writers.append(self)
+
+    def run(self, statements, label=""):
+        self.labels.append(label)
+        return True
+
+    def close(self):
+        pass
+
+
+def test_transactional_ingest_spreads_groups_over_writers(monkeypatch):
+    monkeypatch.setattr(loader, "SQL_FILES_DIR", str(SQL_DIR))
+    monkeypatch.setattr(loader, "new_transactional_writer", RecordingWriter)
+    monkeypatch.setattr(RecordingWriter, "writers", [])
+    workers = 4
+
+    loader.run_ingest_pipeline(SAMPLE_JSON_DIR, workers=workers, incremental=False, use_transactions=True)
+
+    shared, *lanes = RecordingWriter.writers
+    assert shared.labels == ["shared nodes"]
+    groups = sum(len(lane.labels) for lane in lanes)
+    assert groups == len(list(SAMPLE_JSON_DIR.glob("*.json")))
+    assert len([lane for lane in lanes if lane.labels]) > 1
+    assert max(len(lane.labels) for lane in lanes) <= math.ceil(groups / workers) + 1
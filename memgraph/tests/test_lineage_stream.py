@@ -0,0 +1,49 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+MEMGRAPH_DIR = Path(__file__).resolve().parents[1]
+SAMPLE_JSON_DIR = MEMGRAPH_DIR.parent / "agentic" / "Agent_LLM_JSONs"
+sys.path.insert(0, str(MEMGRAPH_DIR))
+
+from lineage_stream import JsonStreamReader, STREAMED_KEY
+
+NUMBER_DOCUMENTS = [
+    '[1, -1.5e-07, 2]',
+    '{"a": 1e+10, "b": -0.0, "c": 12345678901234567890, "d": 1E5, "e": [0, -0, 3.25e-3, -12.5E+2]}',
+    '-1.5e-07',
+    '[-Infinity, NaN, true, false, null, "\\u00e9x", 7]',
+]
+
+
+def read_document(text: str, chunk_size: int) -> dict:
+    """Reads a document the way load_json_document() streams large files."""
+    reader = JsonStreamReader(io.StringIO(text), chunk_size=chunk_size)
+    document = {}
+    for key, value in reader.read_document(STREAMED_KEY):
+        document[key] = dict(reader.iter_object()) if key == STREAMED_KEY else value
+    assert reader.peek() == ""
+    return document
+
+
+@pytest.mark.parametrize("text", NUMBER_DOCUMENTS)
+def test_values_cut_at_any_chunk_boundary(text):
+    for chunk_size in range(1, len(text) + 1):
+        assert JsonStreamReader(io.StringIO(text), chunk_size=chunk_size).read_value() == json.loads(text), chunk_size
+
+
+@pytest.mark.parametrize("path", sorted(SAMPLE_JSON_DIR.glob("*.json")), ids=lambda path: path.name)
+def test_sample_documents_at_every_chunk_size(path):
+    text = path.read_text(encoding="utf-8")
+    expected = json.loads(text)
+    for chunk_size in list(range(1, 65)) + [256, 4096]:
+        assert read_document(text, chunk_size) == expected, chunk_size
+
+
+def test_invalid_json_is_still_rejected():
+    for chunk_size in (1, 3, 64):
+        with pytest.raises(json.JSONDecodeError):
+            JsonStreamReader(io.StringIO('[1, 2.e5, 3]'), chunk_size=chunk_size).read_value()
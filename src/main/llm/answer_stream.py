@@ -0,0 +1,178 @@
+import json
+
+_WHITESPACE = " \t\r\n"
+EXCERPT_CHARS = 300
+
+
+class InvalidAnswerError(ValueError):
+    """A (partial) LLM answer that can no longer become a valid lineage JSON object."""
+
+
+class AnswerSchema:
+    """
+    The top-level shape of an expected answer: keys that must appear, keys that may
+    appear (None: any), and the JSON types their values must start as ('{', '[',
+    '"', 'null', ...). value_types["*"] applies to every key without its own entry.
+    """
+
+    def __init__(self, required_keys=(), allowed_keys=None, value_types=None):
+        self.required_keys = tuple(required_keys)
+        self.allowed_keys = set(allowed_keys) if allowed_keys is not None else None
+        self.value_types = value_types or {}
+
+    def check_key(self, key: str) -> None:
+        if self.allowed_keys is not None and key not in self.allowed_keys:
+            raise InvalidAnswerError(f"unexpected top-level key {key!r}")
+
+    def check_value_start(self, key: str, char: str) -> None:
+        expected = self.value_types.get(key, self.value_types.get("*"))
+        if expected and not any(char == start[0] for start in expected):
+            raise InvalidAnswerError(f"value of {key!r} starts with {char!r}, expected one of {', '.join(expected)}")
+
+    def check_complete(self, keys: list) -> None:
+        missing = [key for key in self.required_keys if key not in keys]
+        if missing:
+            raise InvalidAnswerError(f"missing top-level key(s) {', '.join(missing)}")
+
+
+# {"target_table": ..., "sources_summary": [...], "lineage": {...}} (the "hard" templates, agentic prompts)
+TABLE_LINEAGE_SCHEMA = AnswerSchema(
+    required_keys=("target_table", "lineage"),
+    allowed_keys=("target_table", "sources_summary", "lineage"),
+    value_types={"target_table": ('"', "null"), "sources_summary": ("[", "null"), "lineage": ("{",)},
+)
+# {"<target column>": {...}, ...} (templates without a target_table field)
+COLUMN_LINEAGE_SCHEMA = AnswerSchema(value_types={"*": ("{",)})
+
+
+def answer_schema_for(template_content: str) -> AnswerSchema:
+    """The schema a template asks for: table lineage if it mentions target_table, else column lineage."""
+    return TABLE_LINEAGE_SCHEMA if "target_table" in template_content else COLUMN_LINEAGE_SCHEMA
+
+
+def batch_answer_schema(script_names: list) -> AnswerSchema:
+    """A batch answer is keyed by script name; every value is one script's answer object."""
+    return AnswerSchema(allowed_keys=script_names, value_types={"*": ("{",)})
+
+
+class StreamingAnswerValidator:
+    """
+    Checks an LLM answer chunk by chunk as it streams in, so a plainly invalid
+    generation can be cancelled long before it is complete. Tracks only the top
+    level of the JSON object (after an optional ```json fence): every key as soon
+    as it is read, the first character of its value, and the required keys once
+    the object closes. Nested values are skipped by bracket depth, not parsed;
+    json.loads on the full text stays the final check (e.g. for a cut off answer).
+    """
+
+    def __init__(self, schema: AnswerSchema):
+        self.schema = schema
+        self.keys = []
+        self.chars = 0
+        self.complete = False
+        self._state = "start" # start, fence, key, in_key, colon, value_start, value, done
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._key = []
+
+    def feed(self, chunk: str) -> None:
+        """Consumes the next piece of the answer. Raises InvalidAnswerError as soon as it is invalid."""
+        for char in chunk:
+            self._feed_char(char)
+            self.chars += 1
+
+    def _feed_char(self, char: str) -> None:
+        state = self._state
+        if state == "done":
+            return # Closing fence or trailing text; json.loads decides
+        if state == "start":
+            if char in _WHITESPACE:
+                return
+            if char == "`":
+                self._state = "fence"
+            elif char == "{":
+                self._open_object()
+            else:
+                raise InvalidAnswerError(f"answer starts with {char!r} instead of a JSON object")
+            return
+        if state == "fence": # ```json up to the end of the line
+            if char == "\n":
+                self._state = "start"
+            return
+        if state == "in_key":
+            if self._escaped:
+                self._escaped = False
+                self._key.append(char)
+            elif char == "\\":
+                self._escaped = True
+                self._key.append(char)
+            elif char == '"':
+                try:
+                    key = json.loads('"' + "".join(self._key) + '"')
+                except json.JSONDecodeError:
+                    raise InvalidAnswerError(f"malformed top-level key {''.join(self._key)!r}")
+                self.schema.check_key(key)
+                self.keys.append(key)
+                self._state = "colon"
+            else:
+                self._key.append(char)
+            return
+        if state == "value":
+            self._skip_value(char)
+            return
+        if char in _WHITESPACE:
+            return
+        if state == "key":
+            if char == '"':
+                self._key = []
+                self._state = "in_key"
+            elif char == "}" and not self.keys:
+                self._close_object()
+            else:
+                raise InvalidAnswerError(f"expected a top-level key, found {char!r}")
+        elif state == "colon":
+            if char != ":":
+                raise InvalidAnswerError(f"expected ':' after key {self.keys[-1]!r}, found {char!r}")
+            self._state = "value_start"
+        elif state == "value_start":
+            self.schema.check_value_start(self.keys[-1], char)
+            self._state = "value"
+            self._skip_value(char)
+
+    def _skip_value(self, char: str) -> None:
+        """Follows a top-level value by string state and bracket depth until ',' or the closing '}'."""
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+            return
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._close_object()
+        elif char == "," and self._depth == 1:
+            self._state = "key"
+
+    def _open_object(self) -> None:
+        self._depth = 1
+        self._state = "key"
+
+    def _close_object(self) -> None:
+        self.schema.check_complete(self.keys)
+        self.complete = True
+        self._state = "done"
+
+
+def excerpt(text: str, limit: int = EXCERPT_CHARS) -> str:
+    """The start of a (long) answer for log messages, instead of the full raw text."""
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
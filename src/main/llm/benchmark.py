@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+
+import lineage_extractor_v2 as extractor
+from answer_stream import InvalidAnswerError, StreamingAnswerValidator, answer_schema_for
+from call_timing import SpanRecorder
+from model_client import ReplayModel, load_recordings
+from response_cache import ResponseCache
+
+# End-to-end throughput of lineage_extractor_v2 and agentic/agent_v3 against ReplayModel:
+# recorded answers with simulated latency and errors, no network access or quota needed.
+#   python benchmark.py --latency 2 --jitter 1 --rate-limit-rate 0.05 --workers 4 --runs 2 --cache
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+AGENTIC_DIR = os.path.join(REPO_DIR, "agentic")
+DEFAULT_ANSWERS_DIR = os.path.join(AGENTIC_DIR, "Agent_LLM_JSONs")
+DEFAULT_SQL_FILES_DIR = os.path.join(REPO_DIR, "src", "main", "sql_for_pipelines")
+DEFAULT_TEMPLATES_DIR = os.path.join(REPO_DIR, "src", "templates")
+# agent_v3 stage 1 answer for every script: no DuckDB context lookups, straight to the analysis
+IDENTIFIER_REPLAY_ANSWER = {"statement_type": "OTHER", "context_needed": False, "tables_requiring_context": []}
+
+
+def replayable_templates(templates_dir: str, recordings: list, target_dir: str) -> list:
+    """
+    Copies the templates whose answer schema the recorded answers satisfy into
+    target_dir and returns their names. The others would only measure streamed
+    answers being rejected.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    sample = recordings[0].answer_text
+    names = []
+    for filename in sorted(os.listdir(templates_dir)):
+        path = os.path.join(templates_dir, filename)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            validator = StreamingAnswerValidator(answer_schema_for(f.read()))
+        try:
+            validator.feed(sample)
+        except InvalidAnswerError as e:
+            logging.info(f"Not replaying template {filename}, the recorded answers do not fit it: {e}")
+            continue
+        shutil.copy(path, target_dir)
+        names.append(filename)
+    return names
+
+
+def benchmark_extractor(work_dir: str, recordings: list, model_options: dict, templates_dir: str, sql_files_dir: str,
+                        workers: int, requests_per_minute: float, tokens_per_minute: float,
+                        use_batches: bool = False, use_cache: bool = False, runs: int = 1) -> list:
+    """
+    Runs lineage_extractor_v2.run_all_templates() `runs` times against one ReplayModel,
+    with all output, spans and (if use_cache) the response cache under work_dir, so
+    later runs show the cache. Returns the summarize_run() of every run.
+    """
+    replay_templates_dir = os.path.join(work_dir, "templates")
+    if not replayable_templates(templates_dir, recordings, replay_templates_dir):
+        raise ValueError(f"No template in {templates_dir} asks for the shape of the recorded answers")
+    extractor.BASE_OUTPUT_DIR = os.path.join(work_dir, "LLM_answers")
+    extractor.MODEL_BACKEND = "replay"
+    extractor.METADATA_STORE_PATH = None
+    extractor.response_cache = ResponseCache(os.path.join(work_dir, "llm_response_cache.sqlite"), extractor.RESPONSE_CACHE_MAX_BYTES) if use_cache else None
+    extractor.span_recorder = SpanRecorder(os.path.join(work_dir, "extractor_spans.jsonl"), "lineage_extractor_v2")
+    extractor.use_model(ReplayModel(recordings, extractor.MODEL_NAME, **model_options))
+
+    summaries = []
+    for run in range(1, runs + 1):
+        logging.info(f"Extractor benchmark run {run}/{runs}")
+        extractor.run_all_templates(replay_templates_dir, sql_files_dir, workers, requests_per_minute, tokens_per_minute, use_batches)
+        summaries.append(extractor.span_recorder.summary())
+    extractor.span_recorder.close()
+    return summaries
+
+
+def load_orchestrator():
+    """Imports agentic/agent_v3.py, which (with its tools module) lives outside this package."""
+    if AGENTIC_DIR not in sys.path:
+        sys.path.insert(0, AGENTIC_DIR)
+    os.environ.setdefault("GOOGLE_API_KEY", "replay") # Checked at import, never used by the replay models
+    import agent_v3
+    return agent_v3
+
+
+def benchmark_orchestrator(work_dir: str, recordings: list, model_options: dict, sql_files_dir: str,
+                           workers: int, requests_per_minute: float, runs: int = 1, catalog_db: str = None) -> list:
+    """
+    Runs agent_v3.process_all_sql_files() `runs` times with ReplayModels for both of
+    its stages, `workers` files at a time under one requests_per_minute limiter.
+    Stage 2 reads catalog_db instead of tools.DB_FILE if given. Returns the
+    summarize_run() of every run.
+    """
+    agent = load_orchestrator()
+    models = {
+        "identifier": ReplayModel([], "identifier", fallback_answer=IDENTIFIER_REPLAY_ANSWER, **model_options),
+        "analysis": ReplayModel(recordings, "analysis", **model_options),
+    }
+    agent.create_model = models.__getitem__
+    if catalog_db:
+        agent.catalog.close()
+        agent.catalog.db_file = catalog_db
+    agent.span_recorder.close()
+    agent.span_recorder = SpanRecorder(os.path.join(work_dir, "agent_spans.jsonl"), "agent_v3")
+    agent.IDENTIFIER_PROMPT_FILE = os.path.join(AGENTIC_DIR, "prompts", "identifier_prompt_v2.txt")
+    agent.COPY_ANALYZER_PROMPT_FILE = os.path.join(AGENTIC_DIR, "prompts", "general_lineage_prompt.txt")
+
+    summaries = []
+    for run in range(1, runs + 1):
+        logging.info(f"Orchestrator benchmark run {run}/{runs}")
+        agent.process_all_sql_files(sql_files_dir, os.path.join(work_dir, "Agent_LLM_JSONs", str(run)), workers=workers,
+                                    requests_per_minute=requests_per_minute)
+        summaries.append(agent.span_recorder.summary())
+    agent.span_recorder.close()
+    return summaries
+
+
+def print_benchmark(name: str, summaries: list) -> None:
+    print(f"{name}:")
+    for run, summary in enumerate(summaries, 1):
+        scripts_per_second = summary["scripts"] / summary["wall_seconds"] if summary["wall_seconds"] else 0.0
+        print(f"  run {run}: {summary['scripts']} scripts in {summary['wall_seconds']:.2f}s = {scripts_per_second:.2f} scripts/s "
+              f"({summary['api_calls']} API calls, {summary['cache_hits']} cache hits, {summary['errors']} errors, "
+              f"{summary['retries']} retries, {summary['quota_wait_seconds_total'] + summary['sleep_seconds_total']:.1f}s "
+              f"rate limit/backoff over all workers)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+    parser = argparse.ArgumentParser(description="Offline scripts/second benchmark of the extractor and the agentic orchestrator.")
+    parser.add_argument("--target", choices=["extractor", "orchestrator", "all"], default="all")
+    parser.add_argument("--answers-dir", default=DEFAULT_ANSWERS_DIR, help="recorded answers to replay")
+    parser.add_argument("--sql-dir", default=DEFAULT_SQL_FILES_DIR)
+    parser.add_argument("--templates-dir", default=DEFAULT_TEMPLATES_DIR)
+    parser.add_argument("--work-dir", help="where outputs and spans go (default: a new temporary directory)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per target; with --cache the later ones hit the cache")
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds to the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency varies uniformly by +/- this")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="generation time per answer token")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests failing with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--catalog-db", help="DuckDB database for the orchestrator's Stage 2 (default: tools.DB_FILE)")
+    parser.add_argument("--workers", type=int, default=extractor.MAX_CONCURRENT_REQUESTS,
+                        help="extractor workers per template, orchestrator files at a time")
+    parser.add_argument("--rpm", type=float, default=extractor.REQUESTS_PER_MINUTE, help="requests/min limit (0: no limit)")
+    parser.add_argument("--tpm", type=float, default=extractor.TOKENS_PER_MINUTE, help="extractor tokens/min limit (0: no limit)")
+    parser.add_argument("--batches", action="store_true", help="extractor batch prompts")
+    parser.add_argument("--cache", action="store_true", help="extractor response cache (fresh, under the work dir)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="lineage_benchmark_")
+    recordings = load_recordings(args.answers_dir, args.sql_dir)
+    model_options = {
+        "latency_seconds": args.latency,
+        "latency_jitter": args.jitter,
+        "seconds_per_answer_token": args.seconds_per_token,
+        "rate_limit_rate": args.rate_limit_rate,
+        "error_rate": args.error_rate,
+        "seed": args.seed,
+    }
+    print(f"Replaying {len(recordings)} recorded answers with {json.dumps(model_options)}; output in {work_dir}")
+    if args.target in ("extractor", "all"):
+        print_benchmark("lineage_extractor_v2", benchmark_extractor(
+            os.path.join(work_dir, "extractor"), recordings, model_options, args.templates_dir, args.sql_dir,
+            args.workers, args.rpm, args.tpm, args.batches, args.cache, args.runs))
+    if args.target in ("orchestrator", "all"):
+        print_benchmark("agent_v3", benchmark_orchestrator(
+            os.path.join(work_dir, "orchestrator"), recordings, model_options, args.sql_dir,
+            args.workers, args.rpm, args.runs, args.catalog_db))
@@ -64,6 +64,22 @@ def calculate_token_usage(json_file_path):
         print(f"  Avg: {avg_answer_tokens:.2f}")
         print(f"  Sum: {sum_answer_tokens}")
 
+        # Batch prompt mode: query tokens saved per script vs. sending it on its own
+        batched = [item for item in data["individual_prompts_metadata"] if item.get("batch")]
+        if batched:
+            print("\nBatch Token Savings (query tokens):")
+            total_unbatched = 0
+            total_used = 0
+            for item in batched:
+                unbatched = item["batch"]["estimated_unbatched_query_tokens"]
+                used = item["usage"]["query_tokens_used"]
+                total_unbatched += unbatched
+                total_used += used
+                saved_pct = (unbatched - used) / unbatched * 100 if unbatched else 0
+                print(f"  {item['prompt_details']['sql_file_name']}: {used} used vs ~{unbatched} unbatched, saved {unbatched - used} ({saved_pct:.1f}%) [batch of {item['batch']['scripts']}]")
+            total_pct = (total_unbatched - total_used) / total_unbatched * 100 if total_unbatched else 0
+            print(f"  Total: {total_used} used vs ~{total_unbatched} unbatched, saved {total_unbatched - total_used} ({total_pct:.1f}%)")
+
     except FileNotFoundError:
         print(f"Error: File not found at {json_file_path}")
     except json.JSONDecodeError:
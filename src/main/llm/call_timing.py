@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+
+# One JSON object per line:
+# {"run_id", "component", "name", "span_id", "parent_id", "thread", "start", "end",
+#  "duration_seconds", "status", "attributes": {...}}
+# Span names used by the extractors:
+#   run       one whole run; attributes scripts, calls
+#   job       one scheduled job; queue_seconds, quota_wait_seconds, retries, label
+#   llm_call  one model request; api_seconds, ttft_seconds, prompt_tokens, answer_tokens, cache_hit
+#   sleep     deliberate pauses between requests
+
+
+class SpanRecorder:
+    """
+    Writes timing spans of one component to a JSONL file. Spans opened with span()
+    nest per thread (parent_id); every span carries the run_id of the current run,
+    see new_run(), and the current run's spans are kept for summary(). Safe to share
+    between threads.
+    """
+
+    def __init__(self, path: str, component: str):
+        self.path = path
+        self.component = component
+        self.run_id = uuid.uuid4().hex[:12]
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def new_run(self) -> str:
+        with self._lock:
+            self.run_id = uuid.uuid4().hex[:12]
+            self.spans = []
+        return self.run_id
+
+    def summary(self):
+        """summarize_run() of the current run, or None before its first span."""
+        with self._lock:
+            spans = list(self.spans)
+        return summarize_run(spans) if spans else None
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Times the enclosed block. Yields the attribute dict, which the block may fill in
+        (tokens, retries...). An exception marks the span as error and is re-raised.
+        """
+        span_id = uuid.uuid4().hex[:16]
+        stack = self._stack()
+        parent_id = stack[-1] if stack else None
+        stack.append(span_id)
+        start = time.time()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException as e:
+            status = "error"
+            attributes.setdefault("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            stack.pop()
+            self.record(name, start, time.time(), span_id=span_id, parent_id=parent_id, status=status, **attributes)
+
+    def record(self, name: str, start: float, end: float, span_id: str = None, parent_id: str = None,
+               status: str = "ok", **attributes) -> None:
+        """Writes an already timed span (start and end as time.time())."""
+        if parent_id is None:
+            stack = self._stack()
+            parent_id = stack[-1] if stack else None
+        span = {
+            "run_id": self.run_id,
+            "component": self.component,
+            "name": name,
+            "span_id": span_id or uuid.uuid4().hex[:16],
+            "parent_id": parent_id,
+            "thread": threading.current_thread().name,
+            "start": round(start, 6),
+            "end": round(end, 6),
+            "duration_seconds": round(end - start, 6),
+            "status": status,
+            "attributes": attributes,
+        }
+        line = json.dumps(span, default=str)
+        with self._lock:
+            self.spans.append(span)
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class NullRecorder:
+    """Stand-in when instrumentation is switched off: same interface, records nothing."""
+
+    component = None
+    run_id = None
+
+    def new_run(self) -> None:
+        return None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        yield attributes
+
+    def record(self, *args, **kwargs) -> None:
+        pass
+
+    def summary(self) -> None:
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+def open_span_recorder(path, component: str):
+    """A SpanRecorder writing to path, or a NullRecorder if path is empty or cannot be opened."""
+    if not path:
+        return NullRecorder()
+    try:
+        return SpanRecorder(path, component)
+    except OSError as e:
+        logging.error(f"Could not open span file {path}, timing is not recorded: {e}")
+        return NullRecorder()
+
+
+def read_spans(path: str) -> list:
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue # Torn last line of a crashed run
+    return spans
+
+
+def percentile(values: list, fraction: float):
+    """Linear-interpolated percentile (as DuckDB's quantile_cont), None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize_run(spans: list) -> dict:
+    """Throughput and where the time went, for the spans of one run."""
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span["name"], []).append(span)
+    runs = by_name.get("run", [])
+    start = min(span["start"] for span in spans)
+    end = max(span["end"] for span in spans)
+    wall = max(end - start, 1e-9)
+    calls = [span for span in by_name.get("llm_call", []) if not span["attributes"].get("cache_hit")]
+    jobs = by_name.get("job", [])
+    api_seconds = [span["attributes"].get("api_seconds", span["duration_seconds"]) for span in calls]
+    ttft = [span["attributes"]["ttft_seconds"] for span in calls if span["attributes"].get("ttft_seconds") is not None]
+    tokens = sum((span["attributes"].get("prompt_tokens") or 0) + (span["attributes"].get("answer_tokens") or 0) for span in calls)
+    scripts = sum(span["attributes"].get("scripts", 0) for span in runs)
+    return {
+        "component": spans[0]["component"],
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+        "wall_seconds": round(wall, 3),
+        "scripts": scripts,
+        "api_calls": len(calls),
+        "cache_hits": len(by_name.get("llm_call", [])) - len(calls),
+        "errors": sum(1 for span in spans if span["status"] == "error"),
+        "scripts_per_minute": round(scripts / wall * 60, 2),
+        "tokens_per_second": round(tokens / wall, 1),
+        "api_seconds_total": round(sum(api_seconds), 3),
+        "api_seconds_p50": percentile(api_seconds, 0.5),
+        "api_seconds_p95": percentile(api_seconds, 0.95),
+        "ttft_seconds_p50": percentile(ttft, 0.5),
+        "queue_seconds_total": round(sum(span["attributes"].get("queue_seconds", 0) for span in jobs), 3),
+        "quota_wait_seconds_total": round(sum(span["attributes"].get("quota_wait_seconds", 0) for span in jobs), 3),
+        "retries": sum(span["attributes"].get("retries", 0) for span in jobs + calls),
+        "sleep_seconds_total": round(sum(span["duration_seconds"] for span in by_name.get("sleep", [])), 3),
+    }
+
+
+def summarize_spans(path: str) -> list:
+    """summarize_run() for every run in a span file, oldest first."""
+    runs = {}
+    for span in read_spans(path):
+        runs.setdefault(span["run_id"], []).append(span)
+    return sorted((summarize_run(spans) for spans in runs.values()), key=lambda summary: summary["started"])
+
+
+def print_summary(summary: dict) -> None:
+    def seconds(value):
+        return "n/a" if value is None else f"{value:.2f}s"
+
+    print(f"{summary['component']} run started {summary['started']} ({summary['wall_seconds']:.1f}s wall clock)")
+    print(f"  Throughput: {summary['scripts_per_minute']} scripts/min, {summary['tokens_per_second']} tokens/s "
+          f"({summary['scripts']} scripts, {summary['api_calls']} API calls, {summary['cache_hits']} cache hits, {summary['errors']} errors)")
+    print(f"  API time: {summary['api_seconds_total']:.1f}s total, p50 {seconds(summary['api_seconds_p50'])}, "
+          f"p95 {seconds(summary['api_seconds_p95'])}, time to first token p50 {seconds(summary['ttft_seconds_p50'])}")
+    print(f"  Waiting: {summary['queue_seconds_total']:.1f}s queued for a worker, {summary['quota_wait_seconds_total']:.1f}s for "
+          f"rate limit/backoff, {summary['sleep_seconds_total']:.1f}s sleeping, {summary['retries']} retries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and time breakdown per run from a span file.")
+    parser.add_argument("path", help="span JSONL file, e.g. LLM_answers/llm_spans.jsonl")
+    parser.add_argument("--last", type=int, default=0, help="only the last N runs")
+    args = parser.parse_args()
+
+    for run_summary in summarize_spans(args.path)[-args.last:]:
+        print_summary(run_summary)
@@ -1,12 +1,23 @@
 import os
 import json
+import time
+import argparse
 from datetime import datetime
 # Make sure you have the library installed: pip install google-generativeai
 import google.generativeai as genai
 # Assuming types is needed for config, keep it. If not strictly needed, could remove.
 from google.generativeai import types
 import logging
-import time
+import threading
+from llm_scheduler import TokenBucketLimiter, estimate_tokens, is_rate_limit_error
+from response_cache import ResponseCache, cache_key, prompt_digest
+from run_planner import Lane, read_sql_scripts, run_lanes
+from run_journal import RunJournal
+from answer_stream import InvalidAnswerError, StreamingAnswerValidator, answer_schema_for, batch_answer_schema, excerpt
+from call_timing import open_span_recorder
+from metadata_store import MetadataStore, open_metadata_store
+from model_client import ReplayModel, load_recordings
+from token_estimator import TokenEstimator, calibrated_estimator, preflight_report, print_preflight_report
 
 # --- Configuration ---
 # Use os.path.join for better cross-platform compatibility
@@ -15,6 +26,51 @@ BASE_OUTPUT_DIR = os.path.join("C:", os.sep, "lopu-kg-test", "project", "src", "
 SQL_FILES_DIR = os.path.join("C:", os.sep, "lopu-kg-test", "project", "src", "main", "sql_for_pipelines")
 TEMPLATES_DIR = os.path.join("C:", os.sep, "lopu-kg-test", "project", "src", "templates")
 LOG_FILE_PATH = os.path.join(BASE_OUTPUT_DIR, 'llm_processing_log.log') # Central log file
+MODEL_NAME = 'gemini-2.0-flash' # Or your preferred model
+# Request scheduling (set to your API tier's quota)
+MAX_CONCURRENT_REQUESTS = 4 # Workers per template lane; all lanes share the rate limits below
+REQUESTS_PER_MINUTE = 15
+TOKENS_PER_MINUTE = 1_000_000
+LARGEST_FIRST = True # Start the biggest prompts first so no long call is left alone at the end
+# Preflight estimate (token_estimator.py), printed with --preflight and logged before every run
+PROMPT_TOKEN_BUDGET = 32_000 # Prompts predicted above this are flagged
+INPUT_PRICE_PER_MILLION = 0.10 # USD per 1M prompt tokens of MODEL_NAME
+OUTPUT_PRICE_PER_MILLION = 0.40 # USD per 1M answer tokens of MODEL_NAME
+SECONDS_PER_CALL = 10.0 # Typical latency of one request
+GENERATION_CONFIG = {"temperature": 0.1, "candidate_count": 1}
+# "gemini", or "replay" to answer offline from recorded answers with simulated
+# latency (model_client.ReplayModel), e.g. to benchmark the pipeline without quota
+MODEL_BACKEND = "gemini"
+REPLAY_ANSWERS_DIR = os.path.join("C:", os.sep, "lopu-kg-test", "project", "agentic", "Agent_LLM_JSONs")
+REPLAY_LATENCY_SECONDS = 2.0
+# Stream answers and validate them as they arrive (answer_stream.py); a plainly
+# invalid generation is abandoned and requested again, up to STREAM_MAX_ATTEMPTS in all
+USE_STREAMING = True
+STREAM_MAX_ATTEMPTS = 3
+# Reuse answers for identical (model, generation config, prompt) across runs.
+# Disable to sample the model again on every execution number.
+USE_RESPONSE_CACHE = True
+RESPONSE_CACHE_PATH = os.path.join(BASE_OUTPUT_DIR, "llm_response_cache.sqlite")
+RESPONSE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Every run's metadata items are also appended to this DuckDB table for analytics
+# across all runs (python metadata_store.py <path>); None keeps only the JSON files
+METADATA_STORE_PATH = os.path.join(BASE_OUTPUT_DIR, "llm_metadata.duckdb")
+# Timing spans of every run, job and model call (python call_timing.py <path>); None disables
+SPANS_PATH = os.path.join(BASE_OUTPUT_DIR, "llm_spans.jsonl")
+# Batch mode: pack several SQL scripts into one prompt (template sent once per batch)
+USE_BATCH_PROMPTS = False
+BATCH_TOKEN_BUDGET = 8000 # Max estimated prompt tokens per batched request
+MAX_SCRIPTS_PER_BATCH = 8
+PROMPT_PLACEHOLDER = "YOUR SQL QUERY HERE"
+SCRIPT_HEADER = "=== SCRIPT: {name} ==="
+BATCH_INSTRUCTIONS = """
+
+--- BATCH MODE ---
+The SQL section above contains {count} separate SQL scripts, each starting with a line
+"=== SCRIPT: <name> ===". Analyse every script on its own, exactly as instructed above.
+Return ONE JSON object whose keys are the script names ({names}) and whose values are the
+complete JSON answers for the corresponding script. Return only that JSON object.
+"""
 
 # Configure logging
 # Ensure the base output directory exists for the log file
@@ -54,6 +110,16 @@ def get_next_execution_number(template_base_output_dir: str) -> int:
         return max(existing_nums) + 1
 
 
+def strip_code_fences(response_text: str) -> str:
+    """Removes a surrounding ```json ... ``` fence from an LLM answer."""
+    data = response_text.strip()
+    if data.startswith("```json"):
+        data = data[len("```json"):].strip()
+    if data.endswith("```"):
+        data = data[:-len("```")].strip()
+    return data
+
+
 def process_llm_answer(response_text: str, output_dir: str, sql_file_name: str, timestamp: str):
     """
     Processes the LLM's answer text, saves it as JSON in the specified output directory.
@@ -69,17 +135,13 @@ def process_llm_answer(response_text: str, output_dir: str, sql_file_name: str,
         dict or None: The parsed JSON data from the response, or None if parsing fails.
     """
     # Clean up the response text
-    data = response_text.strip()
-    if data.startswith("```json"):
-        data = data[len("```json"):].strip()
-    if data.endswith("```"):
-        data = data[:-len("```")].strip()
+    data = strip_code_fences(response_text)
 
     # Convert string to JSON object
     try:
         json_data = json.loads(data)
     except json.JSONDecodeError as e:
-        logging.error(f"Error: Invalid JSON format for {sql_file_name} in {output_dir}. Error: {e}. Raw Response: {response_text}")
+        logging.error(f"Error: Invalid JSON format for {sql_file_name} in {output_dir}. Error: {e}. Response: {excerpt(response_text)!r}")
         return None # Indicate failure
 
     # Ensure the specific output directory exists (should be created by main loop already, but double-check)
@@ -116,7 +178,6 @@ def create_prompt_from_files(template_path: str, sql_path: str) -> str:
         FileNotFoundError: If either file cannot be found.
         Exception: For other file reading errors.
     """
-    placeholder = "YOUR SQL QUERY HERE"
     template_content = ""
     sql_content = ""
 
@@ -140,58 +201,110 @@ def create_prompt_from_files(template_path: str, sql_path: str) -> str:
         logging.error(f"Error reading SQL file '{sql_path}': {e}")
         raise
 
-    if placeholder not in template_content:
-        logging.warning(f"Placeholder '{placeholder}' not found in template file: {template_path}")
+    return render_prompt(template_content, sql_content, template_path)
 
-    final_prompt = template_content.replace(placeholder, sql_content)
-    return final_prompt
 
+def render_prompt(template_content: str, sql_content: str, template_path: str = "") -> str:
+    """Replaces the SQL placeholder of an already read template with an SQL query."""
+    if PROMPT_PLACEHOLDER not in template_content:
+        logging.warning(f"Placeholder '{PROMPT_PLACEHOLDER}' not found in template file: {template_path}")
+    return template_content.replace(PROMPT_PLACEHOLDER, sql_content)
 
-def generate_llm_response(prompt_for_api: str, template_name: str, sql_file_name_base: str, current_run_output_dir: str) -> tuple:
-    """
-    Sends a prompt to Gemini API, processes the answer, and returns the answer
-    and metadata information.
 
-    Args:
-        prompt_for_api (str): The complete prompt string.
-        template_name (str): The name of the template file (without path).
-        sql_file_name_base (str): The base name of the SQL file (e.g., "1_wh_db.DimAccount").
-        current_run_output_dir (str): The full path to the output directory for this execution run
-                                      (e.g., C:\...\LLM_answers\template_A\1).
+_model = None
+_model_lock = threading.Lock()
+response_cache = ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES) if USE_RESPONSE_CACHE else None
+span_recorder = open_span_recorder(SPANS_PATH, "lineage_extractor_v2")
 
-    Returns:
-        tuple: (parsed_json_answer, metadata_dict)
-               parsed_json_answer is the dict from the LLM response (or None on failure).
-               metadata_dict contains prompt, tokens, etc. (or None on major failure).
+
+def get_model():
     """
-    # Generate a single timestamp for files related to this call
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    parsed_json_answer = None
-    metadata_dict = None
-    usage_info = None
+    Returns the shared model client, created on first use: a Gemini GenerativeModel,
+    or a ReplayModel if MODEL_BACKEND is "replay".
+    """
+    global _model
+    with _model_lock:
+        if _model is None and MODEL_BACKEND == "replay":
+            _model = ReplayModel(load_recordings(REPLAY_ANSWERS_DIR, SQL_FILES_DIR), MODEL_NAME, latency_seconds=REPLAY_LATENCY_SECONDS)
+        elif _model is None:
+            api_key = os.environ.get("GOOGLE_API_KEY")
+            if not api_key:
+                logging.error("GOOGLE_API_KEY environment variable not set.")
+                raise ValueError("Missing Google API Key")
+            genai.configure(api_key=api_key)
+            _model = genai.GenerativeModel(MODEL_NAME)
+        return _model
+
+
+def use_model(model) -> None:
+    """Replaces the shared model client, e.g. with a differently configured ReplayModel."""
+    global _model
+    with _model_lock:
+        _model = model
 
-    try:
-        api_key = os.environ.get("GOOGLE_API_KEY")
-        if not api_key:
-            logging.error("GOOGLE_API_KEY environment variable not set.")
-            raise ValueError("Missing Google API Key")
 
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash') # Or your preferred model
+def cache_model_name() -> str:
+    """The model name in response cache keys; replayed answers never mix with real ones."""
+    return MODEL_NAME if MODEL_BACKEND == "gemini" else f"{MODEL_BACKEND}/{MODEL_NAME}"
 
-        generation_config = types.GenerationConfig(
-            temperature=0.1,
-            candidate_count=1
+
+def call_llm(prompt_for_api: str, label: str, answer_schema=None) -> dict:
+    """
+    Sends a prompt to the Gemini API, or serves it from the response cache. With an
+    answer_schema (and USE_STREAMING) the answer is streamed and checked as it arrives,
+    see stream_llm_answer(). Every call is recorded as an "llm_call" span with its API
+    time, time to first token and token counts.
+
+    Returns:
+        dict: {"text", "prompt_tokens", "answer_tokens", "model_name", "cache_hit", "cache_key",
+               "stream_restarts"}.
+              Pass it to cache_llm_answer() once the answer is known to be usable.
+    """
+    with span_recorder.span("llm_call", label=label, prompt_chars=len(prompt_for_api)) as span:
+        llm_call = request_llm_answer(prompt_for_api, label, answer_schema, span)
+        span.update(
+            cache_hit=llm_call["cache_hit"],
+            prompt_tokens=llm_call["prompt_tokens"],
+            answer_tokens=llm_call["answer_tokens"],
+            retries=llm_call["stream_restarts"],
         )
+        return llm_call
+
+
+def request_llm_answer(prompt_for_api: str, label: str, answer_schema, span: dict) -> dict:
+    """call_llm() without the span; fills in span["api_seconds"] and span["ttft_seconds"]."""
+    key = cache_key(cache_model_name(), GENERATION_CONFIG, prompt_for_api)
+    cached = response_cache.get(key) if response_cache is not None else None
+    if cached:
+        logging.info(f"Cache hit for {label}, skipping API call")
+        return {
+            "text": cached["response_text"],
+            "prompt_tokens": cached["prompt_tokens"],
+            "answer_tokens": cached["answer_tokens"],
+            "model_name": cached["model"],
+            "cache_hit": True,
+            "cache_key": key,
+            "stream_restarts": 0,
+        }
+
+    model = get_model()
+    generation_config = types.GenerationConfig(**GENERATION_CONFIG)
+    stream_restarts = 0
+    started = time.monotonic()
 
-        logging.info(f"Sending prompt for template '{template_name}', SQL '{sql_file_name_base}' to {current_run_output_dir}")
+    if USE_STREAMING and answer_schema is not None:
+        llm_answer_text, usage_info, stream_restarts = stream_llm_answer(model, generation_config, prompt_for_api, answer_schema, label, span)
+        span["api_seconds"] = round(time.monotonic() - started, 6)
+    else:
+        logging.info(f"Sending prompt for {label}")
         response = model.generate_content(
             contents=prompt_for_api,
             generation_config=generation_config,
         )
-        logging.info(f"Received response for template '{template_name}', SQL '{sql_file_name_base}'")
+        span["api_seconds"] = round(time.monotonic() - started, 6)
+        logging.info(f"Received response for {label}")
 
-        # --- Process the answer ---
+        # --- Extract the answer text ---
         llm_answer_text = ""
         try:
             if response.parts:
@@ -199,10 +312,113 @@ def generate_llm_response(prompt_for_api: str, template_name: str, sql_file_name
             elif hasattr(response, 'text'):
                  llm_answer_text = response.text
             else:
-                 logging.warning(f"Could not extract text from response for {sql_file_name_base}, template {template_name}. Response: {response}")
+                 logging.warning(f"Could not extract text from response for {label}. Response: {response}")
         except Exception as e:
              logging.error(f"Error extracting text content from response: {e}. Response object: {response}")
 
+        usage_info = getattr(response, 'usage_metadata', None) # Safely get usage metadata
+    prompt_tokens = None
+    answer_tokens = None
+
+    if usage_info:
+        prompt_tokens = getattr(usage_info, 'prompt_token_count', None)
+        answer_tokens = getattr(usage_info, 'candidates_token_count', None)
+        if prompt_tokens is None or answer_tokens is None:
+             logging.warning(f"Could not extract full token counts from usage metadata for {label}. Metadata: {usage_info}")
+    else:
+         logging.warning(f"No usage metadata found in response for {label}.")
+
+    return {
+        "text": llm_answer_text,
+        "prompt_tokens": prompt_tokens,
+        "answer_tokens": answer_tokens,
+        "model_name": model.model_name,
+        "cache_hit": False,
+        "cache_key": key,
+        "stream_restarts": stream_restarts,
+    }
+
+
+def stream_llm_answer(model, generation_config, prompt_for_api: str, answer_schema, label: str, span: dict = None) -> tuple:
+    """
+    Streams an answer and feeds every chunk to a StreamingAnswerValidator. As soon as
+    the answer can no longer be valid (prose instead of JSON, an unexpected top-level
+    key, a missing required key...) the stream is abandoned and the prompt sent again,
+    up to STREAM_MAX_ATTEMPTS times in all, instead of waiting for the whole bad
+    generation. Abandoned attempts report no token usage. span["ttft_seconds"] gets
+    the time to the first chunk of the attempt that was kept.
+
+    Returns:
+        tuple: (answer text, usage metadata or None, number of restarts). If every
+               attempt is abandoned, the last partial text is returned and fails
+               the usual JSON parsing.
+    """
+    for attempt in range(1, STREAM_MAX_ATTEMPTS + 1):
+        validator = StreamingAnswerValidator(answer_schema)
+        chunks = []
+        logging.info(f"Streaming prompt for {label} (attempt {attempt}/{STREAM_MAX_ATTEMPTS})")
+        started = time.monotonic()
+        response = model.generate_content(
+            contents=prompt_for_api,
+            generation_config=generation_config,
+            stream=True,
+        )
+        try:
+            for chunk in response:
+                if not chunks and span is not None:
+                    span["ttft_seconds"] = round(time.monotonic() - started, 6)
+                text = chunk.text if chunk.parts else ""
+                chunks.append(text)
+                validator.feed(text)
+        except InvalidAnswerError as e:
+            partial_text = "".join(chunks)
+            logging.warning(f"Abandoned streamed answer for {label} after {validator.chars} chars: {e}. Answer so far: {excerpt(partial_text)!r}")
+            if attempt == STREAM_MAX_ATTEMPTS:
+                return partial_text, None, attempt - 1
+            continue
+        logging.info(f"Received streamed response for {label}")
+        return "".join(chunks), getattr(response, 'usage_metadata', None), attempt - 1
+
+
+def cache_llm_answer(llm_call: dict) -> None:
+    """Stores a call_llm() result in the response cache (no-op for cache hits or without a cache)."""
+    if response_cache is not None and not llm_call["cache_hit"] and llm_call["text"]:
+        response_cache.put(llm_call["cache_key"], llm_call["text"], llm_call["prompt_tokens"], llm_call["answer_tokens"], llm_call["model_name"])
+
+
+def generate_llm_response(prompt_for_api: str, template_name: str, sql_file_name_base: str, current_run_output_dir: str,
+                          answer_schema=None) -> tuple:
+    """
+    Sends a prompt to Gemini API, processes the answer, and returns the answer
+    and metadata information.
+
+    Args:
+        prompt_for_api (str): The complete prompt string.
+        template_name (str): The name of the template file (without path).
+        sql_file_name_base (str): The base name of the SQL file (e.g., "1_wh_db.DimAccount").
+        current_run_output_dir (str): The full path to the output directory for this execution run
+                                      (e.g., C:\...\LLM_answers\template_A\1).
+        answer_schema (AnswerSchema): Expected answer shape for streaming validation (optional).
+
+    Returns:
+        tuple: (parsed_json_answer, metadata_dict)
+               parsed_json_answer is the dict from the LLM response (or None on failure).
+               metadata_dict contains prompt, tokens, etc. (or None on major failure).
+    """
+    # Generate a single timestamp for files related to this call
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    parsed_json_answer = None
+    metadata_dict = None
+
+    try:
+        started = time.monotonic()
+        llm_call = call_llm(prompt_for_api, f"template '{template_name}', SQL '{sql_file_name_base}'", answer_schema)
+        latency_seconds = round(time.monotonic() - started, 3)
+        llm_answer_text = llm_call["text"]
+        prompt_tokens = llm_call["prompt_tokens"]
+        answer_tokens = llm_call["answer_tokens"]
+        model_name = llm_call["model_name"]
+
         if llm_answer_text:
             parsed_json_answer = process_llm_answer(
                 llm_answer_text,
@@ -213,31 +429,27 @@ def generate_llm_response(prompt_for_api: str, template_name: str, sql_file_name
         else:
              logging.error(f"LLM response text is empty for {sql_file_name_base}, template {template_name}. Skipping answer processing.")
 
-        # --- Prepare metadata ---
-        usage_info = getattr(response, 'usage_metadata', None) # Safely get usage metadata
-        prompt_tokens = None
-        answer_tokens = None
-
-        if usage_info:
-            prompt_tokens = getattr(usage_info, 'prompt_token_count', None)
-            answer_tokens = getattr(usage_info, 'candidates_token_count', None)
-            if prompt_tokens is None or answer_tokens is None:
-                 logging.warning(f"Could not extract full token counts from usage metadata for {sql_file_name_base}, template {template_name}. Metadata: {usage_info}")
-        else:
-             logging.warning(f"No usage metadata found in response for {sql_file_name_base}, template {template_name}.")
+        # Only answers that parsed are cached, so invalid ones are asked again next run
+        if parsed_json_answer is not None:
+            cache_llm_answer(llm_call)
 
+        # --- Prepare metadata ---
         metadata_dict = {
             "prompt_details": { # Nest prompt to avoid huge top-level string in combined file
                  "sql_file_name": sql_file_name_base,
                  "timestamp": timestamp,
-                 "prompt_text_hash": hash(prompt_for_api), # Hash of prompt instead of full text for brevity in combined file
+                 "prompt_text_hash": prompt_digest(prompt_for_api), # sha256 of prompt instead of full text for brevity in combined file
+                 "prompt_chars": len(prompt_for_api), # Calibrates the token estimator of later runs
+                 "cache_hit": llm_call["cache_hit"],
+                 "stream_restarts": llm_call["stream_restarts"],
                  # "prompt_text": prompt_for_api # Uncomment if you need the full prompt here
             },
             "usage":{
                 "query_tokens_used": prompt_tokens,
                 "answer_tokens_used": answer_tokens,
             },
-            "model_used": model.model_name, # Get model name dynamically
+            "model_used": model_name, # Get model name dynamically
+            "latency_seconds": latency_seconds,
             "response_summary":{
                  "answer_saved": parsed_json_answer is not None,
                  "answer_file": f"answer_{sql_file_name_base}_{timestamp}.json" if parsed_json_answer is not None else None
@@ -249,6 +461,8 @@ def generate_llm_response(prompt_for_api: str, template_name: str, sql_file_name
         logging.error(f"Configuration error: {ve}")
         raise # Re-raise to stop execution
     except Exception as e:
+        if is_rate_limit_error(e):
+            raise # The scheduler backs off and retries
         logging.exception(f"Error during API call or processing for template '{template_name}', SQL '{sql_file_name_base}': {e}")
         # Still try to return a minimal metadata dict indicating failure if possible
         metadata_dict = {
@@ -267,6 +481,147 @@ def generate_llm_response(prompt_for_api: str, template_name: str, sql_file_name
         return None, metadata_dict # Indicate failure for both
 
 
+def build_batch_prompt(template_content: str, scripts: list) -> str:
+    """
+    Builds one prompt for several scripts: the template's SQL placeholder holds all
+    scripts, each under a SCRIPT_HEADER line, followed by BATCH_INSTRUCTIONS asking
+    for one JSON object keyed by script name.
+
+    Args:
+        template_content: The prompt template text.
+        scripts: [(script_name, sql_content), ...]
+    """
+    sql_block = "\n\n".join(f"{SCRIPT_HEADER.format(name=name)}\n{sql}" for name, sql in scripts)
+    names = ", ".join(f'"{name}"' for name, _ in scripts)
+    return template_content.replace(PROMPT_PLACEHOLDER, sql_block) + BATCH_INSTRUCTIONS.format(count=len(scripts), names=names)
+
+
+def pack_sql_batches(template_content: str, scripts: list, token_budget: int = BATCH_TOKEN_BUDGET,
+                     max_scripts: int = MAX_SCRIPTS_PER_BATCH) -> list:
+    """
+    Groups [(script_name, sql_content), ...] in order into batches whose batch prompt
+    stays within token_budget estimated tokens. A script too large for the budget on
+    its own gets a batch of one.
+    """
+    batches = []
+    current = []
+    for script in scripts:
+        candidate = current + [script]
+        if current and (len(candidate) > max_scripts or estimate_tokens(build_batch_prompt(template_content, candidate)) > token_budget):
+            batches.append(current)
+            candidate = [script]
+        current = candidate
+    if current:
+        batches.append(current)
+    return batches
+
+
+def split_batch_answer(response_text: str, script_names: list) -> dict:
+    """
+    Splits a batch answer into {script_name: answer}. Keys are matched exactly, or
+    without a '.sql' suffix. Raises json.JSONDecodeError / ValueError for answers that
+    are not one JSON object.
+    """
+    data = json.loads(strip_code_fences(response_text))
+    if not isinstance(data, dict):
+        raise ValueError(f"Batch answer is a {type(data).__name__}, expected an object keyed by script name")
+    by_stem = {key[:-4] if key.lower().endswith(".sql") else key: value for key, value in data.items()}
+    return {name: by_stem[name] for name in script_names if name in by_stem}
+
+
+def generate_llm_batch_response(template_content: str, scripts: list, template_name: str, current_run_output_dir: str) -> list:
+    """
+    Sends several SQL scripts in one batch prompt and splits the keyed answer back into
+    the usual per-script answer files and metadata items.
+
+    Token usage is apportioned per script: the prompt total by each script's share of
+    the estimated prompt (shared template part split evenly), the answer total by the
+    size of each script's answer. "batch.estimated_unbatched_query_tokens" is what the
+    script's own prompt would have cost, scaled by the real/estimated ratio of the batch.
+
+    Args:
+        template_content: The prompt template text.
+        scripts: [(sql_file_name_base, sql_content), ...]
+        template_name: The name of the template file (without path).
+        current_run_output_dir: The output directory for this execution run.
+
+    Returns:
+        list: [(parsed_json_answer, metadata_dict), ...] in the order of `scripts`.
+              Scripts missing from the answer get parsed_json_answer None and
+              prompt_details.error "missing_from_batch_answer".
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    script_names = [name for name, _ in scripts]
+    prompt_for_api = build_batch_prompt(template_content, scripts)
+    label = f"template '{template_name}', batch of {len(scripts)} SQL scripts ({', '.join(script_names)})"
+
+    started = time.monotonic()
+    llm_call = call_llm(prompt_for_api, label, batch_answer_schema(script_names))
+    latency_seconds = round(time.monotonic() - started, 3)
+    answers = {}
+    error = None
+    try:
+        answers = split_batch_answer(llm_call["text"], script_names)
+    except (json.JSONDecodeError, ValueError) as e:
+        logging.error(f"Error: Invalid batch answer for {label}. Error: {e}. Response: {excerpt(llm_call['text'])!r}")
+        error = "invalid_batch_answer"
+    if answers and len(answers) == len(scripts):
+        cache_llm_answer(llm_call)
+
+    # --- Apportion token usage ---
+    batch_estimate = estimate_tokens(prompt_for_api)
+    shared_estimate = max(0, batch_estimate - sum(estimate_tokens(sql) for _, sql in scripts))
+    prompt_total = llm_call["prompt_tokens"] if llm_call["prompt_tokens"] is not None else batch_estimate
+    scale = prompt_total / batch_estimate
+    answer_sizes = {name: len(json.dumps(answers[name])) if name in answers else 0 for name in script_names}
+    answer_total = llm_call["answer_tokens"]
+
+    results = []
+    for position, (name, sql) in enumerate(scripts):
+        parsed_json_answer = None
+        if name in answers:
+            parsed_json_answer = process_llm_answer(json.dumps(answers[name], ensure_ascii=False), current_run_output_dir, name, timestamp)
+        elif error is None:
+            logging.warning(f"Script '{name}' missing from batch answer for {label}")
+
+        single_prompt = template_content.replace(PROMPT_PLACEHOLDER, sql)
+        query_tokens = round((shared_estimate / len(scripts) + estimate_tokens(sql)) * scale)
+        answer_tokens = None
+        if answer_total is not None and sum(answer_sizes.values()):
+            answer_tokens = round(answer_total * answer_sizes[name] / sum(answer_sizes.values()))
+
+        prompt_details = {
+            "sql_file_name": name,
+            "timestamp": timestamp,
+            "prompt_text_hash": prompt_digest(prompt_for_api),
+            "cache_hit": llm_call["cache_hit"],
+            "stream_restarts": llm_call["stream_restarts"],
+        }
+        if parsed_json_answer is None:
+            prompt_details["error"] = error or "missing_from_batch_answer"
+        results.append((parsed_json_answer, {
+            "prompt_details": prompt_details,
+            "usage": {
+                "query_tokens_used": query_tokens,
+                "answer_tokens_used": answer_tokens,
+            },
+            "batch": {
+                "scripts": len(scripts),
+                "position": position,
+                "query_tokens_total": llm_call["prompt_tokens"],
+                "answer_tokens_total": llm_call["answer_tokens"],
+                "estimated_unbatched_query_tokens": round(estimate_tokens(single_prompt) * scale),
+            },
+            "model_used": llm_call["model_name"],
+            "latency_seconds": latency_seconds, # Of the whole batch request
+            "response_summary": {
+                "answer_saved": parsed_json_answer is not None,
+                "answer_file": f"answer_{name}_{timestamp}.json" if parsed_json_answer is not None else None
+            }
+        }))
+    return results
+
+
 def save_consolidated_metadata(metadata_list: list, output_dir: str, template_name: str, execution_number: int):
     """
     Saves the collected list of metadata items into a single JSON file for the run.
@@ -299,9 +654,316 @@ def save_consolidated_metadata(metadata_list: list, output_dir: str, template_na
         logging.error(f"An unexpected error occurred during consolidated metadata saving: {e}")
 
 
+def usage_tokens(result) -> int | None:
+    """Total tokens reported in a generate_llm_response() result, for the rate limiter."""
+    if isinstance(result, list): # Batch: every item carries the totals of the one request
+        if not result:
+            return None
+        metadata_item = result[0][1]
+        usage = metadata_item.get("batch") or {}
+        counts = [usage.get("query_tokens_total"), usage.get("answer_tokens_total")]
+        if metadata_item["prompt_details"].get("cache_hit"):
+            return 0
+        return sum(counts) if all(count is not None for count in counts) else None
+    _, metadata_item = result
+    if ((metadata_item or {}).get("prompt_details") or {}).get("cache_hit"):
+        return 0
+    usage = (metadata_item or {}).get("usage") or {}
+    counts = [usage.get("query_tokens_used"), usage.get("answer_tokens_used")]
+    return sum(counts) if all(count is not None for count in counts) else None
+
+
+def prepare_template_run(template_full_path: str, resume: bool = False, create: bool = True):
+    """
+    Creates the next numbered output directory of a template, or with resume reuses
+    the latest one. Without create, only works out which it would be.
+    Returns (name, execution number, dir) or None.
+    """
+    template_base_name = os.path.splitext(os.path.basename(template_full_path))[0]
+    logging.info(f"--- Processing Template: {template_base_name} ---")
+
+    # Determine base output dir for this template
+    template_base_output_dir = os.path.join(BASE_OUTPUT_DIR, template_base_name)
+
+    # Determine the execution number for THIS run
+    if create or os.path.isdir(template_base_output_dir):
+        current_exec_number = get_next_execution_number(template_base_output_dir) # Creates the base dir
+    else:
+        current_exec_number = 1
+    if resume and current_exec_number > 1:
+        current_exec_number -= 1 # Continue the latest run
+        logging.info(f"Resuming execution #{current_exec_number} of template {template_base_name}")
+    current_run_output_dir = os.path.join(template_base_output_dir, str(current_exec_number))
+
+    if not create:
+        return template_base_name, current_exec_number, current_run_output_dir
+
+    # Create the output directory for this specific execution run *before* processing files
+    try:
+        os.makedirs(current_run_output_dir, exist_ok=True)
+        logging.info(f"Output directory for this run: {current_run_output_dir}")
+    except OSError as e:
+        logging.error(f"Could not create output directory {current_run_output_dir}. Skipping template {template_base_name}. Error: {e}")
+        return None
+    return template_base_name, current_exec_number, current_run_output_dir
+
+
+def run_journaled(lane: Lane, scripts: list, func, *args):
+    """Runs a job and journals every script it answered as soon as it is done (see RunJournal)."""
+    result = func(*args)
+    items = result if isinstance(result, list) else [result]
+    for script, (parsed_json_answer, metadata_item) in zip(scripts, items):
+        if parsed_json_answer is None:
+            continue # Failed answers are not checkpointed, a resumed run asks again
+        output_path = os.path.join(lane.output_dir, metadata_item["response_summary"]["answer_file"])
+        lane.journal.record(lane.template_name, script.filename, lane.template_sha256, script.sha256, output_path, metadata_item)
+    return result
+
+
+def schedule_job(lane: Lane, scripts: list, func, args, prompt: str, estimator: TokenEstimator) -> int:
+    """
+    Adds a journaled job to a lane, with the estimator's prompt + answer tokens as its
+    limiter estimate. Cached answers cost no quota, so they bypass the limiter.
+    """
+    is_cached = response_cache is not None and cache_key(cache_model_name(), GENERATION_CONFIG, prompt) in response_cache
+    if len(scripts) == 1:
+        label = f"{lane.template_name} / {scripts[0].filename}"
+    else:
+        label = f"{lane.template_name} / batch of {len(scripts)} ({', '.join(script.filename for script in scripts)})"
+    estimated_tokens = None if is_cached else estimator.prompt_tokens(prompt) + estimator.answer_tokens(prompt)
+    return lane.add_job(run_journaled, (lane, scripts, func, *args), estimated_tokens, label, prompt, is_cached)
+
+
+def plan_run(templates_dir: str = TEMPLATES_DIR, sql_files_dir: str = SQL_FILES_DIR,
+             use_batches: bool = USE_BATCH_PROMPTS, batch_token_budget: int = BATCH_TOKEN_BUDGET,
+             resume: bool = False, estimator: TokenEstimator = None, create: bool = True) -> list:
+    """
+    Builds the (template x SQL file) job matrix: every SQL file is read and hashed once
+    (read_sql_scripts) and every template gets a Lane with its own execution number,
+    output directory and RunJournal. With use_batches, a lane's scripts are packed into
+    batch prompts of at most batch_token_budget estimated tokens. With resume, the
+    latest run of each template is continued and scripts its journal lists as done
+    (from the same template and SQL text) are not sent again. Without create, nothing
+    is written to disk (for the preflight estimate; the lanes cannot be run).
+    """
+    estimator = estimator or TokenEstimator()
+    scripts = read_sql_scripts(sql_files_dir)
+    lanes = []
+    for template_filename in sorted(os.listdir(templates_dir)):
+        template_full_path = os.path.join(templates_dir, template_filename)
+        if not os.path.isfile(template_full_path):
+            logging.debug(f"Skipping non-file item in templates directory: {template_filename}")
+            continue
+        try:
+            with open(template_full_path, 'r', encoding='utf-8') as f_template:
+                template_content = f_template.read()
+        except OSError as e:
+            logging.error(f"Error reading template file '{template_full_path}': {e}")
+            continue
+        prepared = prepare_template_run(template_full_path, resume, create)
+        if prepared is None:
+            continue # Skip to the next template
+        template_base_name, current_exec_number, current_run_output_dir = prepared
+        lane = Lane(template_base_name, template_full_path, template_content, current_exec_number, current_run_output_dir,
+                    journal=RunJournal(current_run_output_dir, read_only=not create))
+
+        pending = []
+        for script in scripts:
+            entry = lane.journal.completed(lane.template_name, script.filename, lane.template_sha256, script.sha256) if resume else None
+            if entry is not None:
+                lane.resumed[script.filename] = entry["metadata"]
+            else:
+                pending.append(script)
+        if resume:
+            logging.info(f"Template {lane.template_name}: {len(lane.resumed)} SQL files already done, {len(pending)} to run")
+
+        entries = {}
+        if use_batches:
+            by_name = {script.name: script for script in pending}
+            for batch in pack_sql_batches(template_content, [(script.name, script.content) for script in pending], batch_token_budget):
+                job_index = schedule_job(
+                    lane,
+                    [by_name[name] for name, _ in batch],
+                    generate_llm_batch_response,
+                    (template_content, batch, lane.template_name, lane.output_dir),
+                    build_batch_prompt(template_content, batch),
+                    estimator,
+                )
+                for position, (name, _) in enumerate(batch):
+                    entries[by_name[name].filename] = [by_name[name].filename, job_index, position]
+            logging.info(f"Packed {len(pending)} SQL files into {len(lane.jobs)} batch prompts for template {lane.template_name}")
+        else:
+            for script in pending:
+                prompt = render_prompt(template_content, script.content, template_full_path)
+                entries[script.filename] = [script.filename, schedule_job(
+                    lane,
+                    [script],
+                    generate_llm_response,
+                    (prompt, lane.template_name, script.name, lane.output_dir, answer_schema_for(template_content)),
+                    prompt,
+                    estimator,
+                ), None]
+        # Keep SQL file order, with resumed scripts in place
+        lane.entries = [entries.get(script.filename, [script.filename, None, None]) for script in scripts]
+        lanes.append(lane)
+    return lanes
+
+
+def schedule_batch_fallbacks(lane: Lane, scripts_by_filename: dict, estimator: TokenEstimator) -> int:
+    """Adds single-prompt jobs for scripts a batch answer left out (or garbled). Returns how many."""
+    added = 0
+    for entry in lane.entries:
+        if entry[2] is None:
+            continue
+        result = lane.result(entry)
+        if isinstance(result, Exception) or result[0] is None:
+            script = scripts_by_filename[entry[0]]
+            prompt = render_prompt(lane.template_content, script.content, lane.template_path)
+            args = (prompt, lane.template_name, script.name, lane.output_dir, answer_schema_for(lane.template_content))
+            entry[1] = schedule_job(lane, [script], generate_llm_response, args, prompt, estimator)
+            entry[2] = None
+            added += 1
+    return added
+
+
+def save_lane_metadata(lane: Lane, metadata_store: MetadataStore = None) -> None:
+    """
+    Collects a lane's metadata items in SQL file order, journaled ones for scripts done
+    by an earlier attempt, and saves them with save_consolidated_metadata() and, if
+    given, to the metadata store.
+    """
+    # List to hold metadata for all SQL files processed in this run for this template
+    run_metadata_list = []
+    for entry in lane.entries:
+        sql_filename = entry[0]
+        if entry[1] is None:
+            run_metadata_list.append(lane.resumed[sql_filename])
+            continue
+        result = lane.result(entry)
+        sql_file_name_base = os.path.splitext(sql_filename)[0]
+        if isinstance(result, Exception):
+            logging.error(f"Unhandled error processing Template: {lane.template_name}, SQL: {sql_filename}. Error: {result}")
+            run_metadata_list.append({"prompt_details": {"sql_file_name": sql_file_name_base, "error": f"Unhandled processing error: {type(result).__name__}"}})
+            continue
+        parsed_answer, metadata_item = result
+        if metadata_item:
+            run_metadata_list.append(metadata_item)
+        else:
+            logging.warning(f"No metadata item returned for {sql_filename}")
+        if parsed_answer is None:
+            logging.warning(f"Processing failed or returned no answer JSON for SQL: {sql_filename}")
+
+    # Save the consolidated metadata for this execution run
+    if lane.entries:
+        save_consolidated_metadata(run_metadata_list, lane.output_dir, lane.template_name, lane.execution_number)
+        if metadata_store is not None:
+            try:
+                rows = metadata_store.record_run(lane.template_name, lane.execution_number, run_metadata_list)
+                logging.info(f"Recorded {rows} calls of template {lane.template_name} #{lane.execution_number} in {metadata_store.db_path}")
+            except Exception as e:
+                logging.error(f"Error recording run {lane.execution_number} of {lane.template_name} in the metadata store: {e}")
+    else:
+        logging.info(f"No SQL files processed for template {lane.template_name} in this run. No metadata file created.")
+
+
+def run_all_templates(templates_dir: str = TEMPLATES_DIR, sql_files_dir: str = SQL_FILES_DIR,
+                      workers: int = MAX_CONCURRENT_REQUESTS,
+                      requests_per_minute: float = REQUESTS_PER_MINUTE,
+                      tokens_per_minute: float = TOKENS_PER_MINUTE,
+                      use_batches: bool = USE_BATCH_PROMPTS,
+                      batch_token_budget: int = BATCH_TOKEN_BUDGET,
+                      resume: bool = False) -> dict:
+    """
+    Runs every template against every SQL file. plan_run() builds one lane per
+    template; the lanes run side by side with `workers` workers each under one shared
+    requests/min and tokens/min limiter, so comparing templates takes about as long as
+    the slowest one. With use_batches, scripts missing from a batch answer are asked
+    again on their own. Metadata is saved per template in SQL file order, as before.
+    With resume, an interrupted run is continued from its journal (see plan_run).
+    Job token estimates come from a TokenEstimator calibrated on earlier runs, and
+    the preflight estimate of the whole run is logged before the first request.
+    Returns the scheduler statistics.
+    """
+    get_model() # A missing API key aborts the run here instead of failing every job
+    span_recorder.new_run()
+    run_started = time.time()
+    estimator = calibrated_estimator(BASE_OUTPUT_DIR, templates_dir, sql_files_dir)
+    lanes = plan_run(templates_dir, sql_files_dir, use_batches, batch_token_budget, resume, estimator)
+    report = estimate_lanes(lanes, estimator, workers, requests_per_minute, tokens_per_minute)
+    logging.info(f"Preflight: {report['calls']} calls, ~{report['prompt_tokens']} prompt + ~{report['answer_tokens']} answer tokens, ~${report['cost_usd']:.4f}, ~{report['duration_seconds']:.0f}s")
+    for label, tokens in report["over_budget"]:
+        logging.warning(f"Prompt {label} is predicted at ~{tokens} tokens, over the {PROMPT_TOKEN_BUDGET} token budget")
+
+    limiter = TokenBucketLimiter(requests_per_minute, tokens_per_minute)
+    logging.info(f"Running {sum(len(lane.jobs) for lane in lanes)} LLM calls in {len(lanes)} template lanes with {workers} workers each ({requests_per_minute} requests/min, {tokens_per_minute} tokens/min)")
+    stats = run_lanes(lanes, limiter, workers, usage_of=usage_tokens, largest_first=LARGEST_FIRST, recorder=span_recorder)
+
+    if use_batches:
+        scripts_by_filename = {script.filename: script for script in read_sql_scripts(sql_files_dir)}
+        if sum(schedule_batch_fallbacks(lane, scripts_by_filename, estimator) for lane in lanes):
+            logging.info("Re-sending scripts missing from batch answers as single prompts")
+            for name, value in run_lanes(lanes, limiter, workers, usage_of=usage_tokens, largest_first=LARGEST_FIRST, recorder=span_recorder).items():
+                stats[name] += value
+
+    metadata_store = open_metadata_store(METADATA_STORE_PATH) if METADATA_STORE_PATH else None
+    for lane in lanes:
+        save_lane_metadata(lane, metadata_store)
+        lane.journal.close()
+    if metadata_store is not None:
+        metadata_store.close()
+
+    logging.info(f"Scheduler: {stats}, waited {limiter.waited_seconds:.1f}s for quota")
+    if response_cache is not None:
+        logging.info(f"Response cache: {response_cache.stats()}")
+    span_recorder.record("run", run_started, time.time(), templates=len(lanes),
+                         scripts=sum(len(lane.entries) - len(lane.resumed) for lane in lanes), calls=stats["calls"])
+    summary = span_recorder.summary()
+    if summary:
+        logging.info(f"Timing: {summary['scripts_per_minute']} scripts/min, {summary['tokens_per_second']} tokens/s, "
+                     f"API {summary['api_seconds_total']:.1f}s, queued {summary['queue_seconds_total']:.1f}s, "
+                     f"rate limit/backoff {summary['quota_wait_seconds_total']:.1f}s over {summary['wall_seconds']:.1f}s")
+    return stats
+
+
+def estimate_lanes(lanes: list, estimator: TokenEstimator, workers: int,
+                   requests_per_minute: float, tokens_per_minute: float) -> dict:
+    """preflight_report() over the pending jobs of all lanes, with the module's budget and prices."""
+    prompts = [prompt for lane in lanes for prompt in lane.prompts[len(lane.results):]]
+    return preflight_report(
+        prompts, estimator, PROMPT_TOKEN_BUDGET, INPUT_PRICE_PER_MILLION, OUTPUT_PRICE_PER_MILLION,
+        requests_per_minute, tokens_per_minute, workers * max(1, len(lanes)), SECONDS_PER_CALL,
+    )
+
+
+def preflight(templates_dir: str = TEMPLATES_DIR, sql_files_dir: str = SQL_FILES_DIR,
+              workers: int = MAX_CONCURRENT_REQUESTS,
+              requests_per_minute: float = REQUESTS_PER_MINUTE,
+              tokens_per_minute: float = TOKENS_PER_MINUTE,
+              use_batches: bool = USE_BATCH_PROMPTS,
+              batch_token_budget: int = BATCH_TOKEN_BUDGET,
+              resume: bool = False) -> dict:
+    """
+    Prints what run_all_templates() with the same arguments would send: calls, tokens,
+    cost, duration and the prompts over PROMPT_TOKEN_BUDGET. Sends no request and
+    writes nothing. Returns the report.
+    """
+    estimator = calibrated_estimator(BASE_OUTPUT_DIR, templates_dir, sql_files_dir)
+    lanes = plan_run(templates_dir, sql_files_dir, use_batches, batch_token_budget, resume, estimator, create=False)
+    report = estimate_lanes(lanes, estimator, workers, requests_per_minute, tokens_per_minute)
+    print_preflight_report(report, PROMPT_TOKEN_BUDGET)
+    return report
+
+
 # --- Main Execution Logic ---
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract column lineage from SQL files with every prompt template.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the latest run of each template, skipping SQL files its journal lists as done")
+    parser.add_argument("--preflight", action="store_true",
+                        help="only print the predicted tokens, cost and duration of the run; send nothing")
+    args = parser.parse_args()
+
     start_time = datetime.now()
     logging.info(f"Script started at {start_time.isoformat()}")
 
@@ -312,91 +974,11 @@ if __name__ == "__main__":
         logging.error(f"Templates directory not found: {TEMPLATES_DIR}")
         exit(1)
 
-    # Iterate through each template file in the templates directory
-    for template_filename in os.listdir(TEMPLATES_DIR):
-        template_full_path = os.path.join(TEMPLATES_DIR, template_filename)
-
-        if os.path.isfile(template_full_path):
-            template_base_name = os.path.splitext(template_filename)[0]
-            logging.info(f"--- Processing Template: {template_base_name} ---")
-
-            # Determine base output dir for this template
-            template_base_output_dir = os.path.join(BASE_OUTPUT_DIR, template_base_name)
-
-            # Determine the execution number for THIS run
-            current_exec_number = get_next_execution_number(template_base_output_dir)
-            current_run_output_dir = os.path.join(template_base_output_dir, str(current_exec_number))
+    if args.preflight:
+        preflight(resume=args.resume)
+        exit(0)
 
-            # Create the output directory for this specific execution run *before* processing files
-            try:
-                os.makedirs(current_run_output_dir, exist_ok=True)
-                logging.info(f"Output directory for this run: {current_run_output_dir}")
-            except OSError as e:
-                logging.error(f"Could not create output directory {current_run_output_dir}. Skipping template {template_base_name}. Error: {e}")
-                continue # Skip to the next template
-
-            # List to hold metadata for all SQL files processed in this run for this template
-            run_metadata_list = []
-
-            # Iterate through each SQL file for the current template
-            sql_files_processed_count = 0
-            for sql_filename in os.listdir(SQL_FILES_DIR):
-                if sql_filename.lower().endswith(".sql"):
-                    sql_full_path = os.path.join(SQL_FILES_DIR, sql_filename)
-                    sql_file_name_base = os.path.splitext(sql_filename)[0]
-
-                    try:
-                        # 1. Create the prompt
-                        prompt = create_prompt_from_files(template_full_path, sql_full_path)
-
-                        # 2. Call the API, get answer and metadata item
-                        parsed_answer, metadata_item = generate_llm_response(
-                            prompt,
-                            template_base_name,
-                            sql_file_name_base,
-                            current_run_output_dir # Pass the specific dir for this run/exec number
-                        )
-
-                        # 3. Collect metadata for this SQL file
-                        if metadata_item:
-                             # Add execution context to the item if needed (already in structure)
-                             # metadata_item['execution_number'] = current_exec_number
-                             run_metadata_list.append(metadata_item)
-                        else:
-                            logging.warning(f"No metadata item returned for {sql_filename}")
-
-
-                        if parsed_answer is None:
-                            logging.warning(f"Processing failed or returned no answer JSON for SQL: {sql_filename}")
-                        # else: parsed_answer contains the dict if needed downstream
-
-                        sql_files_processed_count += 1
-
-                        # Optional: Add a delay between API calls
-                        logging.debug("Sleeping for 5 seconds before next API call...")
-                        time.sleep(5)
-
-                    except FileNotFoundError as fnf_error:
-                        logging.error(f"Skipping pair due to FileNotFoundError: {fnf_error}")
-                        continue
-                    except Exception as e:
-                        logging.exception(f"Unhandled error processing Template: {template_base_name}, SQL: {sql_filename}. Error: {e}")
-                        # Optionally add error info to metadata list
-                        error_meta = {"prompt_details": {"sql_file_name": sql_file_name_base, "error": f"Unhandled processing error: {type(e).__name__}"}}
-                        run_metadata_list.append(error_meta)
-                        continue # Continue with the next SQL file
-                else:
-                     logging.debug(f"Skipping non-SQL file: {sql_filename}")
-
-            # --- After processing all SQL files for the template ---
-            # Save the consolidated metadata for this execution run
-            if sql_files_processed_count > 0:
-                 save_consolidated_metadata(run_metadata_list, current_run_output_dir, template_base_name, current_exec_number)
-            else:
-                 logging.info(f"No SQL files processed for template {template_base_name} in this run. No metadata file created.")
-
-        else:
-            logging.debug(f"Skipping non-file item in templates directory: {template_filename}")
+    run_all_templates(resume=args.resume)
 
     end_time = datetime.now()
-    logging.info(f"Script finished at {end_time.isoformat()}. Total duration: {end_time - start_time}")
\ No newline at end of file
+    logging.info(f"Script finished at {end_time.isoformat()}. Total duration: {end_time - start_time}")
@@ -0,0 +1,218 @@
+import os
+import json
+import logging
+import argparse
+from datetime import datetime
+
+import duckdb
+
+METADATA_FILENAME = "_metadata_run.json"
+
+CALLS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS llm_calls (
+        template VARCHAR NOT NULL,
+        execution_number INTEGER NOT NULL,
+        sql_file VARCHAR,
+        called_at TIMESTAMP,
+        recorded_at TIMESTAMP NOT NULL,
+        model VARCHAR,
+        status VARCHAR NOT NULL, -- ok, invalid_answer or error
+        error VARCHAR,
+        query_tokens INTEGER,
+        answer_tokens INTEGER,
+        latency_seconds DOUBLE,
+        prompt_chars INTEGER,
+        cache_hit BOOLEAN,
+        stream_restarts INTEGER,
+        batch_scripts INTEGER
+    )
+"""
+
+# Vectorised replacements for looping over _metadata_run.json files
+LATENCY_BY_TEMPLATE_QUERY = """
+    SELECT template,
+           count(*) AS calls,
+           round(quantile_cont(latency_seconds, 0.5), 3) AS p50_seconds,
+           round(quantile_cont(latency_seconds, 0.95), 3) AS p95_seconds,
+           round(max(latency_seconds), 3) AS max_seconds
+    FROM llm_calls
+    WHERE latency_seconds IS NOT NULL AND NOT coalesce(cache_hit, false)
+    GROUP BY template
+    ORDER BY template
+"""
+
+TOKEN_USAGE_QUERY = """
+    SELECT template,
+           execution_number,
+           count(*) AS calls,
+           count(*) FILTER (WHERE status = 'ok') AS answers_saved,
+           min(query_tokens) AS min_query_tokens,
+           arg_min(sql_file, query_tokens) AS min_query_file,
+           max(query_tokens) AS max_query_tokens,
+           arg_max(sql_file, query_tokens) AS max_query_file,
+           round(avg(query_tokens), 2) AS avg_query_tokens,
+           sum(query_tokens) AS sum_query_tokens,
+           min(answer_tokens) AS min_answer_tokens,
+           max(answer_tokens) AS max_answer_tokens,
+           round(avg(answer_tokens), 2) AS avg_answer_tokens,
+           sum(answer_tokens) AS sum_answer_tokens
+    FROM llm_calls
+    GROUP BY template, execution_number
+    ORDER BY template, execution_number
+"""
+
+TOKENS_BY_SCRIPT_QUERY = """
+    SELECT sql_file,
+           template,
+           execution_number,
+           min(called_at) AS called_at,
+           sum(query_tokens) AS query_tokens,
+           sum(answer_tokens) AS answer_tokens,
+           sum(query_tokens) - lag(sum(query_tokens)) OVER (PARTITION BY sql_file, template ORDER BY execution_number) AS query_tokens_change
+    FROM llm_calls
+    GROUP BY sql_file, template, execution_number
+    ORDER BY sql_file, template, execution_number
+"""
+
+
+def metadata_row(template_name: str, execution_number: int, item: dict, recorded_at: datetime) -> tuple:
+    """Flattens one metadata item of save_consolidated_metadata() into an llm_calls row."""
+    details = item.get("prompt_details") or {}
+    usage = item.get("usage") or {}
+    summary = item.get("response_summary") or {}
+    called_at = None
+    if details.get("timestamp"):
+        try:
+            called_at = datetime.strptime(details["timestamp"], "%Y%m%d_%H%M%S_%f")
+        except ValueError:
+            pass
+    if details.get("error") and not summary.get("answer_saved"):
+        status = "error"
+    else:
+        status = "ok" if summary.get("answer_saved") else "invalid_answer"
+    return (
+        template_name,
+        execution_number,
+        details.get("sql_file_name"),
+        called_at,
+        recorded_at,
+        item.get("model_used"),
+        status,
+        details.get("error"),
+        usage.get("query_tokens_used"),
+        usage.get("answer_tokens_used"),
+        item.get("latency_seconds"),
+        details.get("prompt_chars"),
+        details.get("cache_hit"),
+        details.get("stream_restarts"),
+        (item.get("batch") or {}).get("scripts"),
+    )
+
+
+class MetadataStore:
+    """
+    One DuckDB table (llm_calls) with a row per LLM call of every template and
+    execution run, so token and latency analytics are single queries over all runs
+    instead of loops over _metadata_run.json files. Recording a run replaces its
+    earlier rows, so resumed or re-imported runs are not counted twice.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = duckdb.connect(db_path)
+        self.conn.execute(CALLS_TABLE_DDL)
+
+    def record_run(self, template_name: str, execution_number: int, metadata_list: list, recorded_at: datetime = None) -> int:
+        """Stores the metadata items of one execution run. Returns the number of rows written."""
+        recorded_at = recorded_at or datetime.now()
+        rows = [metadata_row(template_name, execution_number, item, recorded_at) for item in metadata_list]
+        self.conn.execute("BEGIN TRANSACTION")
+        try:
+            self.conn.execute("DELETE FROM llm_calls WHERE template = ? AND execution_number = ?", [template_name, execution_number])
+            if rows:
+                self.conn.executemany(f"INSERT INTO llm_calls VALUES ({', '.join(['?'] * len(rows[0]))})", rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def import_json_runs(self, base_output_dir: str) -> int:
+        """Loads every <template>/<execution>/_metadata_run.json under base_output_dir. Returns the number of runs."""
+        runs = 0
+        for template_name in sorted(os.listdir(base_output_dir)):
+            template_dir = os.path.join(base_output_dir, template_name)
+            if not os.path.isdir(template_dir):
+                continue
+            for execution in sorted(os.listdir(template_dir)):
+                metadata_path = os.path.join(template_dir, execution, METADATA_FILENAME)
+                if not execution.isdigit() or not os.path.isfile(metadata_path):
+                    continue
+                try:
+                    with open(metadata_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.warning(f"Skipping unreadable metadata file {metadata_path}: {e}")
+                    continue
+                recorded_at = None
+                if data.get("run_timestamp"):
+                    recorded_at = datetime.fromisoformat(data["run_timestamp"])
+                self.record_run(template_name, int(execution), data.get("individual_prompts_metadata", []), recorded_at)
+                runs += 1
+        logging.info(f"Imported {runs} metadata files from {base_output_dir} into {self.db_path}")
+        return runs
+
+    def query(self, sql: str, params: list = None) -> list:
+        """Runs a query and returns its rows as dicts."""
+        cursor = self.conn.execute(sql, params or [])
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def latency_by_template(self) -> list:
+        return self.query(LATENCY_BY_TEMPLATE_QUERY)
+
+    def token_usage(self) -> list:
+        return self.query(TOKEN_USAGE_QUERY)
+
+    def tokens_by_script(self) -> list:
+        return self.query(TOKENS_BY_SCRIPT_QUERY)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_metadata_store(db_path: str):
+    """Opens the store, or logs why it cannot be opened (e.g. locked by another process) and returns None."""
+    try:
+        return MetadataStore(db_path)
+    except (duckdb.Error, OSError) as e:
+        logging.error(f"Could not open metadata store {db_path}, runs are only saved as JSON: {e}")
+        return None
+
+
+def print_report(store: MetadataStore) -> None:
+    print("Token Usage by Template and Execution:")
+    for row in store.token_usage():
+        print(f"  {row['template']} #{row['execution_number']}: {row['calls']} calls, {row['answers_saved']} answers saved")
+        print(f"    Query tokens  min {row['min_query_tokens']} ({row['min_query_file']}), max {row['max_query_tokens']} ({row['max_query_file']}), avg {row['avg_query_tokens']}, sum {row['sum_query_tokens']}")
+        print(f"    Answer tokens min {row['min_answer_tokens']}, max {row['max_answer_tokens']}, avg {row['avg_answer_tokens']}, sum {row['sum_answer_tokens']}")
+
+    print("\nLatency by Template (API calls, cache hits excluded):")
+    for row in store.latency_by_template():
+        print(f"  {row['template']}: {row['calls']} calls, p50 {row['p50_seconds']}s, p95 {row['p95_seconds']}s, max {row['max_seconds']}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Token and latency report over all recorded LLM runs.")
+    parser.add_argument("db_path", help="DuckDB metadata store, e.g. LLM_answers/llm_metadata.duckdb")
+    parser.add_argument("--import-json", metavar="BASE_OUTPUT_DIR",
+                        help="first load every _metadata_run.json below this directory (LLM_answers)")
+    args = parser.parse_args()
+
+    store = MetadataStore(args.db_path)
+    if args.import_json:
+        store.import_json_runs(args.import_json)
+    print_report(store)
+    store.close()
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from types import SimpleNamespace
+
+from llm_scheduler import estimate_tokens
+
+# A model client is anything with the part of google.generativeai.GenerativeModel the
+# extractors use:
+#   model_name                                           str
+#   generate_content(contents, generation_config=None,   response with .text, .parts,
+#                    stream=False)                       .candidates and .usage_metadata;
+#                                                        streamed, it iterates over chunks
+# genai.GenerativeModel is the online client; ReplayModel answers offline from recordings.
+
+SCRIPT_HEADER_PATTERN = re.compile(r"^=== SCRIPT: (.+?) ===$", re.MULTILINE) # lineage_extractor_v2.SCRIPT_HEADER
+ANSWER_FILE_PATTERN = re.compile(r"^answer_(.+)_\d{8}_\d{6}_\d{6}\.json$") # lineage_extractor_v2 answer files
+STREAM_CHUNK_CHARS = 200
+
+Recording = namedtuple("Recording", ["name", "sql", "answer_text"])
+
+
+class ReplayMissError(LookupError):
+    """A prompt with no recorded answer (and no fallback answer)."""
+
+
+class InjectedRateLimitError(Exception):
+    """Stands in for google.api_core ResourceExhausted; is_rate_limit_error() recognises its status code."""
+    code = 429
+
+
+class InjectedServerError(Exception):
+    """Stands in for any other failed request (HTTP 500)."""
+
+
+def load_recordings(answers_dir: str, sql_files_dir: str) -> list:
+    """
+    Recorded answers as [Recording(name, sql, answer_text), ...], one per SQL script.
+    answers_dir holds <script>.json files (agentic/Agent_LLM_JSONs) or the
+    answer_<script>_<timestamp>.json files of one lineage_extractor_v2 run, the latest
+    per script winning. sql is the stripped text of <script>.sql from sql_files_dir,
+    or None if it is gone (then only batch prompts, which name their scripts, find it).
+    """
+    answers = {}
+    for filename in sorted(os.listdir(answers_dir)):
+        match = ANSWER_FILE_PATTERN.match(filename)
+        if match:
+            name = match.group(1)
+        elif filename.endswith(".json") and not filename.startswith("_"):
+            name = filename[:-len(".json")]
+        else:
+            continue
+        with open(os.path.join(answers_dir, filename), "r", encoding="utf-8") as f:
+            answers[name] = json.dumps(json.load(f), indent=2, ensure_ascii=False)
+    recordings = []
+    for name, answer_text in answers.items():
+        sql = None
+        sql_path = os.path.join(sql_files_dir, f"{name}.sql")
+        if os.path.isfile(sql_path):
+            with open(sql_path, "r", encoding="utf-8") as f:
+                sql = f.read().strip() or None
+        recordings.append(Recording(name, sql, answer_text))
+    logging.info(f"Loaded {len(recordings)} recorded answers from {answers_dir}")
+    return recordings
+
+
+def replay_response(text: str, prompt_tokens: int, answer_tokens: int) -> SimpleNamespace:
+    """A response shaped like a finished GenerateContentResponse."""
+    part = SimpleNamespace(text=text)
+    return SimpleNamespace(
+        text=text,
+        parts=[part],
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=SimpleNamespace(name="STOP"))],
+        usage_metadata=SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=answer_tokens,
+                                       total_token_count=prompt_tokens + answer_tokens),
+        prompt_feedback=None,
+    )
+
+
+class ReplayStream:
+    """A streamed replay answer: iterates over chunk responses, spreading the generation time over them."""
+
+    def __init__(self, text: str, prompt_tokens: int, answer_tokens: int, generation_seconds: float):
+        self.chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        self.generation_seconds = generation_seconds
+        self.usage_metadata = replay_response(text, prompt_tokens, answer_tokens).usage_metadata
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.generation_seconds:
+                time.sleep(self.generation_seconds / len(self.chunks))
+            yield replay_response(chunk, 0, 0)
+
+
+class ReplayModel:
+    """
+    Offline model client answering from recorded lineage answers, for benchmarking
+    the extractors without network access or API quota. A prompt gets the answer of
+    the longest recorded SQL script it contains; a batch prompt gets an object keyed
+    by the script names of its "=== SCRIPT: ... ===" headers. Other prompts get
+    fallback_answer, or raise ReplayMissError.
+
+    Each request waits latency_seconds (+/- latency_jitter) before the first token and
+    seconds_per_answer_token while generating, and fails with probability
+    rate_limit_rate (an immediate 429) or error_rate (a 500 after the latency). The
+    random draws depend only on seed, the prompt and how often it was sent before, so
+    a run replays the same way whatever the thread interleaving.
+    """
+
+    def __init__(self, recordings: list, model_name: str = "replay", fallback_answer: dict = None,
+                 latency_seconds: float = 0.0, latency_jitter: float = 0.0, seconds_per_answer_token: float = 0.0,
+                 rate_limit_rate: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.model_name = f"models/{model_name}"
+        self.recordings = sorted((r for r in recordings if r.sql), key=lambda r: -len(r.sql))
+        self.recordings_by_name = {r.name: r for r in recordings}
+        self.fallback_answer = fallback_answer
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.seconds_per_answer_token = seconds_per_answer_token
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def answer_for(self, prompt: str) -> str:
+        """The recorded answer text for a prompt."""
+        names = SCRIPT_HEADER_PATTERN.findall(prompt)
+        if names:
+            answers = {name: json.loads(self.recordings_by_name[name].answer_text) for name in names if name in self.recordings_by_name}
+            return json.dumps(answers, indent=2, ensure_ascii=False)
+        for recording in self.recordings:
+            if recording.sql in prompt:
+                return recording.answer_text
+        if self.fallback_answer is not None:
+            return json.dumps(self.fallback_answer, indent=2)
+        raise ReplayMissError(f"No recorded answer for prompt starting {prompt[:80]!r}")
+
+    def _random(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            self.calls += 1
+            sent_before = self._sent.get(digest, 0)
+            self._sent[digest] = sent_before + 1
+        return random.Random(f"{self.seed}:{digest}:{sent_before}")
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        prompt = contents if isinstance(contents, str) else str(contents)
+        rng = self._random(prompt)
+        if rng.random() < self.rate_limit_rate:
+            self._count_error()
+            raise InjectedRateLimitError("429 Resource has been exhausted (injected by the replay backend)")
+        time.sleep(max(0.0, self.latency_seconds + rng.uniform(-self.latency_jitter, self.latency_jitter)))
+        if rng.random() < self.error_rate:
+            self._count_error()
+            raise InjectedServerError("500 An internal error has occurred (injected by the replay backend)")
+
+        text = f"```json\n{self.answer_for(prompt)}\n```"
+        prompt_tokens = estimate_tokens(prompt)
+        answer_tokens = estimate_tokens(text)
+        generation_seconds = answer_tokens * self.seconds_per_answer_token
+        if stream:
+            return ReplayStream(text, prompt_tokens, answer_tokens, generation_seconds)
+        if generation_seconds:
+            time.sleep(generation_seconds)
+        return replay_response(text, prompt_tokens, answer_tokens)
+
+    def _count_error(self) -> None:
+        with self._lock:
+            self.errors += 1
@@ -4,8 +4,14 @@ from google import genai
 from google.genai import types
 import json
 import re
+import sys
+import time
 from datetime import datetime
 
+# Span recorder shared with the extractors in src/main/llm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from call_timing import SpanRecorder
+
 
 
 
@@ -34,6 +40,7 @@ prompt = prompt.replace("[YOUR SQL QUERY HERE]", python_code_text)
 
 
 
+call_start = time.time()
 response = client.models.generate_content(
     model="gemini-2.0-flash",
     config=types.GenerateContentConfig(
@@ -41,6 +48,7 @@ response = client.models.generate_content(
         temperature=0.1),
     contents=prompt
 )
+call_end = time.time()
 
 # Write the model response to a JSON file
 txt_path = "model_response.txt"
@@ -48,3 +56,13 @@ with open(txt_path, "w") as txt_file:
     txt_file.write(response.text)
 
 print(f"Model response written to {txt_path}")
+
+# Timing spans (python ../call_timing.py llm_spans.jsonl)
+spans_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_spans.jsonl")
+span_recorder = SpanRecorder(spans_path, "lineage_extractor_python")
+usage = response.usage_metadata
+span_recorder.record("llm_call", call_start, call_end, label=os.path.basename(file_path),
+                     prompt_tokens=getattr(usage, "prompt_token_count", None),
+                     answer_tokens=getattr(usage, "candidates_token_count", None))
+span_recorder.record("run", call_start, time.time(), scripts=1)
+span_recorder.close()
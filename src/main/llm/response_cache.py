@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def prompt_digest(prompt: str) -> str:
+    """Stable sha256 of a prompt (unlike hash(), the same in every process)."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def cache_key(model_name: str, generation_config: dict, prompt: str) -> str:
+    """Digest of everything that determines a response: model, generation config and prompt."""
+    payload = json.dumps(
+        {"model": model_name, "config": generation_config, "prompt": prompt_digest(prompt)},
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of raw LLM responses and their token usage, keyed by
+    cache_key(). Least recently used entries are evicted once the stored response
+    text exceeds max_bytes. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response_text TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                answer_tokens INTEGER,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns {"response_text", "prompt_tokens", "answer_tokens", "model"} or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response_text, prompt_tokens, answer_tokens, model FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return {"response_text": row[0], "prompt_tokens": row[1], "answer_tokens": row[2], "model": row[3]}
+
+    def __contains__(self, key: str) -> bool:
+        """Checks for an entry without counting a hit or miss."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, response_text: str, prompt_tokens=None, answer_tokens=None, model: str = None) -> None:
+        now = time.time()
+        size = len(response_text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO responses (key, model, response_text, prompt_tokens, answer_tokens, size, created, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, model, response_text, prompt_tokens, answer_tokens, size, now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Deletes least recently used entries until the total size fits max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        logging.info(f"Response cache evicted down to {total} bytes (limit {self.max_bytes}).")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,90 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+JOURNAL_FILENAME = "_journal.jsonl"
+
+
+class RunJournal:
+    """
+    Append-only JSONL checkpoint of one execution run: a line per completed
+    (template, SQL file) job with the hashes it was made from, the answer file and
+    its metadata item. Lines are flushed to disk as jobs finish, so after a crash
+    the journal lists exactly the work that does not have to be paid for again.
+    Safe to share between threads. A read_only journal only loads the entries.
+    """
+
+    def __init__(self, run_output_dir: str, read_only: bool = False):
+        self.path = os.path.join(run_output_dir, JOURNAL_FILENAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(self.path):
+            self._load()
+        if read_only:
+            return
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n") # Close a torn last line so the next entry starts on its own line
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    key = (entry["template"], entry["sql_file"])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # A crash mid-write leaves a torn last line (older journal formats lack the
+                    # keys); that job simply runs again
+                    logging.warning(f"Ignoring unreadable line {line_number} of {self.path}")
+                    continue
+                self.entries[key] = entry
+        logging.info(f"Loaded {len(self.entries)} completed jobs from {self.path}")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def completed(self, template_name: str, sql_filename: str, template_sha256: str, sql_sha256: str):
+        """
+        Returns the journal entry of a job if it completed from the same template and
+        SQL text and its answer file still exists, otherwise None.
+        """
+        entry = self.entries.get((template_name, sql_filename))
+        if entry is None:
+            return None
+        if entry["template_sha256"] != template_sha256 or entry["sql_sha256"] != sql_sha256:
+            logging.info(f"{sql_filename} changed since it was journaled for template {template_name}; running it again")
+            return None
+        if not os.path.exists(entry["output_path"]):
+            logging.warning(f"Journaled answer {entry['output_path']} is missing; running {sql_filename} again")
+            return None
+        return entry
+
+    def record(self, template_name: str, sql_filename: str, template_sha256: str, sql_sha256: str,
+               output_path: str, metadata_item: dict) -> None:
+        entry = {
+            "template": template_name,
+            "sql_file": sql_filename,
+            "template_sha256": template_sha256,
+            "sql_sha256": sql_sha256,
+            "output_path": output_path,
+            "completed_at": datetime.now().isoformat(),
+            "metadata": metadata_item,
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.entries[(template_name, sql_filename)] = entry
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_scheduler import RequestScheduler
+
+# One SQL file, read and hashed once per run and shared by every template
+SqlScript = namedtuple("SqlScript", ["name", "filename", "path", "content", "sha256"])
+
+
+def read_sql_scripts(sql_files_dir: str) -> list:
+    """Reads and hashes every .sql file of a directory once. Returns SqlScripts sorted by filename."""
+    scripts = []
+    for filename in sorted(os.listdir(sql_files_dir)):
+        if not filename.lower().endswith(".sql"):
+            continue
+        path = os.path.join(sql_files_dir, filename)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            content = raw.decode("utf-8")
+        except (OSError, UnicodeDecodeError) as e:
+            logging.error(f"Skipping SQL file {filename}: {e}")
+            continue
+        scripts.append(SqlScript(os.path.splitext(filename)[0], filename, path, content, hashlib.sha256(raw).hexdigest()))
+    logging.info(f"Read {len(scripts)} SQL files from {sql_files_dir}")
+    return scripts
+
+
+class Lane:
+    """
+    The jobs of one template in a run: its own execution number and output directory,
+    its own workers, and a rate limiter shared with every other lane.
+
+    jobs are (func, args, estimated_tokens) as for RequestScheduler; results[i] is the
+    result (or exception) of jobs[i] once run, prompts[i] its (label, prompt, cached)
+    for the preflight estimate. entries are [sql_filename, job index,
+    batch position or None], in SQL file order; a job index of None marks a script
+    completed by an earlier attempt of the run, whose metadata item is in resumed.
+    """
+
+    def __init__(self, template_name: str, template_path: str, template_content: str, execution_number: int, output_dir: str,
+                 journal=None):
+        self.template_name = template_name
+        self.template_path = template_path
+        self.template_content = template_content
+        self.template_sha256 = hashlib.sha256(template_content.encode("utf-8")).hexdigest()
+        self.execution_number = execution_number
+        self.output_dir = output_dir
+        self.journal = journal
+        self.resumed = {}
+        self.jobs = []
+        self.prompts = []
+        self.results = []
+        self.entries = []
+
+    def add_job(self, func, args, estimated_tokens, label: str = "", prompt: str = "", cached: bool = False) -> int:
+        self.jobs.append((func, args, estimated_tokens))
+        self.prompts.append((label, prompt, cached))
+        return len(self.jobs) - 1
+
+    def pending_jobs(self) -> list:
+        return self.jobs[len(self.results):]
+
+    def result(self, entry):
+        """Result of an entry: the job's result, or its item for batch entries."""
+        _, job_index, position = entry
+        result = self.results[job_index]
+        return result if position is None or isinstance(result, Exception) else result[position]
+
+
+def run_lanes(lanes: list, limiter, workers_per_lane: int, usage_of=None, largest_first: bool = False,
+              recorder=None) -> dict:
+    """
+    Runs the pending jobs of all lanes side by side, each lane on its own
+    RequestScheduler of workers_per_lane threads, all sharing `limiter` (and the
+    span recorder, if any). Wall-clock time is that of the slowest lane rather than
+    the sum of all of them. Returns the summed scheduler statistics.
+    """
+    schedulers = {id(lane): RequestScheduler(limiter, workers_per_lane, usage_of=usage_of, recorder=recorder) for lane in lanes}
+
+    def run_lane(lane):
+        pending = lane.pending_jobs()
+        if pending:
+            logging.info(f"Lane '{lane.template_name}': running {len(pending)} jobs with {workers_per_lane} workers")
+            labels = [label for label, _, _ in lane.prompts[len(lane.results):]]
+            lane.results.extend(schedulers[id(lane)].map(pending, largest_first, labels))
+
+    with ThreadPoolExecutor(max_workers=max(1, len(lanes)), thread_name_prefix="template-lane") as executor:
+        list(executor.map(run_lane, lanes))
+
+    stats = {}
+    for scheduler in schedulers.values():
+        for name, value in scheduler.stats.items():
+            stats[name] = stats.get(name, 0) + value
+    return stats
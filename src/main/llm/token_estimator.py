@@ -0,0 +1,199 @@
+import os
+import json
+import logging
+
+from llm_scheduler import estimate_tokens
+
+PROMPT_PLACEHOLDER = "YOUR SQL QUERY HERE" # As in lineage_extractor_v2
+# Fewer samples than this and the default ~4 characters/token is used instead of a fit
+MIN_CALIBRATION_SAMPLES = 5
+
+
+def fit_line(points: list) -> tuple:
+    """Least-squares fit y = slope * x + intercept over [(x, y), ...]. Returns (slope, intercept)."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x: # All prompts the same length: a plain ratio is all we can fit
+        return (mean_y / mean_x if mean_x else 0.0), 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    return slope, mean_y - slope * mean_x
+
+
+class TokenEstimator:
+    """
+    Predicts the prompt and answer tokens of a prompt from its length in characters
+    with two straight lines (tokens = slope * chars + intercept) fitted on the usage
+    records of earlier runs. Uncalibrated it falls back to ~4 characters per token
+    and predicts no answer tokens.
+    """
+
+    def __init__(self, prompt_fit: tuple = None, answer_fit: tuple = None, samples: int = 0):
+        self.prompt_fit = prompt_fit
+        self.answer_fit = answer_fit
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, samples: list) -> "TokenEstimator":
+        """samples: [(prompt_chars, query_tokens_used, answer_tokens_used), ...]."""
+        samples = [s for s in samples if s[0] and s[1] is not None]
+        if len(samples) < MIN_CALIBRATION_SAMPLES:
+            logging.info(f"Only {len(samples)} usage records, using the default ~4 characters/token estimate")
+            return cls(samples=len(samples))
+        prompt_fit = fit_line([(chars, query) for chars, query, _ in samples])
+        if prompt_fit[0] <= 0: # Longer prompts must cost more tokens; anything else is noise
+            logging.warning(f"Usage records fit a non-positive {prompt_fit[0]:.4f} tokens/character, using the default ~4 characters/token estimate")
+            return cls(samples=len(samples))
+        answers = [(chars, answer) for chars, _, answer in samples if answer is not None]
+        return cls(
+            prompt_fit=prompt_fit,
+            answer_fit=fit_line(answers) if len(answers) >= MIN_CALIBRATION_SAMPLES else None,
+            samples=len(samples),
+        )
+
+    def prompt_tokens(self, prompt: str) -> int:
+        if self.prompt_fit is None or self.prompt_fit[0] <= 0:
+            return estimate_tokens(prompt)
+        slope, intercept = self.prompt_fit
+        return max(1, round(slope * len(prompt) + intercept))
+
+    def answer_tokens(self, prompt: str) -> int:
+        if self.answer_fit is None:
+            return 0
+        slope, intercept = self.answer_fit
+        return max(0, round(slope * len(prompt) + intercept))
+
+    def describe(self) -> str:
+        if self.prompt_fit is None or self.prompt_fit[0] <= 0:
+            return f"default ~4 characters/token ({self.samples} usage records)"
+        slope, intercept = self.prompt_fit
+        return f"{1 / slope:.2f} characters/token + {intercept:.0f} tokens, fitted on {self.samples} usage records"
+
+
+def find_template(templates_dir: str, template_name: str):
+    """Path of the template file whose name without extension is template_name, or None."""
+    if not os.path.isdir(templates_dir):
+        return None
+    for filename in os.listdir(templates_dir):
+        if os.path.splitext(filename)[0] == template_name:
+            return os.path.join(templates_dir, filename)
+    return None
+
+
+def collect_usage_samples(base_output_dir: str, templates_dir: str, sql_files_dir: str) -> list:
+    """
+    Reads every <template>/<execution>/_metadata_run.json under base_output_dir and
+    returns (prompt_chars, query_tokens_used, answer_tokens_used) per single-script
+    prompt. Records from before prompt_chars was stored get their length from the
+    current template and SQL file; records whose files are gone are left out. Batch
+    items are left out too, their per-script usage is apportioned, not measured.
+    """
+    samples = []
+    template_lengths = {}
+    if not os.path.isdir(base_output_dir):
+        return samples
+    for template_name in sorted(os.listdir(base_output_dir)):
+        template_dir = os.path.join(base_output_dir, template_name)
+        if not os.path.isdir(template_dir):
+            continue
+        for execution in sorted(os.listdir(template_dir)):
+            metadata_path = os.path.join(template_dir, execution, "_metadata_run.json")
+            if not os.path.isfile(metadata_path):
+                continue
+            try:
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    items = json.load(f).get("individual_prompts_metadata", [])
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Skipping unreadable metadata file {metadata_path}: {e}")
+                continue
+            for item in items:
+                usage = item.get("usage") or {}
+                details = item.get("prompt_details") or {}
+                if item.get("batch") or usage.get("query_tokens_used") is None:
+                    continue
+                prompt_chars = details.get("prompt_chars")
+                if prompt_chars is None:
+                    prompt_chars = rebuilt_prompt_chars(template_name, details.get("sql_file_name"), templates_dir, sql_files_dir, template_lengths)
+                if prompt_chars:
+                    samples.append((prompt_chars, usage["query_tokens_used"], usage.get("answer_tokens_used")))
+    return samples
+
+
+def rebuilt_prompt_chars(template_name: str, sql_file_name: str, templates_dir: str, sql_files_dir: str, template_lengths: dict):
+    """Length of the prompt a template and SQL file give today, or None if either is missing."""
+    if template_name not in template_lengths:
+        template_path = find_template(templates_dir, template_name)
+        template_lengths[template_name] = None
+        if template_path:
+            with open(template_path, "r", encoding="utf-8") as f:
+                template_content = f.read()
+            template_lengths[template_name] = len(template_content) - (len(PROMPT_PLACEHOLDER) if PROMPT_PLACEHOLDER in template_content else 0)
+    sql_path = os.path.join(sql_files_dir, f"{sql_file_name}.sql")
+    if template_lengths[template_name] is None or not sql_file_name or not os.path.isfile(sql_path):
+        return None
+    with open(sql_path, "r", encoding="utf-8") as f:
+        return template_lengths[template_name] + len(f.read())
+
+
+def calibrated_estimator(base_output_dir: str, templates_dir: str, sql_files_dir: str) -> TokenEstimator:
+    """Fits a TokenEstimator on all usage records found under base_output_dir."""
+    estimator = TokenEstimator.fit(collect_usage_samples(base_output_dir, templates_dir, sql_files_dir))
+    logging.info(f"Token estimator: {estimator.describe()}")
+    return estimator
+
+
+def preflight_report(prompts: list, estimator: TokenEstimator, prompt_token_budget: int,
+                     input_price_per_million: float, output_price_per_million: float,
+                     requests_per_minute: float, tokens_per_minute: float,
+                     workers: int, seconds_per_call: float) -> dict:
+    """
+    Predicts a run before anything is sent. prompts: [(label, prompt text, cached), ...];
+    cached prompts cost nothing and take no quota. Returns the predicted calls, tokens,
+    cost (USD) and duration (the slowest of the request quota, the token quota and
+    calls * seconds_per_call spread over the workers), and the prompts over budget.
+    """
+    calls = 0
+    prompt_tokens = 0
+    answer_tokens = 0
+    over_budget = []
+    for label, prompt, cached in prompts:
+        predicted = estimator.prompt_tokens(prompt)
+        if predicted > prompt_token_budget:
+            over_budget.append((label, predicted))
+        if cached:
+            continue
+        calls += 1
+        prompt_tokens += predicted
+        answer_tokens += estimator.answer_tokens(prompt)
+    total_tokens = prompt_tokens + answer_tokens
+    duration = max(
+        calls / requests_per_minute * 60 if requests_per_minute else 0,
+        total_tokens / tokens_per_minute * 60 if tokens_per_minute else 0,
+        calls * seconds_per_call / max(1, workers),
+    )
+    return {
+        "prompts": len(prompts),
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "answer_tokens": answer_tokens,
+        "cost_usd": round(prompt_tokens / 1e6 * input_price_per_million + answer_tokens / 1e6 * output_price_per_million, 4),
+        "duration_seconds": round(duration, 1),
+        "over_budget": sorted(over_budget, key=lambda item: -item[1]),
+        "estimator": estimator.describe(),
+    }
+
+
+def print_preflight_report(report: dict, prompt_token_budget: int) -> None:
+    print("Preflight Estimate:")
+    print(f"  Token model: {report['estimator']}")
+    print(f"  Prompts: {report['prompts']} ({report['calls']} API calls, the rest cached)")
+    print(f"  Predicted prompt tokens: {report['prompt_tokens']}")
+    print(f"  Predicted answer tokens: {report['answer_tokens']}")
+    print(f"  Predicted cost: ${report['cost_usd']:.4f}")
+    minutes, seconds = divmod(report["duration_seconds"], 60)
+    print(f"  Predicted duration: {int(minutes)} minutes {seconds:.0f} seconds")
+    if report["over_budget"]:
+        print(f"\nPrompts over the {prompt_token_budget} token budget:")
+        for label, tokens in report["over_budget"]:
+            print(f"  {label}: ~{tokens} tokens")